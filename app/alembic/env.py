@@ -13,6 +13,8 @@ from middleware.apps.admin.models import metadata as auth_metadata
 from middleware.apps.product.models import metadata as product_metadata
 from middleware.apps.feedback.models import metadata as feedback_metadata
 from middleware.apps.order.models import metadata as order_metadata
+from middleware.apps.outbox.models import metadata as outbox_metadata
+from middleware.apps.invalidation.models import metadata as invalidation_metadata
 from middleware.apps import metadata
 asyncio.run(setup())
 # Set up the path and configuration
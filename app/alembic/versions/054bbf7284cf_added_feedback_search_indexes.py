@@ -0,0 +1,30 @@
+"""added feedback search indexes
+
+Revision ID: 054bbf7284cf
+Revises: 282754d377f3
+Create Date: 2026-10-18 21:12:56.048391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '054bbf7284cf'
+down_revision: Union[str, None] = '282754d377f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_feedbacks_email_prefix', 'feedbacks', [sa.text('lower(email) text_pattern_ops')], unique=False)
+    op.create_index('ix_feedbacks_fullname_prefix', 'feedbacks', [sa.text('lower(fullname) text_pattern_ops')], unique=False)
+    op.create_index('ix_feedbacks_description_search', 'feedbacks', [sa.text("to_tsvector('simple', description)")], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_feedbacks_description_search', table_name='feedbacks')
+    op.drop_index('ix_feedbacks_fullname_prefix', table_name='feedbacks')
+    op.drop_index('ix_feedbacks_email_prefix', table_name='feedbacks')
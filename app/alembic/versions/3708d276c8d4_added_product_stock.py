@@ -0,0 +1,39 @@
+"""added product stock
+
+Revision ID: 3708d276c8d4
+Revises: 9b6efacc31e1
+Create Date: 2026-10-18 10:12:41.318042
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3708d276c8d4'
+down_revision: Union[str, None] = '9b6efacc31e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('products', sa.Column('stock', sa.Integer(), nullable=True))
+    op.add_column('products', sa.Column('stock_stripes', sa.Integer(), server_default='0', nullable=False))
+    op.create_check_constraint('ck_products_stock_positive', 'products', 'stock >= 0')
+    op.create_table('product_stock_stripes',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('stripe', sa.Integer(), nullable=False),
+    sa.Column('stock', sa.Integer(), nullable=False),
+    sa.CheckConstraint('stock >= 0', name='ck_product_stock_stripes_stock_positive'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'stripe')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('product_stock_stripes')
+    op.drop_constraint('ck_products_stock_positive', 'products', type_='check')
+    op.drop_column('products', 'stock_stripes')
+    op.drop_column('products', 'stock')
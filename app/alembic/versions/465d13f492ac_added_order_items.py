@@ -0,0 +1,47 @@
+"""added order items
+
+Revision ID: 465d13f492ac
+Revises: 67c95e0a38a2
+Create Date: 2026-10-18 16:41:09.512307
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '465d13f492ac'
+down_revision: Union[str, None] = '67c95e0a38a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column('orders', 'product_id', existing_type=sa.Integer(), nullable=True)
+    op.alter_column('orders', 'price', existing_type=sa.Float(), nullable=True)
+    op.alter_column('orders', 'quantity', existing_type=sa.Integer(), nullable=True)
+    op.create_table('order_items',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('order_created_at', sa.DateTime(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('total_price', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['order_id', 'order_created_at'], ['orders.id', 'orders.created_at'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_order_items_order', 'order_items', ['order_id', 'order_created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_order_items_order', table_name='order_items')
+    op.drop_table('order_items')
+    # Headers of multi-line orders have no product, they can not be kept
+    op.execute("DELETE FROM orders WHERE product_id IS NULL")
+    op.alter_column('orders', 'quantity', existing_type=sa.Integer(), nullable=False)
+    op.alter_column('orders', 'price', existing_type=sa.Float(), nullable=False)
+    op.alter_column('orders', 'product_id', existing_type=sa.Integer(), nullable=False)
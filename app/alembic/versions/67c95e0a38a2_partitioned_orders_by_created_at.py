@@ -0,0 +1,92 @@
+"""partitioned orders by created_at
+
+Revision ID: 67c95e0a38a2
+Revises: 3708d276c8d4
+Create Date: 2026-10-18 14:03:27.905114
+
+"""
+import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '67c95e0a38a2'
+down_revision: Union[str, None] = '3708d276c8d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Monthly partitions created ahead of time, the rest is done by
+# python -m middleware.apps.order.partitions create
+MONTHS_AHEAD = 3
+
+
+def _month_start(value: datetime.date, shift: int = 0) -> datetime.date:
+    month = value.year * 12 + value.month - 1 + shift
+    return datetime.date(month // 12, month % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE orders RENAME TO orders_legacy")
+    op.execute("ALTER TABLE orders_legacy RENAME CONSTRAINT orders_pkey TO orders_legacy_pkey")
+    op.execute("ALTER TABLE orders_legacy RENAME CONSTRAINT orders_product_id_fkey TO orders_legacy_product_id_fkey")
+    op.execute("""
+        CREATE TABLE orders (
+            id INTEGER NOT NULL DEFAULT nextval('orders_id_seq'::regclass),
+            product_id INTEGER NOT NULL,
+            price DOUBLE PRECISION NOT NULL,
+            quantity INTEGER NOT NULL,
+            total_price DOUBLE PRECISION NOT NULL,
+            customer_name VARCHAR(255) NOT NULL,
+            delivery BOOLEAN NOT NULL,
+            note TEXT,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT timezone('utc', now()),
+            CONSTRAINT orders_pkey PRIMARY KEY (id, created_at),
+            CONSTRAINT orders_product_id_fkey FOREIGN KEY (product_id) REFERENCES products (id)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("CREATE TABLE orders_default PARTITION OF orders DEFAULT")
+
+    today = datetime.datetime.utcnow().date()
+    for shift in range(MONTHS_AHEAD + 1):
+        start, end = _month_start(today, shift), _month_start(today, shift + 1)
+        op.execute(
+            f"CREATE TABLE orders_y{start.year}m{start.month:02d} PARTITION OF orders "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+
+    # Existing orders have no creation time, they are put into the current month
+    op.execute("""
+        INSERT INTO orders (id, product_id, price, quantity, total_price, customer_name, delivery, note, created_at)
+        SELECT id, product_id, price, quantity, total_price, customer_name, delivery, note, timezone('utc', now())
+        FROM orders_legacy
+    """)
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY orders.id")
+    op.drop_table('orders_legacy')
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE orders RENAME TO orders_partitioned")
+    op.execute("ALTER TABLE orders_partitioned RENAME CONSTRAINT orders_pkey TO orders_partitioned_pkey")
+    op.create_table('orders',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('orders_id_seq'::regclass)"), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('price', sa.Float(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('total_price', sa.Float(), nullable=False),
+    sa.Column('customer_name', sa.String(length=255), nullable=False),
+    sa.Column('delivery', sa.Boolean(), nullable=False),
+    sa.Column('note', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('id')
+    )
+    op.execute("""
+        INSERT INTO orders (id, product_id, price, quantity, total_price, customer_name, delivery, note)
+        SELECT id, product_id, price, quantity, total_price, customer_name, delivery, note
+        FROM orders_partitioned
+    """)
+    op.execute("ALTER SEQUENCE orders_id_seq OWNED BY orders.id")
+    op.execute("DROP TABLE orders_partitioned")
+    op.create_foreign_key('orders_product_id_fkey', 'orders', 'products', ['product_id'], ['id'])
@@ -0,0 +1,30 @@
+"""added cache versions
+
+Revision ID: 8e3f1a6c2d47
+Revises: c41d7e2a9b85
+Create Date: 2026-10-19 10:12:41.530918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e3f1a6c2d47'
+down_revision: Union[str, None] = 'c41d7e2a9b85'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('cache_versions',
+    sa.Column('cache', sa.String(length=100), nullable=False),
+    sa.Column('version', sa.BigInteger(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('cache')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('cache_versions')
@@ -0,0 +1,47 @@
+"""added query indexes
+
+Revision ID: d5a92c7e4f18
+Revises: 8e3f1a6c2d47
+Create Date: 2026-10-19 11:03:27.884612
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a92c7e4f18'
+down_revision: Union[str, None] = '8e3f1a6c2d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY does not lock writes but cannot run in a transaction.
+    # A failed build leaves an invalid index, drop it and run the migration again.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_products_type', 'products', ['type'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_products_is_on_sale', 'products', ['id'], unique=False, postgresql_where=sa.text('is_on_sale'), postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_order_items_product_id', 'order_items', ['product_id'], unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+        # Partitioned tables have no CONCURRENTLY: the index of orders is created invalid on the
+        # table only, the index of every partition concurrently and attached, which makes it valid.
+        # Partitions created later get it from orders.
+        op.execute('CREATE INDEX IF NOT EXISTS ix_orders_product_id ON ONLY orders (product_id)')
+        partitions = op.get_bind().execute(sa.text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'orders'::regclass ORDER BY c.relname"
+        )).scalars().all()
+        for partition in partitions:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_product_id_idx ON {partition} (product_id)')
+            op.execute(f'ALTER INDEX ix_orders_product_id ATTACH PARTITION {partition}_product_id_idx')
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_orders_product_id', table_name='orders', if_exists=True)
+        op.drop_index('ix_order_items_product_id', table_name='order_items', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_products_is_on_sale', table_name='products', postgresql_concurrently=True, if_exists=True)
+        op.drop_index('ix_products_type', table_name='products', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,63 @@
+"""added customers
+
+Revision ID: ed5897cb2a53
+Revises: 465d13f492ac
+Create Date: 2026-10-18 18:22:47.630518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ed5897cb2a53'
+down_revision: Union[str, None] = '465d13f492ac'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Orders backfilled per transaction
+BATCH_SIZE = 10_000
+
+
+def upgrade() -> None:
+    op.create_table('customers',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.add_column('orders', sa.Column('customer_id', sa.Integer(), nullable=True))
+
+    # Every batch is committed on its own, so the backfill never holds
+    # row locks of more than BATCH_SIZE orders
+    connection = op.get_bind()
+    with op.get_context().autocommit_block():
+        low, high = connection.execute(sa.text("SELECT min(id), max(id) FROM orders")).one()
+        if low is not None:
+            for start in range(low, high + 1, BATCH_SIZE):
+                bounds = {'start': start, 'end': start + BATCH_SIZE}
+                connection.execute(sa.text("""
+                    INSERT INTO customers (name)
+                    SELECT DISTINCT customer_name FROM orders
+                    WHERE id >= :start AND id < :end
+                    ON CONFLICT (name) DO NOTHING
+                """), bounds)
+                connection.execute(sa.text("""
+                    UPDATE orders SET customer_id = customers.id
+                    FROM customers
+                    WHERE customers.name = orders.customer_name
+                      AND orders.id >= :start AND orders.id < :end
+                      AND orders.customer_id IS NULL
+                """), bounds)
+
+    op.create_foreign_key('orders_customer_id_fkey', 'orders', 'customers', ['customer_id'], ['id'])
+    op.create_index('ix_orders_customer_id', 'orders', ['customer_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_orders_customer_id', table_name='orders')
+    op.drop_constraint('orders_customer_id_fkey', 'orders', type_='foreignkey')
+    op.drop_column('orders', 'customer_id')
+    op.drop_table('customers')
@@ -0,0 +1,6 @@
+__doc__ = """
+    Benchmarks for the Admin Shop API. Run them from the app directory
+    against a database migrated with alembic, e.g.
+
+        python -m benchmarks.stock_reservation --buyers 300
+"""
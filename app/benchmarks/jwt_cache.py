@@ -0,0 +1,73 @@
+"""
+Benchmark of the authentication overhead of a protected request.
+
+Calls get_current_user with the same token the way a signed-in admin's
+requests do, once with the decoded-token cache and once with a cache that
+keeps nothing. The admin is served from admin_cache and no token is revoked
+in both rounds, so the numbers are the token handling only and no database
+is needed, e.g.
+
+    python -m benchmarks.jwt_cache --requests 20000
+"""
+import argparse
+import asyncio
+import time
+
+from core import setup
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create argument parser for CLI
+    """
+    parser = argparse.ArgumentParser(description="Decoded token cache benchmark")
+    parser.add_argument("--requests", default=20000, type=int, help="authenticated requests per round")
+    parser.add_argument("--tokens", default=1, type=int, help="distinct tokens, requests cycle through them")
+    return parser
+
+
+async def run(requests: int, tokens: list, cached: bool) -> dict:
+    """
+    Run one benchmark round.
+    @params requests: number of authenticated requests.
+    @params tokens: tokens used by the requests.
+    @params cached: True to use the decoded token cache.
+    @return: dict with the results of the round.
+    """
+    from middleware.apps.admin import TOKEN_CACHE_SIZE, utils
+    from utils import TTLCache
+
+    utils.token_cache = TTLCache(utils.token_cache.ttl, TOKEN_CACHE_SIZE if cached else 0)
+    started = time.perf_counter()
+    for i in range(requests):
+        await utils.get_current_user(tokens[i % len(tokens)], None)
+    elapsed = time.perf_counter() - started
+    return {
+        'cached': cached,
+        'elapsed': elapsed,
+        'us_per_request': elapsed / requests * 1_000_000,
+        'hits': utils.token_cache.hits,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    await setup()
+
+    from middleware.apps.admin import utils
+    tokens = []
+    for admin_id in range(1, args.tokens + 1):
+        token, _ = utils.create_access_token(data={"sub": str(admin_id), "username": f"admin{admin_id}"})
+        tokens.append(token)
+        utils.admin_cache.set(admin_id, {'id': admin_id, 'username': f"admin{admin_id}"}, ttl=3600)
+
+    results = [await run(args.requests, tokens, cached) for cached in (False, True)]
+    for result in results:
+        print(
+            f"cache={'on ' if result['cached'] else 'off'} requests={args.requests} "
+            f"time={result['elapsed']:.3f}s auth={result['us_per_request']:.1f} us/request hits={result['hits']}"
+        )
+    print(f"speedup={results[0]['elapsed'] / results[1]['elapsed']:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(create_parser().parse_args()))
@@ -0,0 +1,132 @@
+"""
+Spike test of the database concurrency limit and the load shedding.
+
+An app with LoadSheddingMiddleware and two routes that hold their session
+for a pg_sleep() is hit by a burst of concurrent requests, in process with
+httpx. '/work/' is a normal route, '/orders/export/' matches
+LOW_PRIORITY_PATHS. The limit starts low and the statements are slower than
+DB_LIMIT_LATENCY_MS, so the queue grows past the budgets, e.g.
+
+    python -m benchmarks.load_shedding --requests 200 --sleep 0.05 --budget 300
+
+Low-priority requests should be shed first, every 503 carries Retry-After,
+and no slot may be left in use after the burst.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from collections import Counter
+
+from core import setup
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create argument parser for CLI
+    """
+    parser = argparse.ArgumentParser(description="Load shedding spike test")
+    parser.add_argument("--requests", default=200, type=int, help="concurrent requests of the burst")
+    parser.add_argument("--low-share", default=0.3, type=float, help="share of low-priority requests")
+    parser.add_argument("--sleep", default=0.05, type=float, help="seconds every request sleeps in the database")
+    parser.add_argument("--budget", default=300, type=float, help="queue budget in milliseconds")
+    return parser
+
+
+async def run(requests: int, low_share: float, sleep: float, budget: float) -> dict:
+    """
+    Send a burst of requests.
+    @params requests: number of concurrent requests.
+    @params low_share: share of requests to the low-priority route.
+    @params sleep: seconds every request holds its session in pg_sleep().
+    @params budget: queue budget in milliseconds.
+    @return: dict with status counts and latencies per route and the limiter state.
+    """
+    import httpx
+    from fastapi import Depends, FastAPI
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    from database.limiter import LoadSheddingMiddleware, db_limiter
+    from database.session import get_async_db
+
+    app = FastAPI()
+
+    async def work(db: AsyncSession = Depends(get_async_db)) -> dict:
+        await db.execute(text("SELECT pg_sleep(:seconds)"), {'seconds': sleep})
+        return {'ok': True}
+
+    app.add_api_route('/work/', work)
+    app.add_api_route('/orders/export/', work)
+    app.add_middleware(LoadSheddingMiddleware)
+
+    db_limiter.configure(
+        limit=db_limiter.min_limit,
+        min_limit=db_limiter.min_limit,
+        max_limit=db_limiter.max_limit,
+        latency_target_ms=min(db_limiter.latency_target_ms, sleep * 1000 / 2),
+        queue_budget_ms=budget
+    )
+    results = {'/work/': [], '/orders/export/': []}
+    retry_after_missing = 0
+    low_every = max(1, round(1 / low_share)) if low_share > 0 else 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://benchmark') as client:
+        async def call(i: int) -> None:
+            nonlocal retry_after_missing
+            path = '/orders/export/' if low_every and i % low_every == 0 else '/work/'
+            started = time.perf_counter()
+            response = await client.get(path)
+            results[path].append((response.status_code, time.perf_counter() - started))
+            if response.status_code == 503 and 'retry-after' not in response.headers:
+                retry_after_missing += 1
+
+        await asyncio.gather(*(call(i) for i in range(requests)))
+
+    routes = {}
+    for path, calls in results.items():
+        statuses = Counter(status for status, _ in calls)
+        served = sorted(seconds for status, seconds in calls if status == 200)
+        shed = sorted(seconds for status, seconds in calls if status == 503)
+        routes[path] = {
+            'requests': len(calls),
+            'statuses': dict(statuses),
+            'served_p50_ms': round(statistics.median(served) * 1000, 1) if served else None,
+            'shed_p50_ms': round(statistics.median(shed) * 1000, 1) if shed else None,
+        }
+    return {'routes': routes, 'retry_after_missing': retry_after_missing, 'limiter': db_limiter.stats()}
+
+
+async def main(args: argparse.Namespace) -> int:
+    await setup()
+
+    from database import connection
+
+    await connection.init_db()
+    connection.async_engine.echo = False
+
+    result = await run(args.requests, args.low_share, args.sleep, args.budget)
+    for path, route in result['routes'].items():
+        print(
+            f"{path:<16} requests={route['requests']} statuses={route['statuses']} "
+            f"served_p50={route['served_p50_ms']}ms shed_p50={route['shed_p50_ms']}ms"
+        )
+    limiter = result['limiter']
+    print(f"limiter: {limiter}")
+
+    shed_rate = {
+        path: route['statuses'].get(503, 0) / route['requests'] if route['requests'] else 0
+        for path, route in result['routes'].items()
+    }
+    failed = (
+        result['retry_after_missing'] > 0
+        or limiter['in_flight'] != 0
+        or shed_rate['/orders/export/'] < shed_rate['/work/']
+    )
+    print("FAILED" if failed else "ok")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(create_parser().parse_args())))
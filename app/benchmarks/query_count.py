@@ -0,0 +1,181 @@
+"""
+Number of SQL statements of the write paths of the managers.
+
+Creates, updates and deletes an admin, a product, a feedback and an order
+through their managers and counts the statements sent to the database by
+every call. Row writes are single INSERT/UPDATE/DELETE ... RETURNING
+statements, so a call is expected to send exactly the statements listed in
+EXPECTED; the script exits with status 1 if any call sends more, e.g.
+
+    python -m benchmarks.query_count
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, List
+
+from sqlalchemy import delete, event, select
+
+from core import setup
+
+# Statements per call. Order writes also reserve or release the stock of the product
+# (one UPDATE), a new order looks its customer up and creates it (SELECT and INSERT).
+EXPECTED = {
+    'admin.create': 1,
+    'admin.update': 1,
+    'admin.delete': 1,
+    'product.create': 1,
+    'product.update': 1,
+    'product.delete': 1,
+    'feedback.create': 1,
+    'feedback.update': 1,
+    'feedback.delete': 1,
+    'order.create': 4,
+    'order.delete': 2,
+}
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create argument parser for CLI
+    """
+    return argparse.ArgumentParser(description="Statements per manager write")
+
+
+@contextmanager
+def count_statements(engine) -> Iterator[List[str]]:
+    """
+    Collect the statements executed by an engine.
+    @params engine: async engine.
+    @return: list the statements are appended to.
+    """
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, 'before_cursor_execute', before_cursor_execute)
+
+
+async def run() -> dict:
+    """
+    Run every write once.
+    @return: dict of operation -> executed statements.
+    """
+    from database import connection
+    from middleware.apps.admin.manager import AdminManager
+    from middleware.apps.admin.models import Admin
+    from middleware.apps.admin.schemas import AdminCreateScheme, AdminUpdateScheme
+    from middleware.apps.feedback.manager import FeedBackManager
+    from middleware.apps.feedback.schemas import CreateFeedBackSchema, UpdateFeedBackSchema
+    from middleware.apps.order.manager import OrderManager
+    from middleware.apps.order.schemas import CreateOrderSchema
+    from middleware.apps.product.inventory import set_stock
+    from middleware.apps.product.manager import ProductManager
+    from middleware.apps.product.schemas import CreateProductSchema
+    from middleware.apps.order.models import Customer
+
+    suffix = uuid.uuid4().hex[:8]
+    results = {}
+
+    async def measure(operation: str, call) -> object:
+        async with connection.AsyncSessionLocal() as session:
+            with count_statements(connection.async_engine) as statements:
+                result = await call(session)
+        results[operation] = statements
+        return result
+
+    await measure('admin.create', lambda session: AdminManager(session).create_new_admin(
+        AdminCreateScheme(
+            name="Benchmark", surname="Benchmark", email=f"{suffix}@example.com",
+            phone="+70000000000", password="Passw0rd!x", username=f"bench{suffix}"
+        )
+    ))
+    async with connection.AsyncSessionLocal() as session:
+        admin_id = (await session.execute(select(Admin.id).where(Admin.username == f"bench{suffix}"))).scalar_one()
+    await measure('admin.update', lambda session: AdminManager(session).update_admin(
+        admin_id, AdminUpdateScheme(
+            name="Updated", surname="Benchmark", email=f"{suffix}@example.com",
+            phone="+70000000000", password="Passw0rd!y", username=f"bench{suffix}"
+        )
+    ))
+    await measure('admin.delete', lambda session: AdminManager(session).delete_admin(admin_id))
+
+    product = dict(
+        name=f"benchmark-{suffix}", smallDescription=None, description=None, application=None,
+        structure=None, price=10.0, type="benchmark", status=True, is_on_sale=False, sale_price=None, file=None
+    )
+    product = await measure('product.create', lambda session: ProductManager(session).create_new_product(
+        CreateProductSchema(**product)
+    ))
+    product_id = product['id']
+    async with connection.AsyncSessionLocal() as session:
+        await set_stock(session, product_id, 10)
+        await session.commit()
+
+    order = await measure('order.create', lambda session: OrderManager(session).create_order(
+        CreateOrderSchema(
+            product_id=product_id, price=10.0, quantity=1, total_price=10.0,
+            customer_name=f"benchmark-{suffix}", delivery=False, note=None
+        )
+    ))
+    await measure('order.delete', lambda session: OrderManager(session).delete_order_by_id(order['id']))
+
+    with tempfile.NamedTemporaryFile(suffix='.png') as image:
+        await measure('product.update', lambda session: ProductManager(session).update_product_by_id(
+            product_id, CreateProductSchema(**dict(product, name=f"benchmark-{suffix}-updated", file=None)), image.name
+        ))
+    await measure('product.delete', lambda session: ProductManager(session).delete_product(product_id))
+
+    feedback = dict(
+        fullname="Benchmark Benchmark Benchmark", email=f"{suffix}@example.com",
+        description="Statement count benchmark", phone="+70000000000"
+    )
+    feedback, _ = await measure('feedback.create', lambda session: FeedBackManager(session).create_feedback(
+        CreateFeedBackSchema(**feedback)
+    ))
+    await measure('feedback.update', lambda session: FeedBackManager(session).update_feedback_by_id(
+        feedback['id'], UpdateFeedBackSchema(**dict(feedback, description="Updated statement count benchmark"))
+    ))
+    await measure('feedback.delete', lambda session: FeedBackManager(session).delete_feedback_by_id(feedback['id']))
+
+    async with connection.AsyncSessionLocal() as session:
+        await session.execute(delete(Customer).where(Customer.name == f"benchmark-{suffix}"))
+        await session.commit()
+    return results
+
+
+async def main(args: argparse.Namespace) -> int:
+    await setup()
+
+    from database import connection
+    from utils import password_pool
+
+    await connection.init_db()
+    connection.async_engine.echo = False
+    try:
+        results = await run()
+    finally:
+        password_pool.shutdown()
+
+    failed = False
+    for operation, statements in results.items():
+        expected = EXPECTED[operation]
+        ok = len(statements) <= expected
+        failed = failed or not ok
+        print(f"{operation:<16} statements={len(statements)} expected={expected} {'ok' if ok else 'FAILED'}")
+        if not ok:
+            for statement in statements:
+                print(f"    {' '.join(statement.split())[:120]}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(create_parser().parse_args())))
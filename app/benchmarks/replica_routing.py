@@ -0,0 +1,138 @@
+"""
+Check of the read replica routing against two local databases.
+
+Both databases are migrated with alembic but not replicated, so a row
+written to the primary is missing on the "replica" and every read shows
+which database served it. Sessions come from get_async_db like in the
+endpoints, e.g.
+
+    createdb main_replica && DATABASE_URL=... alembic upgrade head
+    DATABASE_REPLICA_URL=postgresql+asyncpg://postgres@127.0.0.1:5432/main_replica \\
+        python -m benchmarks.replica_routing --sticky 0.5
+
+The script exits with status 1 if a statement went to the wrong database.
+"""
+import argparse
+import asyncio
+import sys
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+from sqlalchemy import event
+from starlette.requests import Request
+
+from core import setup
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create argument parser for CLI
+    """
+    parser = argparse.ArgumentParser(description="Read replica routing check")
+    parser.add_argument("--sticky", default=0.5, type=float, help="sticky primary window in seconds")
+    return parser
+
+
+def make_request(method: str, token: str) -> Request:
+    """
+    Create a request of a client.
+    @params method: HTTP method.
+    @params token: bearer token identifying the client.
+    @return: Request object.
+    """
+    return Request({
+        'type': 'http',
+        'method': method,
+        'path': '/',
+        'headers': [(b'authorization', f"Bearer {token}".encode())],
+        'client': ('127.0.0.1', 0),
+    })
+
+
+async def run(sticky: float) -> list:
+    """
+    Run the routing checks.
+    @params sticky: sticky primary window in seconds.
+    @return: list of (check, expected database, statements per database, result).
+    """
+    from database import connection
+    from database.routing import sticky_clients
+    from database.session import get_async_db
+    from middleware.apps.feedback.manager import FeedBackManager
+    from middleware.apps.feedback.schemas import CreateFeedBackSchema
+
+    sticky_clients.ttl = sticky
+    counts: Dict[str, int] = {}
+
+    def counter(name: str):
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            counts[name] += 1
+        return before_cursor_execute
+
+    event.listen(connection.async_engine.sync_engine, 'before_cursor_execute', counter('primary'))
+    event.listen(connection.replica_engine.sync_engine, 'before_cursor_execute', counter('replica'))
+
+    @asynccontextmanager
+    async def request_session(method: str, token: str) -> AsyncIterator[FeedBackManager]:
+        counts.update(primary=0, replica=0)
+        # Entered like FastAPI enters the dependency, the unit of work commits when the block exits
+        async with asynccontextmanager(get_async_db)(make_request(method, token)) as session:
+            yield FeedBackManager(session)
+
+    results = []
+    writer, reader = uuid.uuid4().hex, uuid.uuid4().hex
+    suffix = uuid.uuid4().hex[:8]
+
+    async with request_session('POST', writer) as manager:
+        feedback, _ = await manager.create_feedback(CreateFeedBackSchema(
+            fullname="Replica Routing Check", email=f"{suffix}@example.com",
+            description="Replica routing check", phone="+70000000000"
+        ))
+    results.append(('POST writes', 'primary', dict(counts), feedback is not None))
+
+    async with request_session('GET', writer) as manager:
+        found = await manager.get_feedback_by_id(feedback['id'])
+    results.append(('GET of the writer in the sticky window', 'primary', dict(counts), found is not None))
+
+    async with request_session('GET', reader) as manager:
+        found = await manager.get_feedback_by_id(feedback['id'])
+    results.append(('GET of another client', 'replica', dict(counts), found is None))
+
+    await asyncio.sleep(sticky)
+    async with request_session('GET', writer) as manager:
+        found = await manager.get_feedback_by_id(feedback['id'])
+    results.append(('GET of the writer after the window', 'replica', dict(counts), found is None))
+
+    async with request_session('DELETE', reader) as manager:
+        deleted = await manager.delete_feedback_by_id(feedback['id'])
+    results.append(('DELETE writes', 'primary', dict(counts), deleted))
+    return results
+
+
+async def main(args: argparse.Namespace) -> int:
+    await setup()
+
+    from database import connection
+
+    await connection.init_db()
+    if connection.replica_engine is None:
+        print("DATABASE_REPLICA_URL is not set")
+        return 1
+    for engine in (connection.async_engine, connection.replica_engine):
+        engine.echo = False
+
+    failed = False
+    for check, expected, counts, result in await run(args.sticky):
+        other = 'replica' if expected == 'primary' else 'primary'
+        ok = result and counts[expected] > 0 and counts[other] == 0
+        failed = failed or not ok
+        print(
+            f"{check:<40} expected={expected:<8} primary={counts['primary']} replica={counts['replica']} "
+            f"{'ok' if ok else 'FAILED'}"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(create_parser().parse_args())))
@@ -0,0 +1,127 @@
+"""
+Benchmark of stock reservations with many concurrent buyers of one product.
+
+Every buyer creates an order through OrderManager.create_order with its own
+session, so the numbers include the whole reservation + insert transaction.
+The benchmark is run once per stripes value, e.g.
+
+    python -m benchmarks.stock_reservation --buyers 300 --stock 250 --stripes 0 8
+
+and checks that the product was never oversold.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import delete
+
+from core import setup
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create argument parser for CLI
+    """
+    parser = argparse.ArgumentParser(description="Stock reservation benchmark")
+    parser.add_argument("--buyers", default=300, type=int, help="number of concurrent buyers")
+    parser.add_argument("--stock", default=None, type=int, help="initial stock, defaults to buyers * quantity")
+    parser.add_argument("--quantity", default=1, type=int, help="quantity bought by every buyer")
+    parser.add_argument("--stripes", default=[0, 8], type=int, nargs="+", help="stripes values to compare")
+    return parser
+
+
+async def run(buyers: int, stock: int, quantity: int, stripes: int) -> dict:
+    """
+    Run one benchmark round.
+    @params buyers: number of concurrent buyers.
+    @params stock: initial stock of the product.
+    @params quantity: quantity bought by every buyer.
+    @params stripes: number of stock stripes of the product.
+    @return: dict with the results of the round.
+    """
+    from database import connection
+    from middleware.apps.order.manager import OrderManager
+    from middleware.apps.order.models import Order
+    from middleware.apps.order.schemas import CreateOrderSchema
+    from middleware.apps.product.inventory import OutOfStockError, get_stock, set_stock
+    from middleware.apps.product.models import Product
+
+    async with connection.AsyncSessionLocal() as session:
+        product = Product(
+            name=f"benchmark-{uuid.uuid4().hex}",
+            smallDescription=None,
+            description=None,
+            application=None,
+            structure=None,
+            price=10.0,
+            type="benchmark",
+            status=True,
+            is_on_sale=False,
+            sale_price=None,
+            file=None
+        )
+        session.add(product)
+        await session.flush()
+        await set_stock(session, product.id, stock, stripes)
+        await session.commit()
+        product_id = product.id
+
+    async def buy() -> bool:
+        order = CreateOrderSchema(
+            product_id=product_id,
+            price=10.0,
+            quantity=quantity,
+            total_price=10.0 * quantity,
+            customer_name="benchmark",
+            delivery=False,
+            note=None
+        )
+        async with connection.AsyncSessionLocal() as session:
+            try:
+                await OrderManager(session).create_order(order)
+            except OutOfStockError:
+                return False
+        return True
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(buy() for _ in range(buyers)))
+    elapsed = time.perf_counter() - started
+
+    async with connection.AsyncSessionLocal() as session:
+        left = (await get_stock(session, product_id))['stock']
+        await session.execute(delete(Order).where(Order.product_id == product_id))
+        await session.execute(delete(Product).where(Product.id == product_id))
+        await session.commit()
+
+    sold = sum(results)
+    return {
+        'stripes': stripes,
+        'elapsed': elapsed,
+        'orders_per_second': buyers / elapsed,
+        'sold': sold,
+        'rejected': buyers - sold,
+        'stock_left': left,
+        'oversold': left < 0 or sold * quantity + left != stock,
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    await setup()
+
+    from database.connection import init_db
+    await init_db()
+
+    stock = args.stock if args.stock is not None else args.buyers * args.quantity
+    for stripes in args.stripes:
+        result = await run(args.buyers, stock, args.quantity, stripes)
+        print(
+            f"stripes={result['stripes']:<3} buyers={args.buyers} "
+            f"time={result['elapsed']:.3f}s throughput={result['orders_per_second']:.1f} orders/s "
+            f"sold={result['sold']} rejected={result['rejected']} stock_left={result['stock_left']} "
+            f"oversold={result['oversold']}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main(create_parser().parse_args()))
@@ -1,5 +1,6 @@
 from typing import (
     List, 
+    Optional,
     Union,
     Tuple
 )
@@ -16,6 +17,7 @@ from functions.async_logger import AsyncLogger
 
 __all__ = [
     "setup_middleware", 
+    "DatabaseSettings",
     "Settings"
 ]
 
@@ -101,7 +103,37 @@ async def setup_endpoints(
     
     return True
 
-class Settings(BaseSettings):
+class DatabaseSettings(BaseSettings):
+    """
+    Engine and connection pool settings, every field has a default so the
+    engine can be created from DATABASE_URL alone, e.g. DB_POOL_SIZE=20 in .env.
+    """
+    db_pool_size: int = 5                 # connections kept open in the pool
+    db_max_overflow: int = 10             # connections opened above db_pool_size under load
+    db_pool_timeout: float = 30           # seconds to wait for a free connection
+    db_pool_recycle: int = 1800           # seconds after which a connection is reopened, -1 never
+    db_pool_pre_ping: bool = True         # check a connection before it is handed out
+    db_statement_cache_size: int = 100    # prepared statements per connection, 0 behind pgbouncer
+    db_echo: bool = False                 # log every SQL statement
+    db_pool_prewarm: int = 5              # connections opened on startup, at most db_pool_size
+    database_replica_url: Optional[str] = None  # read replica, reads of GET requests go there
+    db_replica_sticky_seconds: float = 5  # reads of a client go to the primary for this long after a write
+    db_slow_query_ms: float = 200         # statements taking this long are recorded and explained
+    db_slow_query_log_size: int = 200     # slow statements kept for GET /admins/slow-queries/
+    db_limit_min: int = 2                 # lowest concurrency limit of database sessions
+    db_limit_latency_ms: float = 50       # mean statement time above which the concurrency limit is lowered
+    db_queue_budget_ms: float = 500       # queue wait of a request before it is answered 503
+    db_invalidation: str = 'notify'       # cache invalidation across workers: notify, poll (no LISTEN) or off
+
+    class Config:
+        """
+        Config class for DatabaseSettings.
+        """
+        env_file = ".env"
+        extra = "ignore"
+
+
+class Settings(DatabaseSettings):
     """
     Settings for the Admin Shop API application.
     """
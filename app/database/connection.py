@@ -1,16 +1,48 @@
+import asyncio
 import logging
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.exc import SQLAlchemyError
 
 from core import cfg
+from core.settings import DatabaseSettings
+from database.instrumentation import instrument_engine
+from database.limiter import LimitedSession, db_limiter
+from database.routing import RoutingSession, sticky_clients
+from database.slow_queries import slow_query_log
 
 async_engine = None
+replica_engine = None
 AsyncSessionLocal = None
 Base = declarative_base()
 
+
+def create_engine(url: str, settings: DatabaseSettings) -> AsyncEngine:
+    """
+    Create an async engine with the pool settings.
+    @params url: database URL.
+    @params settings: engine and pool settings.
+    @return: AsyncEngine object.
+    """
+    return create_async_engine(
+        url,
+        echo=settings.db_echo,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args={
+            # asyncpg's own cache and the cache of the SQLAlchemy dialect
+            'statement_cache_size': settings.db_statement_cache_size,
+            'prepared_statement_cache_size': settings.db_statement_cache_size,
+        }
+    )
+
+
 async def init_db():
-    global async_engine, AsyncSessionLocal
+    global async_engine, replica_engine, AsyncSessionLocal
 
     logging.info("Initializing the database...")
 
@@ -18,13 +50,32 @@ async def init_db():
         try:
             # Create async engine
             logging.info(f"Creating async engine with URL: {cfg['DATABASE_URL']}")
-            async_engine = create_async_engine(cfg["DATABASE_URL"], echo=True)
+            settings = DatabaseSettings()
+            async_engine = create_engine(cfg["DATABASE_URL"], settings)
+            if settings.database_replica_url:
+                logging.info("Creating async engine of the read replica")
+                replica_engine = create_engine(settings.database_replica_url, settings)
+            sticky_clients.ttl = settings.db_replica_sticky_seconds
+            slow_query_log.threshold_ms = settings.db_slow_query_ms
+            slow_query_log.resize(settings.db_slow_query_log_size)
+            db_limiter.configure(
+                limit=settings.db_pool_size,
+                min_limit=settings.db_limit_min,
+                max_limit=settings.db_pool_size + max(settings.db_max_overflow, 0),
+                latency_target_ms=settings.db_limit_latency_ms,
+                queue_budget_ms=settings.db_queue_budget_ms
+            )
+            for engine in (async_engine, replica_engine):
+                if engine is not None:
+                    instrument_engine(engine)
 
             # Create session factory
             logging.info("Creating session factory...")
             AsyncSessionLocal = sessionmaker(
                 bind=async_engine,
-                class_=AsyncSession,
+                class_=LimitedSession,
+                sync_session_class=RoutingSession,
+                info={'replica_bind': replica_engine.sync_engine if replica_engine is not None else None},
                 autocommit=False,
                 autoflush=False,
                 expire_on_commit=False
@@ -38,3 +89,40 @@ async def init_db():
     if AsyncSessionLocal is None:
         logging.error("AsyncSessionLocal is still None after init_db().")
         raise RuntimeError("AsyncSessionLocal was not properly initialized")
+
+
+async def prewarm_pool(connections: int = None) -> int:
+    """
+    Open pool connections of the primary and the replica ahead of the first requests,
+    they are returned to the pool idle.
+    @params connections: number of connections per engine, DB_POOL_PREWARM if None. At most the pool size.
+    @return: number of opened connections.
+    """
+    if async_engine is None:
+        await init_db()
+    if connections is None:
+        connections = DatabaseSettings().db_pool_prewarm
+
+    async def connect(engine: AsyncEngine) -> AsyncConnection:
+        connection = await engine.connect()
+        await connection.execute(text("SELECT 1"))
+        return connection
+
+    opened_total = 0
+    for engine in (async_engine, replica_engine):
+        if engine is None:
+            continue
+        # All connections are held until every one is open, so none of them is reused
+        opened = await asyncio.gather(
+            *(connect(engine) for _ in range(max(0, min(connections, engine.pool.size())))),
+            return_exceptions=True
+        )
+        errors = [connection for connection in opened if isinstance(connection, BaseException)]
+        for connection in opened:
+            if not isinstance(connection, BaseException):
+                await connection.close()
+        if errors:
+            logging.error(f"Failed to open {len(errors)} database connections: {errors[0]}")
+        opened_total += len(opened) - len(errors)
+    logging.info(f"Opened {opened_total} database connections.")
+    return opened_total
@@ -0,0 +1,390 @@
+"""
+Index advisor.
+
+Proposes the missing indexes of the statements the database runs most:
+
+    python -m database.index_advisor
+    python -m database.index_advisor --top 100 --min-rows 1000 --json
+    python -m database.index_advisor --query 'SELECT * FROM products WHERE type = $1'
+
+The statements with the most execution time are read from
+pg_stat_statements and their generic plan is explained (PostgreSQL 16,
+EXPLAIN (GENERIC_PLAN)), nothing is executed. Every sequential scan of a
+table of at least --min-rows rows whose filter keeps at most
+INDEX_ADVISOR_MAX_SELECTIVITY of them is turned into an index: columns
+compared with = first, then one range column, boolean columns become the
+predicate of a partial index. Proposals an existing index already serves,
+by its first column or its predicate, are left out. Scans of partitions are
+proposed on their partitioned table.
+
+The benefit of a proposal is estimated as the execution time of its
+statements times the share of the plan cost spent in the scan times the
+share of rows the filter removes, i.e. the time an index that reads only
+the matching rows would save. Without pg_stat_statements (it needs
+shared_preload_libraries) only --query statements are explained, with
+their plan cost as the benefit. pg_stat_user_tables lists the tables that
+are read mostly by sequential scans either way.
+"""
+import argparse
+import asyncio
+import json
+import re
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+__all__ = [
+    'IndexProposal',
+    'advise',
+    'heavy_tables',
+    'read_statements',
+]
+
+# Statements of pg_stat_statements explained, by total execution time
+INDEX_ADVISOR_TOP_STATEMENTS = 50
+
+# Tables with fewer rows are scanned faster than an index is read
+INDEX_ADVISOR_MIN_ROWS = 1000
+
+# Share of the rows of a table a filter may keep for an index to pay off
+INDEX_ADVISOR_MAX_SELECTIVITY = 0.2
+
+# Statement timeout of the EXPLAIN statements in milliseconds
+INDEX_ADVISOR_TIMEOUT_MS = 5000
+
+# EXPLAIN (GENERIC_PLAN) of a normalized statement, its $n parameters stay unbound.
+# A client can only send it with the simple query protocol, PL/pgSQL EXECUTE does.
+GENERIC_PLAN_FUNCTION = text("""
+    CREATE OR REPLACE FUNCTION pg_temp.index_advisor_plan(query text) RETURNS json
+    LANGUAGE plpgsql AS $$
+    DECLARE plan json;
+    BEGIN
+        EXECUTE 'EXPLAIN (FORMAT JSON, GENERIC_PLAN) ' || query INTO plan;
+        RETURN plan;
+    END $$
+""")
+
+READ_STATEMENTS = text("""
+    SELECT query, calls, total_exec_time, mean_exec_time
+    FROM pg_stat_statements
+    WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+      AND query ~* '^\\s*(SELECT|WITH|UPDATE|DELETE)\\s'
+    ORDER BY total_exec_time DESC
+    LIMIT :limit
+""")
+
+# Columns, rows, parent and indexes of a table or partition, by name
+READ_TABLE = text("""
+    SELECT
+        c.relname AS table,
+        COALESCE(parent.relname, c.relname) AS parent,
+        parent.relkind = 'p' AS partitioned,
+        GREATEST(c.reltuples, 0)::bigint AS rows,
+        (SELECT json_object_agg(a.attname, format_type(a.atttypid, a.atttypmod))
+         FROM pg_attribute a WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped) AS columns,
+        (SELECT json_agg(json_build_object(
+             'name', i.relname,
+             'first', (SELECT attname FROM pg_attribute WHERE attrelid = x.indrelid AND attnum = x.indkey[0]),
+             'predicate', pg_get_expr(x.indpred, x.indrelid)))
+         FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+         WHERE x.indrelid = COALESCE(parent.oid, c.oid)) AS indexes,
+        (SELECT json_agg(a.attname)
+         FROM pg_index x JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = ANY(x.indkey)
+         WHERE x.indrelid = COALESCE(parent.oid, c.oid) AND x.indisprimary) AS primary_key
+    FROM pg_class c
+    LEFT JOIN pg_inherits h ON h.inhrelid = c.oid
+    LEFT JOIN pg_class parent ON parent.oid = h.inhparent
+    WHERE c.relname = :table AND c.relnamespace = 'public'::regnamespace
+""")
+
+HEAVY_TABLES = text("""
+    SELECT COALESCE(parent.relname, s.relname) AS table,
+           sum(s.seq_scan)::bigint AS seq_scan,
+           sum(s.seq_tup_read)::bigint AS seq_tup_read,
+           sum(COALESCE(s.idx_scan, 0))::bigint AS idx_scan,
+           sum(s.n_live_tup)::bigint AS rows
+    FROM pg_stat_user_tables s
+    LEFT JOIN pg_inherits h ON h.inhrelid = s.relid
+    LEFT JOIN pg_class parent ON parent.oid = h.inhparent
+    GROUP BY 1
+    HAVING sum(s.seq_scan) > sum(COALESCE(s.idx_scan, 0))
+       AND sum(s.n_live_tup) >= :min_rows
+       AND sum(s.seq_tup_read) / GREATEST(sum(s.seq_scan), 1) >= :min_rows
+    ORDER BY sum(s.seq_tup_read) DESC
+""")
+
+# A column compared with =, IN (= ANY) or IS NULL, casts and parentheses around it allowed
+EQUALITY = r'\(*\b{column}\b\)*(?:::[\w ]+\)*)?\s*(?:=|IS NULL)'
+RANGE = r'\(*\b{column}\b\)*(?:::[\w ]+\)*)?\s*(?:<|>|<=|>=)\s'
+
+
+class IndexProposal:
+    """
+    A missing index and the statements it serves.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table: str,
+        columns: Tuple[str, ...],
+        predicate: Optional[str],
+        partitioned: bool
+    ) -> None:
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.predicate = predicate
+        self.partitioned = partitioned
+        self.saved_ms = 0.0
+        self.saved_cost = 0.0
+        self.statements: List[str] = []
+
+    @property
+    def ddl(self) -> str:
+        where = f" WHERE {self.predicate}" if self.predicate else ''
+        if self.partitioned:
+            return f"CREATE INDEX {self.name} ON ONLY {self.table} ({', '.join(self.columns)}){where}"
+        return f"CREATE INDEX CONCURRENTLY {self.name} ON {self.table} ({', '.join(self.columns)}){where}"
+
+    def dict(self) -> dict:
+        return {
+            'name': self.name,
+            'table': self.table,
+            'columns': list(self.columns),
+            'predicate': self.predicate,
+            'ddl': self.ddl,
+            'saved_ms': round(self.saved_ms, 1),
+            'saved_cost': round(self.saved_cost, 1),
+            'statements': self.statements,
+        }
+
+
+def _scans(plan: dict):
+    """
+    Yield the sequential scans of a plan with a filter, with the total cost of the plan.
+    """
+    total = plan.get('Total Cost') or 0
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if node.get('Node Type') == 'Seq Scan' and node.get('Filter'):
+            yield node, total
+        stack.extend(node.get('Plans', []))
+
+
+def _proposal(scan: dict, table: dict) -> Optional[Tuple[Tuple[str, ...], Optional[str]]]:
+    """
+    Get the columns and the predicate of an index serving the filter of a scan.
+    @params scan: Seq Scan node of a plan.
+    @params table: row of READ_TABLE.
+    @return: columns and predicate, None if no column of the filter can be indexed.
+    """
+    condition = scan['Filter']
+    equal, ranges, predicate = [], [], None
+    for column, column_type in table['columns'].items():
+        if not re.search(rf'\b{re.escape(column)}\b', condition):
+            continue
+        if column_type == 'boolean':
+            if predicate is None and re.search(rf'(?:^|\(|AND |NOT ){re.escape(column)}(?:$|\)| AND)', condition):
+                negated = re.search(rf'NOT {re.escape(column)}\b', condition)
+                predicate = f"NOT {column}" if negated else column
+        elif re.search(EQUALITY.format(column=re.escape(column)), condition):
+            equal.append((condition.find(column), column))
+        elif re.search(RANGE.format(column=re.escape(column)), condition):
+            ranges.append((condition.find(column), column))
+    columns = [column for _, column in sorted(equal)] + [column for _, column in sorted(ranges)[:1]]
+    if not columns and predicate:
+        columns = table['primary_key'][:1] or []
+    if not columns:
+        return None
+    return tuple(columns), predicate
+
+
+def _served(columns: Tuple[str, ...], predicate: Optional[str], indexes: List[dict]) -> bool:
+    """
+    Check if an existing index serves a proposal: it starts with the first column,
+    and for a partial proposal its predicate has the same column.
+    """
+    for index in indexes:
+        if predicate:
+            column = predicate.replace('NOT ', '')
+            if index['predicate'] and re.search(rf'\b{re.escape(column)}\b', index['predicate']):
+                return True
+        elif index['first'] == columns[0]:
+            return True
+    return False
+
+
+async def read_statements(connection: AsyncConnection, limit: int = INDEX_ADVISOR_TOP_STATEMENTS) -> Optional[List[dict]]:
+    """
+    Read the statements with the most execution time.
+    @params connection: database connection.
+    @params limit: number of statements.
+    @return: dicts with query, calls, total_exec_time and mean_exec_time, None without pg_stat_statements.
+    """
+    installed = (await connection.execute(
+        text("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+    )).scalar()
+    if not installed:
+        return None
+    try:
+        async with connection.begin_nested():
+            return [dict(row) for row in (await connection.execute(READ_STATEMENTS, {'limit': limit})).mappings()]
+    except Exception:
+        # Installed but not in shared_preload_libraries
+        return None
+
+
+async def advise(
+    connection: AsyncConnection,
+    statements: List[dict],
+    min_rows: int = INDEX_ADVISOR_MIN_ROWS,
+    max_selectivity: float = INDEX_ADVISOR_MAX_SELECTIVITY
+) -> Tuple[List[IndexProposal], List[dict]]:
+    """
+    Explain statements and propose indexes for their sequential scans.
+    @params connection: database connection, the caller rolls its transaction back.
+    @params statements: dicts with query and optionally calls and total_exec_time.
+    @params min_rows: smallest table to index.
+    @params max_selectivity: largest share of rows a filter may keep.
+    @return: proposals by estimated benefit and the statements that could not be explained with the reason.
+    """
+    proposals: Dict[tuple, IndexProposal] = {}
+    tables: Dict[str, Optional[dict]] = {}
+    failed = []
+    await connection.execute(text(f"SET LOCAL statement_timeout = {int(INDEX_ADVISOR_TIMEOUT_MS)}"))
+    await connection.execute(GENERIC_PLAN_FUNCTION)
+    for statement in statements:
+        query = statement['query']
+        try:
+            async with connection.begin_nested():
+                plan = (await connection.execute(
+                    text("SELECT pg_temp.index_advisor_plan(:query)"), {'query': query}
+                )).scalar()
+        except Exception as e:
+            error = str(getattr(e, 'orig', e)).splitlines()[0]
+            failed.append({'query': query, 'error': re.sub(r"^<class '[\w.]+'>: ", '', error)})
+            continue
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        for scan, plan_cost in _scans(plan[0]['Plan']):
+            relation = scan['Relation Name']
+            if relation not in tables:
+                row = (await connection.execute(READ_TABLE, {'table': relation})).mappings().first()
+                tables[relation] = dict(row) if row else None
+            table = tables[relation]
+            if table is None or table['rows'] < min_rows:
+                continue
+            selectivity = scan['Plan Rows'] / max(table['rows'], 1)
+            if selectivity > max_selectivity:
+                continue
+            index = _proposal(scan, table)
+            if index is None or _served(*index, table['indexes'] or []):
+                continue
+
+            columns, predicate = index
+            key = (table['parent'], columns, predicate)
+            proposal = proposals.get(key)
+            if proposal is None:
+                # A partial index keyed by the primary key is named after its predicate
+                keyless = predicate is not None and list(columns) == (table['primary_key'] or [])[:1]
+                suffix = predicate.replace('NOT ', 'not_') if keyless else '_'.join(columns)
+                proposal = proposals[key] = IndexProposal(
+                    f"ix_{table['parent']}_{suffix}", table['parent'], columns, predicate, bool(table['partitioned'])
+                )
+            scan_share = min(1.0, scan['Total Cost'] / plan_cost) if plan_cost else 1.0
+            proposal.saved_ms += (statement.get('total_exec_time') or 0) * scan_share * (1 - selectivity)
+            proposal.saved_cost += scan['Total Cost'] * (1 - selectivity) * max(statement.get('calls') or 1, 1)
+            if query not in proposal.statements:
+                proposal.statements.append(query)
+
+    ranked = sorted(proposals.values(), key=lambda proposal: (proposal.saved_ms, proposal.saved_cost), reverse=True)
+    return ranked, failed
+
+
+async def heavy_tables(connection: AsyncConnection, min_rows: int = INDEX_ADVISOR_MIN_ROWS) -> List[dict]:
+    """
+    Get the tables read mostly by sequential scans of many rows, partitions counted to their table.
+    @params connection: database connection.
+    @params min_rows: smallest table and smallest mean rows per scan.
+    @return: dicts with table, seq_scan, seq_tup_read, idx_scan and rows.
+    """
+    return [dict(row) for row in (await connection.execute(HEAVY_TABLES, {'min_rows': min_rows})).mappings()]
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create argument parser for CLI
+    """
+    parser = argparse.ArgumentParser(description="Propose missing indexes")
+    parser.add_argument("--top", default=INDEX_ADVISOR_TOP_STATEMENTS, type=int, help="statements of pg_stat_statements to explain")
+    parser.add_argument("--min-rows", default=INDEX_ADVISOR_MIN_ROWS, type=int, help="smallest table to index")
+    parser.add_argument("--max-selectivity", default=INDEX_ADVISOR_MAX_SELECTIVITY, type=float, help="largest share of rows a filter may keep")
+    parser.add_argument("--query", action="append", default=[], help="statement to explain as well, $n parameters allowed")
+    parser.add_argument("--json", action="store_true", help="print JSON")
+    return parser
+
+
+async def main(args: argparse.Namespace) -> int:
+    from core import setup
+    await setup()
+
+    from database import connection
+    await connection.init_db()
+    connection.async_engine.echo = False
+
+    async with connection.async_engine.connect() as db_connection:
+        server_version = (await db_connection.execute(text("SHOW server_version_num"))).scalar()
+        if int(server_version) < 160000:
+            print("The index advisor needs PostgreSQL 16 for EXPLAIN (GENERIC_PLAN)", file=sys.stderr)
+            return 1
+        statements = await read_statements(db_connection, args.top)
+        tracked = statements is not None
+        statements = (statements or []) + [{'query': query} for query in args.query]
+        proposals, failed = await advise(db_connection, statements, args.min_rows, args.max_selectivity)
+        tables = await heavy_tables(db_connection, args.min_rows)
+
+    if args.json:
+        print(json.dumps({
+            'pg_stat_statements': tracked,
+            'proposals': [proposal.dict() for proposal in proposals],
+            'heavy_tables': tables,
+            'failed': failed,
+        }, indent=2, default=str))
+        return 0
+
+    if not tracked:
+        print(
+            "pg_stat_statements is not available, only --query statements are explained. Enable it with\n"
+            "shared_preload_libraries = 'pg_stat_statements' and CREATE EXTENSION pg_stat_statements.\n"
+        )
+    explained = len(statements) - len(failed)
+    print(f"Proposed indexes ({explained} statements explained):" if proposals else "No missing indexes found.")
+    for proposal in proposals:
+        print(f"  {proposal.ddl};")
+        if proposal.partitioned:
+            print("      partitioned: create it on every partition CONCURRENTLY and attach it, like migration d5a92c7e4f18")
+        print(
+            f"      saves ~{proposal.saved_ms:.1f} ms of recorded time, cost {proposal.saved_cost:.0f}, "
+            f"{len(proposal.statements)} statements"
+        )
+        for query in proposal.statements[:3]:
+            print(f"      - {' '.join(query.split())[:120]}")
+    if tables:
+        print("\nTables read mostly by sequential scans:")
+        for table in tables:
+            print(
+                f"  {table['table']}: {table['seq_scan']} seq scans reading {table['seq_tup_read']} rows, "
+                f"{table['idx_scan']} index scans, {table['rows']} rows"
+            )
+    for statement in failed:
+        print(f"\nCould not explain {' '.join(statement['query'].split())[:120]}: {statement['error']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(create_parser().parse_args())))
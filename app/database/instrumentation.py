@@ -0,0 +1,256 @@
+"""
+Per-request SQL statistics.
+
+Cursor events of the engines add every statement and its time to the
+QueryStats of the current request, QueryStatsMiddleware creates one per
+HTTP request; pool events add the connections the request checked out.
+Every statement is also passed to the slow query log.
+
+When the response starts, the middleware adds the numbers to it as a
+Server-Timing header, e.g.
+
+    Server-Timing: db;dur=4.210;desc="7 statements, 1 checkouts", db-slowest;dur=1.934
+
+When the request is done, it adds them to route_query_stats, the totals per
+route (GET /admins/pool-checkouts/); requests answered from a cache, or with
+a 304, should show up there without checkouts. It also logs requests whose
+statements took at least QUERY_LOG_DB_MS, and requests that ran the same
+statement shape QUERY_N_PLUS_ONE_THRESHOLD times or more as a likely N+1.
+Statements are compared with their bound parameters left out, so one lazy
+load per row is one shape.
+
+Statements of a streamed body run after the headers are sent, they are in
+the totals and the log but not in the header.
+"""
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from database.slow_queries import slow_query_log
+from functions.async_logger import AsyncLogger
+
+__all__ = [
+    'QueryStats',
+    'QueryStatsMiddleware',
+    'RouteQueryStats',
+    'current_query_stats',
+    'instrument_engine',
+    'route_query_stats',
+]
+
+# Same statement shape this many times in one request is logged as a likely N+1
+QUERY_N_PLUS_ONE_THRESHOLD = 10
+
+# Requests whose statements took at least this many milliseconds are logged, 0 logs every request
+QUERY_LOG_DB_MS = 50
+
+log = AsyncLogger(__name__)
+
+
+class QueryStats:
+    """
+    Statements of one request.
+    """
+    __slots__ = ('count', 'checkouts', 'seconds', 'slowest_seconds', 'slowest_statement', 'shapes')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.checkouts = 0
+        self.seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.shapes: Counter = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        """
+        Add an executed statement.
+        @params statement: SQL of the statement with placeholders for the parameters.
+        @params seconds: execution time.
+        @return: None
+        """
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement] += 1
+        if seconds >= self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement
+
+    def most_repeated(self) -> Tuple[Optional[str], int]:
+        """
+        Get the statement shape executed most often.
+        @return: statement and how often it was executed, (None, 0) without statements.
+        """
+        if not self.shapes:
+            return None, 0
+        return self.shapes.most_common(1)[0]
+
+    def server_timing(self) -> str:
+        """
+        Get the value of the Server-Timing header.
+        """
+        return (
+            f'db;dur={self.seconds * 1000:.3f};desc="{self.count} statements, {self.checkouts} checkouts", '
+            f'db-slowest;dur={self.slowest_seconds * 1000:.3f}'
+        )
+
+
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar('current_query_stats', default=None)
+
+
+class RouteQueryStats:
+    """
+    Totals of the statements and pool checkouts of every route.
+    """
+
+    def __init__(self) -> None:
+        self.routes: Dict[str, dict] = {}
+
+    def record(self, route: str, stats: QueryStats) -> None:
+        """
+        Add the statements of a request.
+        @params route: method and path template of the request.
+        @params stats: statements of the request.
+        @return: None
+        """
+        totals = self.routes.get(route)
+        if totals is None:
+            totals = self.routes[route] = {
+                'requests': 0,
+                'requests_with_checkout': 0,
+                'checkouts': 0,
+                'statements': 0,
+                'db_ms': 0.0,
+            }
+        totals['requests'] += 1
+        totals['requests_with_checkout'] += stats.checkouts > 0
+        totals['checkouts'] += stats.checkouts
+        totals['statements'] += stats.count
+        totals['db_ms'] += stats.seconds * 1000
+
+    def stats(self) -> list:
+        """
+        Get the totals of the routes, most checkouts first.
+        """
+        return sorted(
+            (dict(totals, route=route, db_ms=round(totals['db_ms'], 3)) for route, totals in self.routes.items()),
+            key=lambda totals: totals['checkouts'],
+            reverse=True
+        )
+
+    def clear(self) -> None:
+        self.routes.clear()
+
+
+route_query_stats = RouteQueryStats()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    seconds = time.perf_counter() - context._query_started
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+    slow_query_log.observe(conn, statement, parameters, context, seconds)
+
+
+def _checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.checkouts += 1
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """
+    Record the statements and pool checkouts of an engine in the QueryStats of the current request
+    and its slow statements in the slow query log.
+    @params engine: async engine.
+    @return: None
+    """
+    slow_query_log.install(engine)
+    if not event.contains(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine.sync_engine, 'checkout', _checkout)
+
+
+def _shorten(statement: Optional[str], length: int = 200) -> str:
+    statement = ' '.join((statement or '').split())
+    return statement if len(statement) <= length else statement[:length] + '...'
+
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware that collects the statements of every HTTP request.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        n_plus_one_threshold: int = QUERY_N_PLUS_ONE_THRESHOLD,
+        log_db_ms: float = QUERY_LOG_DB_MS,
+        routes: RouteQueryStats = route_query_stats
+    ) -> None:
+        """
+        Initialize the middleware.
+        @params app: wrapped application.
+        @params n_plus_one_threshold: repeats of a statement shape logged as a likely N+1.
+        @params log_db_ms: database time in ms from which a request is logged.
+        @params routes: totals per route the requests are added to.
+        @return: None
+        """
+        self.app = app
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.log_db_ms = log_db_ms
+        self.routes = routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = current_query_stats.set(stats)
+
+        async def send_with_timing(message: Message) -> None:
+            if message['type'] == 'http.response.start' and stats.count:
+                MutableHeaders(scope=message).append('Server-Timing', stats.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_query_stats.reset(token)
+            await self.report(scope, stats)
+
+    async def report(self, scope: Scope, stats: QueryStats) -> None:
+        """
+        Log the statements of a request.
+        @params scope: ASGI scope of the request.
+        @params stats: statements of the request.
+        @return: None
+        """
+        # The router sets the matched route in the scope, unmatched paths are counted together
+        route = scope.get('route')
+        self.routes.record(f"{scope['method']} {getattr(route, 'path', '<unmatched>')}", stats)
+        if not stats.count:
+            return
+        request = f"{scope['method']} {scope['path']}"
+        statement, repeats = stats.most_repeated()
+        if repeats >= self.n_plus_one_threshold:
+            await log.b_warn(
+                f"Likely N+1 in {request}: {repeats} of {stats.count} statements are {_shorten(statement)}"
+            )
+        if stats.seconds * 1000 >= self.log_db_ms:
+            await log.b_info(
+                f"{request}: {stats.count} statements in {stats.seconds * 1000:.1f} ms, "
+                f"slowest {stats.slowest_seconds * 1000:.1f} ms: {_shorten(stats.slowest_statement)}"
+            )
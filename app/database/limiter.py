@@ -0,0 +1,342 @@
+"""
+Adaptive concurrency limit in front of the database and load shedding.
+
+Sessions take a slot of db_limiter before their first statement and give
+it back when they close, so sessions that never run a statement never take
+one. The limit follows AIMD: a session whose statements took at most
+DB_LIMIT_LATENCY_MS on average raises it by 1/limit, about one per limit
+sessions, a slower one multiplies it by DB_LIMIT_BACKOFF. It stays between
+DB_LIMIT_MIN and the pool size plus overflow, so sessions queue here in a
+bounded, observable queue instead of on the pool checkout.
+
+LoadSheddingMiddleware answers 503 with Retry-After right away when the
+oldest session has been queued longer than the budget of the request,
+DB_QUEUE_BUDGET_MS. Low-priority routes (LOW_PRIORITY_PATHS: exports and
+analytics) get LOW_PRIORITY_BUDGET_SHARE of it, so they are shed first. A
+request that is queued longer than its budget gives up its place and is
+answered 503 too, whatever its endpoint makes of the error.
+
+Sessions outside a request, like the job queue, wait without a budget.
+"""
+import asyncio
+import functools
+import math
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from functions.async_logger import AsyncLogger
+
+__all__ = [
+    'AdaptiveLimiter',
+    'Admission',
+    'DatabaseOverloaded',
+    'LimitedSession',
+    'LoadSheddingMiddleware',
+    'current_admission',
+    'db_limiter',
+]
+
+# Factor applied to the limit after a session with slow statements
+DB_LIMIT_BACKOFF = 0.9
+
+# Parts of request paths whose requests are shed first
+LOW_PRIORITY_PATHS = ('/orders/export/', '/product/bestsellers/', '/feedback/clusters/')
+
+# Share of DB_QUEUE_BUDGET_MS low-priority requests may be queued
+LOW_PRIORITY_BUDGET_SHARE = 0.25
+
+log = AsyncLogger(__name__)
+
+
+class DatabaseOverloaded(Exception):
+    """
+    Raised when a session was queued for a slot longer than the budget of its request.
+    """
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"Database overloaded, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit with additive increase and multiplicative decrease, waiters are served in order.
+    """
+
+    def __init__(
+        self,
+        limit: float = 5,
+        min_limit: int = 2,
+        max_limit: int = 15,
+        latency_target_ms: float = 50,
+        queue_budget_ms: float = 500
+    ) -> None:
+        """
+        Initialize the limiter.
+        @params limit: initial limit.
+        @params min_limit: lowest limit.
+        @params max_limit: highest limit, at most the connections of the pool.
+        @params latency_target_ms: mean statement time above which the limit is lowered.
+        @params queue_budget_ms: queue wait of normal requests before they are shed.
+        @return: None
+        """
+        self.configure(limit, min_limit, max_limit, latency_target_ms, queue_budget_ms)
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.shed = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    def configure(
+        self,
+        limit: float,
+        min_limit: int,
+        max_limit: int,
+        latency_target_ms: float,
+        queue_budget_ms: float
+    ) -> None:
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(limit, self.min_limit), self.max_limit))
+        self.latency_target_ms = latency_target_ms
+        self.queue_budget_ms = queue_budget_ms
+
+    def budget(self, low_priority: bool = False) -> float:
+        """
+        Get the queue budget of a request in seconds.
+        """
+        share = LOW_PRIORITY_BUDGET_SHARE if low_priority else 1
+        return self.queue_budget_ms * share / 1000
+
+    def queue_delay(self) -> float:
+        """
+        Get the seconds the oldest waiter has been queued, 0 without waiters.
+        """
+        while self._waiters and self._waiters[0].done():
+            self._waiters.popleft()
+        if not self._waiters:
+            return 0.0
+        return time.monotonic() - self._waiters[0].queued_at
+
+    def retry_after(self) -> int:
+        """
+        Get the seconds a shed client should wait before it retries.
+        """
+        return max(1, math.ceil(max(self.queue_delay(), self.queue_budget_ms / 1000)))
+
+    async def acquire(self, budget: Optional[float] = None) -> None:
+        """
+        Take a slot, waiting for one if the limit is reached.
+        @params budget: seconds to wait at most, None to wait without a budget.
+        @return: None
+        @raise: DatabaseOverloaded if no slot was free within the budget.
+        """
+        if self.in_flight < int(self.limit) and not self.queue_delay():
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        waiter.queued_at = time.monotonic()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), budget)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # The request was cancelled, a slot handed over in the meantime goes to the next waiter
+            if waiter.done():
+                self.release()
+            waiter.cancel()
+            raise
+        if not waiter.done():
+            waiter.cancel()
+            self.rejected += 1
+            raise DatabaseOverloaded(self.retry_after())
+        self.admitted += 1  # release() handed its slot over
+
+    def release(self, latency_ms: Optional[float] = None) -> None:
+        """
+        Give a slot back and adapt the limit.
+        @params latency_ms: mean statement time of the slot, None to keep the limit.
+        @return: None
+        """
+        if latency_ms is not None:
+            if latency_ms > self.latency_target_ms:
+                self.limit = max(self.min_limit, self.limit * DB_LIMIT_BACKOFF)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self) -> dict:
+        """
+        Get the limit, the slots in use and the counters of the limiter.
+        """
+        return {
+            'limit': round(self.limit, 2),
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'in_flight': self.in_flight,
+            'queued': sum(not waiter.done() for waiter in self._waiters),
+            'queue_delay_ms': round(self.queue_delay() * 1000, 3),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'shed': self.shed,
+        }
+
+
+db_limiter = AdaptiveLimiter()
+
+
+class Admission:
+    """
+    Queue budget of a request, set by LoadSheddingMiddleware.
+    """
+    __slots__ = ('budget', 'overloaded')
+
+    def __init__(self, budget: float) -> None:
+        self.budget = budget
+        self.overloaded: Optional[DatabaseOverloaded] = None
+
+
+current_admission: ContextVar[Optional[Admission]] = ContextVar('current_admission', default=None)
+
+
+def _limited(method):
+    @functools.wraps(method)
+    async def call(self, *args, **kwargs):
+        await self._admit()
+        started = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            self._db_seconds += time.perf_counter() - started
+            self._db_calls += 1
+    return call
+
+
+class LimitedSession(AsyncSession):
+    """
+    AsyncSession that holds a slot of db_limiter from its first statement until it is closed.
+    scalars() and stream_scalars() go through execute() and stream().
+    """
+    _db_slot = False
+    _db_seconds = 0.0
+    _db_calls = 0
+
+    async def _admit(self) -> None:
+        if self._db_slot:
+            return
+        admission = current_admission.get()
+        try:
+            await db_limiter.acquire(admission.budget if admission is not None else None)
+        except DatabaseOverloaded as e:
+            if admission is not None:
+                admission.overloaded = e
+            raise
+        self._db_slot = True
+        self._db_seconds = 0.0
+        self._db_calls = 0
+
+    execute = _limited(AsyncSession.execute)
+    scalar = _limited(AsyncSession.scalar)
+    get = _limited(AsyncSession.get)
+    get_one = _limited(AsyncSession.get_one)
+    stream = _limited(AsyncSession.stream)
+    delete = _limited(AsyncSession.delete)
+    merge = _limited(AsyncSession.merge)
+    refresh = _limited(AsyncSession.refresh)
+    flush = _limited(AsyncSession.flush)
+    commit = _limited(AsyncSession.commit)
+    connection = _limited(AsyncSession.connection)
+    run_sync = _limited(AsyncSession.run_sync)
+
+    async def close(self) -> None:
+        try:
+            await super().close()
+        finally:
+            if self._db_slot:
+                self._db_slot = False
+                db_limiter.release(self._db_seconds * 1000 / self._db_calls if self._db_calls else None)
+
+
+class LoadSheddingMiddleware:
+    """
+    ASGI middleware that answers 503 with Retry-After while the database queue is over the budget of a request.
+    """
+
+    def __init__(self, app: ASGIApp, limiter: AdaptiveLimiter = db_limiter) -> None:
+        """
+        Initialize the middleware.
+        @params app: wrapped application.
+        @params limiter: limiter whose queue is watched.
+        @return: None
+        """
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        low_priority = any(path in scope['path'] for path in LOW_PRIORITY_PATHS)
+        admission = Admission(self.limiter.budget(low_priority))
+        if self.limiter.queue_delay() > admission.budget:
+            await self.reject(scope, send, self.limiter.retry_after())
+            return
+
+        token = current_admission.set(admission)
+        started = False
+
+        async def send_or_reject(message: Message) -> None:
+            nonlocal started
+            if message['type'] == 'http.response.start':
+                started = True
+                if admission.overloaded is not None:
+                    # The endpoint answered the rejected session somehow, the client gets the 503
+                    await self.reject(scope, send, admission.overloaded.retry_after)
+                    return
+            if admission.overloaded is None:
+                await send(message)
+
+        try:
+            await self.app(scope, receive, send_or_reject)
+        except Exception:
+            if admission.overloaded is None or started:
+                raise
+            await self.reject(scope, send, admission.overloaded.retry_after)
+        finally:
+            current_admission.reset(token)
+
+    async def reject(self, scope: Scope, send: Send, retry_after: int) -> None:
+        """
+        Answer a request with 503 Service Unavailable.
+        @params scope: ASGI scope of the request.
+        @params send: ASGI send of the request.
+        @params retry_after: seconds the client should wait.
+        @return: None
+        """
+        self.limiter.shed += 1
+        await log.b_warn(f"Shed {scope['method']} {scope['path']}: database queue over budget")
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'retry-after', str(retry_after).encode()),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'{"detail": "Service overloaded, retry later"}',
+        })
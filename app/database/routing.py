@@ -0,0 +1,87 @@
+"""
+Routing of statements between the primary database and the read replica.
+
+get_async_db marks sessions of GET requests for the replica. Such a session
+sends its reads to the replica until it writes; the write and everything
+after it go to the primary. Sessions of other requests, and sessions of
+clients that wrote within the last DB_REPLICA_STICKY_SECONDS, use only the
+primary, so an admin reads their own edits even if the replica lags.
+
+INSERT, UPDATE and DELETE statements and flushes are writes. Other
+statements that must run on the primary are marked with the primary
+execution option: text() writes, SELECTs with data-modifying CTEs or side
+effects, and locking reads.
+
+    text("DELETE FROM ...").execution_options(primary=True)
+
+Sticky clients are kept per process, like the other caches of the app.
+"""
+import hashlib
+from typing import Optional
+
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+
+from utils import TTLCache
+
+__all__ = [
+    'PRIMARY_OPTION',
+    'READ_ONLY_METHODS',
+    'RoutingSession',
+    'client_key',
+    'is_read',
+    'sticky_clients',
+]
+
+# HTTP methods whose sessions read from the replica
+READ_ONLY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Clients that wrote recently, their reads go to the primary. The ttl is
+# DB_REPLICA_STICKY_SECONDS, set by init_db.
+sticky_clients = TTLCache(5, 100_000)
+
+# Execution option of statements that write although they are not INSERT, UPDATE or DELETE
+PRIMARY_OPTION = 'primary'
+
+
+def client_key(request: Request) -> Optional[str]:
+    """
+    Get the key of the client of a request.
+    @params request: HTTP request.
+    @return: digest of the Authorization header, the client address without one.
+    """
+    authorization = request.headers.get('authorization')
+    if authorization:
+        return hashlib.blake2b(authorization.encode(), digest_size=16).hexdigest()
+    return request.client.host if request.client else None
+
+
+def is_read(clause) -> bool:
+    """
+    Check if a statement only reads.
+    @params clause: statement, None for a bind without a statement.
+    @return: False for INSERT, UPDATE and DELETE and for statements with the primary execution option.
+    """
+    if clause is None:
+        return True
+    if clause.is_dml:
+        return False
+    return not clause.get_execution_options().get(PRIMARY_OPTION, False)
+
+
+class RoutingSession(Session):
+    """
+    Session that reads from the replica when session.info['replica'] is set.
+    The replica engine is session.info['replica_bind'], None without a replica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or not is_read(clause):
+            # Reads after a write see the write
+            self.info['replica'] = False
+            client = self.info.get('client')
+            if client is not None:
+                sticky_clients.set(client, True)
+        elif self.info.get('replica') and self.info.get('replica_bind') is not None:
+            return self.info['replica_bind']
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
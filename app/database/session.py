@@ -1,15 +1,26 @@
 from typing import AsyncGenerator
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import Request
 
-async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+from database.routing import READ_ONLY_METHODS, client_key, sticky_clients
+from database.unit_of_work import unit_of_work
+
+async def get_async_db(request: Request) -> AsyncGenerator[AsyncSession, None]:
     """
-    Get AsyncSession object from database connection
-    :params: None
+    Get the unit of work of a request.
+    The session is shared by every dependency of the request, it connects on its
+    first statement and is committed once after the endpoint returned, or rolled back
+    if the endpoint raised. Managers only flush, see database.unit_of_work.
+    Sessions of GET requests read from the replica if one is configured, unless
+    the client wrote within DB_REPLICA_STICKY_SECONDS. Writes always go to the primary.
+    :params: request: HTTP request
     :yields: AsyncSession object from database connection
     """
-    from database.connection import AsyncSessionLocal, init_db
+    from database import connection
 
-    if AsyncSessionLocal is None:  # If AsyncSessionLocal is None, initialize the DB
-        await init_db()
-    async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+    if connection.AsyncSessionLocal is None:  # If AsyncSessionLocal is None, initialize the DB
+        await connection.init_db()
+    client = client_key(request)
+    replica = request.method in READ_ONLY_METHODS and (client is None or sticky_clients.get(client) is None)
+    async with unit_of_work(connection.AsyncSessionLocal, client=client, replica=replica) as session:
+        yield session
@@ -0,0 +1,212 @@
+"""
+Slow query log.
+
+Statements that take at least DB_SLOW_QUERY_MS are recorded with their SQL,
+their parameters redacted to types and lengths, and the time they took, in
+a ring buffer of the last DB_SLOW_QUERY_LOG_SIZE entries (GET
+/admins/slow-queries/). A background task explains every recorded statement
+off the request path: SELECTs built with SQLAlchemy that are not marked for
+the primary (see database.routing) with EXPLAIN (ANALYZE, BUFFERS), other
+statements, text() ones included, with a plain EXPLAIN because ANALYZE
+would run them. The plan is
+captured inside a transaction that is rolled back, with a statement timeout.
+A shape is explained at most once per SLOW_QUERY_EXPLAIN_INTERVAL, later
+entries of the shape reuse its plan.
+
+Sequential scans of the plans are listed per entry, they point at missing
+indexes; python -m database.index_advisor proposes them.
+"""
+import asyncio
+import datetime
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from database.routing import is_read
+from functions.async_logger import AsyncLogger
+
+__all__ = [
+    'SlowQueryLog',
+    'redact',
+    'slow_query_log',
+]
+
+# Seconds a shape's plan is reused before the shape is explained again
+SLOW_QUERY_EXPLAIN_INTERVAL = 300
+
+# Statement timeout of EXPLAIN ANALYZE in milliseconds
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = 5000
+
+# Statements waiting for EXPLAIN, further ones are recorded without a plan
+SLOW_QUERY_EXPLAIN_QUEUE = 100
+
+# Execution option that keeps the EXPLAIN statements themselves out of the log
+SKIP_OPTION = 'skip_slow_query_log'
+
+SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+log = AsyncLogger(__name__)
+
+
+def redact(parameters) -> object:
+    """
+    Replace parameter values by their types, strings and bytes keep their length.
+    @params parameters: parameters of a statement, positional or named.
+    @return: redacted parameters of the same shape.
+    """
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None:
+        return None
+    if isinstance(parameters, (str, bytes)):
+        return f"<{type(parameters).__name__}:{len(parameters)}>"
+    return f"<{type(parameters).__name__}>"
+
+
+class SlowQueryLog:
+    """
+    Ring buffer of slow statements with their plans.
+    """
+
+    def __init__(self, threshold_ms: float = 200, size: int = 200) -> None:
+        """
+        Initialize the log.
+        @params threshold_ms: statements that take at least this many milliseconds are recorded.
+        @params size: number of entries kept.
+        @return: None
+        """
+        self.threshold_ms = threshold_ms
+        self.entries: Deque[dict] = deque(maxlen=size)
+        self.recorded = 0
+        self.explained = 0
+        self.dropped = 0
+        self._engines: Dict[object, AsyncEngine] = {}
+        self._plans: Dict[str, dict] = {}  # shape -> plan fields and the time they were captured
+        self._pending: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def resize(self, size: int) -> None:
+        self.entries = deque(self.entries, maxlen=size)
+
+    def install(self, engine: AsyncEngine) -> None:
+        """
+        Explain slow statements of an engine on the engine.
+        @params engine: async engine.
+        @return: None
+        """
+        self._engines[engine.sync_engine] = engine
+
+    def observe(self, conn, statement: str, parameters, context, seconds: float) -> None:
+        """
+        Record a statement if it was slow, called by the cursor events of the engine.
+        @params conn: connection of the statement.
+        @params statement: SQL of the statement.
+        @params parameters: parameters of the statement.
+        @params context: execution context of the statement.
+        @params seconds: execution time.
+        @return: None
+        """
+        if seconds * 1000 < self.threshold_ms or context.execution_options.get(SKIP_OPTION):
+            return
+        entry = {
+            'at': datetime.datetime.utcnow().isoformat(),
+            'ms': round(seconds * 1000, 3),
+            'statement': statement,
+            'parameters': redact(parameters),
+            'plan': None,
+            'analyzed': False,
+            'seq_scans': [],
+        }
+        self.entries.append(entry)
+        self.recorded += 1
+
+        plan = self._plans.get(statement)
+        if plan is not None and time.monotonic() - plan['captured'] < SLOW_QUERY_EXPLAIN_INTERVAL:
+            entry.update(plan['fields'])
+            return
+        engine = self._engines.get(conn.engine)
+        if self._pending is None or engine is None or context.executemany:
+            return
+        clause = context.compiled.statement if context.compiled is not None else None
+        analyze = clause is not None and clause.is_select and is_read(clause)
+        try:
+            self._pending.put_nowait((engine, statement, parameters, analyze, entry))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def start(self) -> None:
+        """
+        Start the EXPLAIN task.
+        """
+        if self._task is None:
+            self._pending = asyncio.Queue(SLOW_QUERY_EXPLAIN_QUEUE)
+            self._task = asyncio.create_task(self._explain_pending())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._pending = None
+
+    async def _explain_pending(self) -> None:
+        while True:
+            engine, statement, parameters, analyze, entry = await self._pending.get()
+            plan = self._plans.get(statement)
+            if plan is None or time.monotonic() - plan['captured'] >= SLOW_QUERY_EXPLAIN_INTERVAL:
+                try:
+                    fields = await self.explain(engine, statement, parameters, analyze)
+                except Exception as e:
+                    await log.b_warn(f"Failed to explain a slow statement: {e}")
+                    continue
+                plan = self._plans[statement] = {'captured': time.monotonic(), 'fields': fields}
+                self.explained += 1
+                await log.b_warn(
+                    f"Slow statement ({entry['ms']} ms, seq scans: {fields['seq_scans']}): {' '.join(statement.split())[:200]}"
+                )
+            entry.update(plan['fields'])
+
+    async def explain(self, engine: AsyncEngine, statement: str, parameters: Sequence, analyze: bool) -> dict:
+        """
+        Get the plan of a statement in a transaction that is rolled back.
+        @params engine: engine the statement ran on.
+        @params statement: SQL of the statement.
+        @params parameters: parameters of the statement.
+        @params analyze: True to run the statement with EXPLAIN (ANALYZE, BUFFERS).
+        @return: dict with the plan, whether it was analyzed and the relations read with sequential scans.
+        """
+        options = 'ANALYZE, BUFFERS' if analyze else 'COSTS'
+        execution_options = {SKIP_OPTION: True}
+        async with engine.connect() as connection:
+            async with connection.begin() as transaction:
+                await connection.exec_driver_sql(
+                    f"SET LOCAL statement_timeout = {int(SLOW_QUERY_EXPLAIN_TIMEOUT_MS)}",
+                    execution_options=execution_options
+                )
+                result = await connection.exec_driver_sql(
+                    f"EXPLAIN ({options}) {statement}", parameters, execution_options=execution_options
+                )
+                lines: List[str] = [row[0] for row in result]
+                await transaction.rollback()
+        plan = '\n'.join(lines)
+        return {'plan': plan, 'analyzed': analyze, 'seq_scans': sorted(set(SEQ_SCAN.findall(plan)))}
+
+    def stats(self) -> dict:
+        """
+        Get the entries, newest first, and the counters of the log.
+        """
+        return {
+            'threshold_ms': self.threshold_ms,
+            'recorded': self.recorded,
+            'explained': self.explained,
+            'dropped': self.dropped,
+            'entries': list(reversed(self.entries)),
+        }
+
+
+slow_query_log = SlowQueryLog()
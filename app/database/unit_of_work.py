@@ -0,0 +1,107 @@
+"""
+Request-scoped unit of work.
+
+get_async_db hands one session to everything a request depends on, the
+managers and get_current_user. The session connects on its first statement
+and keeps the connection until the end of the request, so a request that
+never touches the database never checks a connection out, and one that
+does uses a single connection (one per database with a read replica).
+
+Managers end their writes with commit(), which only flushes inside a unit
+of work. get_async_db commits once after the endpoint returned and rolls
+back if it raised or if a manager called rollback(). Work that must only
+happen once the data is committed, like cache invalidation or updates of
+in-memory indexes, is registered with after_commit().
+
+Sessions created outside a request (jobs, benchmarks) are not units of
+work: commit() and rollback() act right away and after_commit() callbacks
+run immediately.
+"""
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from functions.async_logger import AsyncLogger
+
+__all__ = [
+    'after_commit',
+    'commit',
+    'is_unit_of_work',
+    'rollback',
+    'unit_of_work',
+]
+
+log = AsyncLogger(__name__)
+
+
+def is_unit_of_work(session: AsyncSession) -> bool:
+    return session.info.get('unit_of_work', False)
+
+
+async def commit(session: AsyncSession) -> None:
+    """
+    Commit the work of a manager method. Inside a unit of work the changes are
+    only flushed, so errors surface in the method, and committed with the request.
+    @params session: database session.
+    @return: None
+    """
+    if is_unit_of_work(session):
+        await session.flush()
+    else:
+        await session.commit()
+
+
+async def rollback(session: AsyncSession) -> None:
+    """
+    Roll back the current transaction. A unit of work is not committed after a rollback.
+    @params session: database session.
+    @return: None
+    """
+    if is_unit_of_work(session):
+        session.info['rollback_only'] = True
+        session.info['after_commit'] = []
+    await session.rollback()
+
+
+def after_commit(session: AsyncSession, callback: Callable[[], None]) -> None:
+    """
+    Run a callback once the changes of the session are committed.
+    @params session: database session.
+    @params callback: function without arguments.
+    @return: None
+    """
+    if is_unit_of_work(session):
+        session.info.setdefault('after_commit', []).append(callback)
+    else:
+        callback()
+
+
+@asynccontextmanager
+async def unit_of_work(session_factory: Callable[..., AsyncSession], **info) -> AsyncIterator[AsyncSession]:
+    """
+    Open a unit of work, committed when the block exits normally and rolled back when it raises.
+    @params session_factory: session factory, e.g. AsyncSessionLocal.
+    @params info: entries of session.info.
+    @return: database session.
+    """
+    async with session_factory() as session:
+        session.info.update(info, unit_of_work=True)
+        try:
+            yield session
+            transaction = session.sync_session.get_transaction()
+            if transaction is not None:
+                if transaction.is_active and not session.info.get('rollback_only'):
+                    await session.commit()
+                else:
+                    await session.rollback()
+        except BaseException:
+            session.info['after_commit'] = []
+            await session.rollback()
+            raise
+
+        for callback in session.info.get('after_commit', []):
+            try:
+                callback()
+            except Exception as e:
+                await log.b_err(f"After commit callback failed: {e}")
@@ -12,7 +12,10 @@ from contextlib import asynccontextmanager
 
 from fastapi.staticfiles import StaticFiles
 
-from database.connection import init_db
+from database.connection import init_db, prewarm_pool
+from database.instrumentation import QueryStatsMiddleware
+from database.limiter import LoadSheddingMiddleware
+from database.slow_queries import slow_query_log
 
 from core.settings import (
     Settings,
@@ -26,7 +29,14 @@ from starlette.middleware.cors import CORSMiddleware
 from middleware.apps.admin.endpoints import API_ADMIN_MODULE
 from middleware.apps.product.endpoints import API_PRODUCT_MODULE
 from middleware.apps.feedback.endpoints import API_FEEDBACK_MODULE
+from middleware.apps.admin.revocation import revocation_list
+from middleware.apps.feedback.dedup import feedback_index
+from middleware.apps.product.bestsellers import bestsellers
 from middleware.apps.order.endpoints import API_ORDER_MODULE
+from middleware.apps.invalidation.bus import invalidation_bus
+from middleware.apps.order.partitions import ensure_partitions
+from middleware.apps.outbox.queue import job_queue
+from utils import password_pool
 
 BUILD_PATH: Optional[str] = f"{os.getcwd()}/frontend/build/static"
 INDEX_DIRECTORY: Optional[str] = f"{os.getcwd()}/frontend/build/index.html"
@@ -50,11 +60,28 @@ async def lifespan_context(app: FastAPI):
     await setup() 
     print(f"{settings.application_name} is running")
     await init_db()
+    await prewarm_pool(settings.db_pool_prewarm)
     from core import cfg
     print(f"{settings.application_name} is conneting to database {cfg['DATABASE_URL']}")
+    from database.connection import async_engine
+    await ensure_partitions(async_engine)
     await initial_server()
+    await job_queue.start()
+    await invalidation_bus.start()
+    await slow_query_log.start()
+    await revocation_list.start()
+    await feedback_index.start()
+    await bestsellers.start()
+    password_pool.start()
     print(f"{settings.application_name} is starting")
     yield
+    await job_queue.stop()
+    await invalidation_bus.stop()
+    await slow_query_log.stop()
+    await revocation_list.stop()
+    await feedback_index.stop()
+    await bestsellers.stop()
+    password_pool.shutdown()
 
 app = FastAPI(
     title=settings.application_name,
@@ -62,13 +89,19 @@ app = FastAPI(
     lifespan=lifespan_context
 )
 
+# Fast 503 while the database queue is over budget, see database/limiter.py.
+# Added before CORS, so the 503 carries the CORS headers
+app.add_middleware(LoadSheddingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allow_origins,  # Specify allowed origins here
     allow_credentials=allow_credentials,
     allow_methods=allow_methods,  # Allow all methods (GET, POST, etc.)
     allow_headers=allow_headers,  # Allow all headers
+    expose_headers=["Server-Timing", "Retry-After"],
 )
+# Statement count and database time of every request, see database/instrumentation.py
+app.add_middleware(QueryStatsMiddleware)
 app.mount("/static", StaticFiles(directory=BUILD_PATH), name="static")
 
 endpoints = []
@@ -105,6 +138,7 @@ async def custom_http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(
         status_code=exc.status_code,
         content={"message": exc.detail},
+        headers=exc.headers,
     )
   
 # @app.get("/{full_path:path}")
@@ -2,3 +2,35 @@ from sqlalchemy import MetaData
 
 
 metadata = MetaData()
+
+
+class _StatementValues:
+    """
+    Stand-in for the model instance passed to validators: its attributes are the values
+    of the statement, a column the statement does not set cannot be read.
+    """
+
+    def __init__(self, model, values: dict) -> None:
+        self.__dict__.update(values)
+        self._model = model
+
+    def __getattr__(self, name: str):
+        raise ValueError(f"{name} is required to validate values of {self._model.__name__}")
+
+
+def validated_values(model, values: dict) -> dict:
+    """
+    Run the @validates validators of a model on the values of an INSERT or UPDATE statement.
+    Statements do not go through model attributes, so their validators are not called otherwise.
+    Validators that read other columns of the instance read the other values of the statement.
+    @params model: model class.
+    @params values: column values.
+    @return: values returned by the validators.
+    @raise: ValueError if a validator rejects a value or reads a column missing from the values.
+    """
+    instance = _StatementValues(model, values)
+    validators = model.__mapper__.validators
+    for key, value in values.items():
+        if key in validators:
+            values[key] = validators[key][0](instance, key, value)
+    return values
@@ -9,4 +9,37 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api_version_1/admins/sign_in")
 
 
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60
\ No newline at end of file
+ACCESS_TOKEN_EXPIRE_MINUTES = 60
+
+# Seconds an authenticated admin is served from the cache of get_current_user
+ADMIN_CACHE_SECONDS = 60
+ADMIN_CACHE_SIZE = 10_000
+
+# Tokens issued for at most this many minutes are trusted without looking the
+# admin up: a deleted admin keeps access until the token expires.
+# 0 disables it, ACCESS_TOKEN_EXPIRE_MINUTES tokens are always looked up.
+TRUST_TOKEN_CLAIMS_MINUTES = 0
+
+# Decoded tokens kept by get_current_user until they expire
+TOKEN_CACHE_SIZE = 10_000
+
+# Refresh tokens exchange for a new access token and a new refresh token
+REFRESH_TOKEN_EXPIRE_DAYS = 14
+
+# Revoked tokens: Bloom filter slices by expiry time, expected revocations per
+# slice and false positive rate of a slice. A token that may be revoked is
+# looked up in revoked_tokens, so false positives cost a query, never a login.
+REVOCATION_SLICE_SECONDS = 3600 * 6
+REVOCATION_SLICE_CAPACITY = 50_000
+REVOCATION_ERROR_RATE = 0.001
+
+# Seconds between loads of revocations made by other workers
+REVOCATION_RESYNC_SECONDS = 10
+
+# Sign in throttling: failures of a key counted in a sliding window, the
+# first ones are free, every next one doubles the wait before the key may
+# try again, up to a lockout of SIGN_IN_LOCKOUT_SECONDS
+SIGN_IN_WINDOW_SECONDS = 900
+SIGN_IN_FREE_FAILURES = {'username': 5, 'ip': 20}
+SIGN_IN_BACKOFF_BASE_SECONDS = 1
+SIGN_IN_LOCKOUT_SECONDS = 900
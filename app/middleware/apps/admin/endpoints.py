@@ -2,22 +2,32 @@
 
 
 import json
-from typing import List
+import math
+from typing import List, Optional
 from fastapi import(
      APIRouter,
      Depends,
      HTTPException, 
+     Request,
      Response,
+     status,
 )
 
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from database import connection
+from database.instrumentation import route_query_stats
+from database.limiter import db_limiter
 from database.session import get_async_db
-from middleware.apps.admin.manager import AdminManager
+from database.slow_queries import slow_query_log
+from middleware.apps.admin.manager import AdminManager, InvalidCredentials
 from middleware.apps.admin.models import Admin
-from middleware.apps.admin.schemas import AdminCreateScheme, AdminSignInScheme, AdminUpdateScheme
-from middleware.apps.admin.utils import get_current_user
+from middleware.apps.admin import oauth2_scheme
+from middleware.apps.admin.throttle import sign_in_throttle
+from middleware.apps.admin.schemas import AdminCreateScheme, AdminSignInScheme, AdminUpdateScheme, RefreshTokenScheme
+from middleware.apps.admin.utils import decode_token, get_current_user
+from utils import PasswordPoolFull, password_pool
 
 
 API_ADMIN_MODULE = APIRouter(
@@ -29,6 +39,16 @@ AdminSignInResponse = AdminSignInScheme
 AdminCreateResponse = AdminCreateScheme
 AdminUpdateResponse = AdminUpdateScheme
 
+def password_pool_busy(e: PasswordPoolFull) -> HTTPException:
+    """
+    Answer of a login or sign up while every password worker is busy.
+    """
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={'Retry-After': '1'}
+    )
+
 
 @API_ADMIN_MODULE.post(
     '/sign_in',
@@ -36,6 +56,7 @@ AdminUpdateResponse = AdminUpdateScheme
     summary="Sign in admin"
 )
 async def sign_in(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(), 
     db:AsyncSession = Depends(get_async_db)
 ) -> None:
@@ -43,6 +64,7 @@ async def sign_in(
     Sign in an admin.
 
     Args:
+        request (Request): The request, its client address is throttled.
         form_data (OAuth2PasswordRequestForm): The form data containing the username and password.
         db (AsyncSession): The database session.
 
@@ -50,18 +72,39 @@ async def sign_in(
         AdminSignInSchema: The signed-in admin with an access token.
 
     Raises:
-        HTTPException: If the admin is not found or the password is invalid.
+        HTTPException: If the admin is not found or the password is invalid,
+                       429 if the username or the client failed too often.
     """
+    throttle_keys = {
+        'username': form_data.username.strip().lower() if form_data.username else None,
+        'ip': request.client.host if request.client else None,
+    }
+    retry_after = sign_in_throttle.check(throttle_keys)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed sign in attempts",
+            headers={'Retry-After': str(math.ceil(retry_after))}
+        )
 
     manager = AdminManager(db)
-    admin_sign_in_schema = AdminSignInResponse(username=form_data.username, password=form_data.password)
-    admin,token,expire = await manager.sign_in_admin(admin_sign_in_schema)
+    try:
+        admin_sign_in_schema = AdminSignInResponse(username=form_data.username, password=form_data.password)
+        admin,token,expire,refresh_token = await manager.sign_in_admin(admin_sign_in_schema)
+    except PasswordPoolFull as e:
+        raise password_pool_busy(e)
+    except InvalidCredentials:
+        # Only a wrong username or password counts, not an overloaded database or a failed token
+        sign_in_throttle.failure(throttle_keys)
+        raise
+    sign_in_throttle.success(throttle_keys['username'])
     
         # Create JSON response content
     response_content = {
         "admin": admin.dict(),  # Convert user object to dictionary
         "message": "Sign in admin successfully",
         "access_token": token,
+        "refresh_token": refresh_token,
         "token_type": "bearer",
         "token_expires_at": expire.timestamp()  # Convert datetime to ISO format string
     }
@@ -81,6 +124,102 @@ async def sign_in(
     return response
 
 
+@API_ADMIN_MODULE.post(
+    '/refresh',
+    summary="Refresh tokens"
+)
+async def refresh(
+    tokens: RefreshTokenScheme,
+    db: AsyncSession = Depends(get_async_db)
+) -> Response:
+    """
+    Exchange a refresh token for a new access token and a new refresh token.
+
+    Args:
+        tokens (RefreshTokenScheme): The refresh token, it can be used once.
+        db (AsyncSession): The database session.
+
+    Returns:
+        Response: new access token and refresh token.
+
+    Raises:
+        HTTPException: If the refresh token is invalid, expired or revoked.
+    """
+    manager = AdminManager(db)
+    try:
+        admin,token,expire,refresh_token = await manager.refresh_tokens(tokens.refresh_token)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=str(e),
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    response_content = {
+        "admin": admin.dict(),  # Convert user object to dictionary
+        "message": "Refresh tokens successfully",
+        "access_token": token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "token_expires_at": expire.timestamp()
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json")
+    response.set_cookie(
+        key="access_token",
+        value=token,
+        expires=expire.timestamp(),  # Convert datetime to timestamp
+        secure=False,  # Optional: Set Secure flag if using HTTPS
+        httponly=False,  # Optional: Set the HttpOnly flag for security
+        samesite=None, # Optional: Set SameSite policy
+        path="/",  # Ensure the cookie is available throughout your site
+    )
+    return response
+
+
+@API_ADMIN_MODULE.post(
+    '/sign_out',
+    summary="Sign out admin"
+)
+async def sign_out(
+    tokens: Optional[RefreshTokenScheme] = None,
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Sign out: revoke the access token of the request and, if given, the refresh token.
+
+    Args:
+        tokens (RefreshTokenScheme): The refresh token to revoke.
+        token (str): The access token of the request.
+        db (AsyncSession): The database session.
+        current_user (Admin): The current authenticated user.
+
+    Returns:
+        Response: message.
+
+    Raises:
+        HTTPException: If the refresh token is invalid or belongs to another admin.
+    """
+    manager = AdminManager(db)
+    try:
+        await manager.sign_out(decode_token(token), tokens.refresh_token if tokens else None)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    response_content = {
+        "message": "Sign out admin successfully",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json")
+    response.delete_cookie(key="access_token", path="/")
+    return response
+
+
 @API_ADMIN_MODULE.post(
     '/',
     response_model = AdminCreateResponse,
@@ -105,12 +244,16 @@ pass321S#
         HTTPException: If the admin data is invalid or an error occurs.
     """
     admin_manager = AdminManager(db)
-    admin,token,expire = await admin_manager.create_new_admin(admin)
+    try:
+        admin,token,expire,refresh_token = await admin_manager.create_new_admin(admin)
+    except PasswordPoolFull as e:
+        raise password_pool_busy(e)
     # Create JSON response content
     response_content = {
         "admin": admin.dict(),  # Convert user object to dictionary
         "message": "Admin created successfully",
         "access_token": token,
+        "refresh_token": refresh_token,
         "token_type": "bearer",
         "token_expires_at": expire.isoformat()  # Convert datetime to ISO format string
     }
@@ -165,6 +308,111 @@ async def read_admins(
 
     return response
 
+@API_ADMIN_MODULE.get(
+    '/sign_in/throttle/',
+    summary="Get sign in throttling stats"
+)
+async def read_sign_in_throttle(
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Get failed and blocked sign in attempts.
+
+    Args:
+        current_user (Admin): The current authenticated user.
+
+    Returns:
+        Response: counters of the sign in throttle.
+    """
+    response_content = {
+        "sign_in_throttle": sign_in_throttle.stats(),
+        "message": "Get sign in throttle stats successfully",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    return Response(content=response_json, media_type="application/json")
+
+
+@API_ADMIN_MODULE.get(
+    '/password-pool/',
+    summary="Get password hashing timings"
+)
+async def read_password_pool(
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Get timings of password hashing and verification.
+
+    Args:
+        current_user (Admin): The current authenticated user.
+
+    Returns:
+        Response: pending and rejected operations and timings per operation.
+    """
+    response_content = {
+        "password_pool": password_pool.stats(),
+        "message": "Get password pool stats successfully",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    return Response(content=response_json, media_type="application/json")
+
+@API_ADMIN_MODULE.get(
+    '/slow-queries/',
+    summary="Get slow SQL statements with their plans"
+)
+async def read_slow_queries(
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Get the last slow SQL statements with redacted parameters and their EXPLAIN plans.
+
+    Args:
+        current_user (Admin): The current authenticated user.
+
+    Returns:
+        Response: slow statements, newest first, and the counters of the slow query log.
+    """
+    response_content = {
+        "slow_queries": slow_query_log.stats(),
+        "message": "Get slow queries successfully",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    return Response(content=response_json, media_type="application/json")
+
+@API_ADMIN_MODULE.get(
+    '/pool-checkouts/',
+    summary="Get connection pool checkouts per route"
+)
+async def read_pool_checkouts(
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Get the connection pool checkouts and SQL statements of every route since the start of the worker,
+    the connections currently checked out of the pools and the state of the concurrency limiter.
+
+    Args:
+        current_user (Admin): The current authenticated user.
+
+    Returns:
+        Response: totals per route, most checkouts first, the state of the pools and of the limiter.
+    """
+    pools = {}
+    for name, engine in (('primary', connection.async_engine), ('replica', connection.replica_engine)):
+        if engine is not None:
+            pool = engine.pool
+            pools[name] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            }
+    response_content = {
+        "routes": route_query_stats.stats(),
+        "pools": pools,
+        "limiter": db_limiter.stats(),
+        "message": "Get pool checkouts successfully",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    return Response(content=response_json, media_type="application/json")
+
 @API_ADMIN_MODULE.get(
     "/{admin_id}",
     response_model = AdminCreateScheme,
@@ -1,21 +1,32 @@
+import datetime
 from typing import (
+    Optional,
     Union,
     Tuple
 )
-from sqlalchemy import select
+from jose import JWTError
+from sqlalchemy import delete, insert, select
+from sqlalchemy import update as update_statement
 from functions.async_logger import AsyncLogger
 from middleware.apps.admin import (
     ACCESS_TOKEN_EXPIRE_MINUTES,
     ALGORITHM
 )
+from middleware.apps import validated_values
 from middleware.apps.admin.models import Admin
+from database.unit_of_work import commit
+from middleware.apps.invalidation.bus import invalidation_bus
 
 from utils import  (
     PasswordManager as pm, 
+    PasswordPoolFull
 )
 
+from .revocation import revocation_list
 from .utils import(
-    create_access_token
+    create_access_token,
+    create_refresh_token,
+    decode_token
 )
 
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -27,6 +38,14 @@ from .schemas import (
     AdminSignInScheme,
     AdminUpdateScheme
 )
+
+
+class InvalidCredentials(Exception):
+    """
+    Raised when a sign in names an unknown admin or gives a wrong password.
+    """
+
+
 class AdminManager:
     """
     Admin manager class. This class manages the admin database. 
@@ -50,20 +69,20 @@ class AdminManager:
     async def create_new_admin(
         self,
         new: AdminCreateScheme
-    ) -> Tuple[AdminCreateScheme, str, str]:
+    ) -> Tuple[AdminCreateScheme, str, str, str]:
         """
         Create new admin.
         This method creates a new admin. 
         This method is responsible for creating a new admin.
         @params: new: AdminCreateScheme object for the new admin.
-        @return: AdminCreateScheme object for the new admin.
+        @return: AdminCreateScheme object for the new admin, access token, its expiration time and refresh token.
         @raise: Exception if any error occurs. Raises an exception.
         """
         if not new.validate():
             await self.log.b_crit(f"Validation Error: {new.errors}")
             raise ValueError(f"Validation Error: {new.errors}")
         
-        hashed_password = self.pwd.hash(new.password)
+        hashed_password = await self.pwd.hash_async(new.password)
         
         # Exclude the password field from the dictionary
         new_dict = new.dict(exclude={'password'})
@@ -71,31 +90,15 @@ class AdminManager:
         # Add the hashed password to the dictionary
         new_dict['password'] = hashed_password
 
-        # Create a new Admin instance
-        new_admin = Admin(**new_dict)
-        
-        try:
-            async with self.__async_db_session as async_session:
-                async with async_session.begin():
-                    async_session.add(new_admin)
-                    await async_session.commit()
-        except SQLAlchemyError as err_sql:
-            await self.log.b_crit(f"SQLAlchemy Error: {err_sql}")
-            raise SQLAlchemyError(f"SQLAlchemy Error: {err_sql}")
-        
-        except Exception as err:
-            await self.log.b_crit(f"Exception: {err}")
-            raise Exception(f"Exception: {err}")
+        new_dict = validated_values(Admin, new_dict)
         
         try:
-            async with self.__async_db_session as async_session:
-                new_added_admin = await async_session.execute(select(Admin)
-                                                   .filter(Admin.username == new_admin.username)
-                                                   )
-                new_added_admin = new_added_admin.scalars().first()
-                if not new_added_admin:
-                    await self.log.b_crit(f"User not found: {new_admin.username}")
-                    raise Exception(f"User not found: {new_admin.username}")
+            async_session = self.__async_db_session
+            # One INSERT ... RETURNING gives the ID, no SELECT of the new admin
+            new_added_admin = (await async_session.scalars(
+                insert(Admin).values(**new_dict).returning(Admin)
+            )).one()
+            await commit(async_session)
         except SQLAlchemyError as err_sql:
             await self.log.b_crit(f"SQLAlchemy Error: {err_sql}")
             raise SQLAlchemyError(f"SQLAlchemy Error: {err_sql}")
@@ -105,7 +108,7 @@ class AdminManager:
             raise Exception(f"Exception: {err}")
         else:
             access_token, expire = create_access_token(
-                data={"sub": str(new_added_admin.id)},
+                data={"sub": str(new_added_admin.id), "username": new_added_admin.username},
             )
             if not access_token:
                 await self.log.b_crit(f"Error creating access token")
@@ -114,9 +117,10 @@ class AdminManager:
                 await self.log.b_crit(f"Error creating access token")
                 raise Exception(f"Error creating access token")
             await self.log.b_info(f"Access Token: {access_token}")
-            return AdminCreateScheme(**new_added_admin.dict()),access_token,expire
+            refresh_token, _ = create_refresh_token(data={"sub": str(new_added_admin.id)})
+            return AdminCreateScheme(**new_added_admin.dict()),access_token,expire,refresh_token
         
-    async def sign_in_admin(self, response: AdminSignInScheme) -> Tuple[AdminSignInScheme, str, str]:
+    async def sign_in_admin(self, response: AdminSignInScheme) -> Tuple[AdminSignInScheme, str, str, str]:
         """
         sign in admin. This method signs in an admin. 
         
@@ -124,7 +128,8 @@ class AdminManager:
             response: AdminSignInScheme object for the admin to sign in.
             
         Returns:
-            AdminSignInScheme object for the admin to sign in. Or None if not found. Raises an exception.
+            AdminSignInScheme object for the admin to sign in, access token, its expiration time and
+            refresh token. Or None if not found. Raises an exception.
             
         """
         if not response.validate():
@@ -132,20 +137,22 @@ class AdminManager:
             raise ValueError(f"Response error: {response.errors}")
         
         try:
-            async with self.__async_db_session as async_session:
-                new_added_admin = await async_session.execute(select(Admin).filter(Admin.username == response.username))
-                new_added_admin = new_added_admin.scalars().first()
+            async_session = self.__async_db_session
+            new_added_admin = await async_session.execute(select(Admin).filter(Admin.username == response.username))
+            new_added_admin = new_added_admin.scalars().first()
                 
-                if not new_added_admin:
-                    await self.log.b_crit(f"Admin not found: {response.username}")
-                    raise Exception(f"Admin not found: {response.username}")
+            if not new_added_admin:
+                await self.log.b_crit(f"Admin not found: {response.username}")
+                raise InvalidCredentials(f"Admin not found: {response.username}")
             
-                # hashed_password = self.pwd.hash(response.password)
-                # await self.log.b_crit(f"response: {hashed_password}\ndatabase: {new_added_admin.password}")
-                if not self.pwd.verify(new_added_admin.password, response.password):
-                    await self.log.b_crit(f"Invalid password: {response.username}")
-                    raise Exception(f"Invalid password: {response.username}")
+            # hashed_password = self.pwd.hash(response.password)
+            # await self.log.b_crit(f"response: {hashed_password}\ndatabase: {new_added_admin.password}")
+            if not await self.pwd.verify_async(new_added_admin.password, response.password):
+                await self.log.b_crit(f"Invalid password: {response.username}")
+                raise InvalidCredentials(f"Invalid password: {response.username}")
 
+        except (InvalidCredentials, PasswordPoolFull):
+            raise
         except SQLAlchemyError as err_sql:
             await self.log.b_crit(f"SQLAlchemy Error: {err_sql}")
             raise SQLAlchemyError(f"SQLAlchemy Error: {err_sql}")
@@ -156,7 +163,7 @@ class AdminManager:
         
         else:
             access_token, expire = create_access_token(
-                data={"sub": str(new_added_admin.id)},
+                data={"sub": str(new_added_admin.id), "username": new_added_admin.username},
             )
             if not access_token:
                 await self.log.b_crit(f"Error creating access token")
@@ -165,8 +172,72 @@ class AdminManager:
                 await self.log.b_crit(f"Error creating access token")
                 raise Exception(f"Error creating access token")
             await self.log.b_info(f"Access Token: {access_token}")
-            return AdminSignInScheme(**new_added_admin.dict()), access_token,expire
+            refresh_token, _ = create_refresh_token(data={"sub": str(new_added_admin.id)})
+            return AdminSignInScheme(**new_added_admin.dict()), access_token,expire,refresh_token
                 
+    async def refresh_tokens(self, refresh_token: str) -> Tuple[AdminSignInScheme, str, datetime.datetime, str]:
+        """
+        Exchange a refresh token for a new access token and a new refresh token.
+        The refresh token is revoked, so every refresh token is used once. Whether it was
+        used is decided by the insert into revoked_tokens, not by the filters of this worker.
+        @params: refresh_token: refresh token of the admin.
+        @return: AdminSignInScheme object of the admin, access token, its expiration time and refresh token.
+        @raise: ValueError if the refresh token is invalid, expired or revoked or the admin was deleted.
+        """
+        try:
+            payload = decode_token(refresh_token)
+        except JWTError as err:
+            raise ValueError(f"Invalid refresh token: {err}")
+        if payload.get("type") != "refresh" or "jti" not in payload:
+            raise ValueError("Invalid refresh token: Not a refresh token")
+
+        try:
+            async_session = self.__async_db_session
+            admin = await async_session.execute(select(Admin).filter(Admin.id == int(payload["sub"])))
+            admin = admin.scalars().first()
+            if not admin:
+                raise ValueError(f"Invalid refresh token: Admin not found")
+
+            if not await revocation_list.revoke(async_session, payload["jti"], payload["exp"]):
+                await self.log.b_warn(f"Revoked refresh token used: admin {payload.get('sub')}")
+                raise ValueError("Invalid refresh token: Token was revoked")
+            await commit(async_session)
+        except SQLAlchemyError as err_sql:
+            await self.log.b_crit(f"SQLAlchemy Error: {err_sql}")
+            raise SQLAlchemyError(f"SQLAlchemy Error: {err_sql}")
+
+        access_token, expire = create_access_token(data={"sub": str(admin.id), "username": admin.username})
+        new_refresh_token, _ = create_refresh_token(data={"sub": str(admin.id)})
+        return AdminSignInScheme(**admin.dict()), access_token, expire, new_refresh_token
+
+    async def sign_out(self, access_payload: dict, refresh_token: Optional[str] = None) -> None:
+        """
+        Sign out: revoke the access token and the refresh token of the admin.
+        @params: access_payload: decoded access token of the request.
+        @params: refresh_token: refresh token to revoke, it must belong to the same admin.
+        @return: None
+        @raise: ValueError if the refresh token is invalid or belongs to another admin.
+        """
+        tokens = [access_payload]
+        if refresh_token:
+            try:
+                refresh_payload = decode_token(refresh_token)
+            except JWTError as err:
+                raise ValueError(f"Invalid refresh token: {err}")
+            if refresh_payload.get("type") != "refresh" or refresh_payload.get("sub") != access_payload.get("sub"):
+                raise ValueError("Invalid refresh token: Not a refresh token of the admin")
+            tokens.append(refresh_payload)
+
+        try:
+            async_session = self.__async_db_session
+            for payload in tokens:
+                if "jti" in payload:
+                    await revocation_list.revoke(async_session, payload["jti"], payload["exp"])
+            await commit(async_session)
+        except SQLAlchemyError as err_sql:
+            await self.log.b_crit(f"SQLAlchemy Error: {err_sql}")
+            raise SQLAlchemyError(f"SQLAlchemy Error: {err_sql}")
+
     async def get_admin(self, admin_id: int) -> Admin:
         """
         Get admin by ID.
@@ -176,12 +247,12 @@ class AdminManager:
         @raise: Exception if any error occurs. Raises an exception.
         """
         try:
-            async with self.__async_db_session as async_session:
-                admin = await async_session.execute(select(Admin).filter(Admin.id == admin_id))
-                admin = admin.scalars().first()
-                if not admin:
-                    await self.log.b_crit(f"Admin not found: {admin_id}")
-                    raise Exception(f"Admin not found: {admin_id}")
+            async_session = self.__async_db_session
+            admin = await async_session.execute(select(Admin).filter(Admin.id == admin_id))
+            admin = admin.scalars().first()
+            if not admin:
+                await self.log.b_crit(f"Admin not found: {admin_id}")
+                raise Exception(f"Admin not found: {admin_id}")
         except SQLAlchemyError as err_sql:
             await self.log.b_crit(f"SQLAlchemy Error: {err_sql}")
             raise SQLAlchemyError(f"SQLAlchemy Error: {err_sql}")
@@ -204,18 +275,21 @@ class AdminManager:
             await self.log.b_crit(f"Validation Error: {update.errors}")
             raise ValueError(f"Validation Error: {update.errors}")
 
+        values = validated_values(Admin, update.dict())
         try:
-            async with self.__async_db_session as async_session:
-                admin = await async_session.execute(select(Admin).filter(Admin.id == admin_id))
-                admin = admin.scalars().first()
-                if not admin:
-                    await self.log.b_crit(f"Admin not found: {admin_id}")
-                    raise Exception(f"Admin not found: {admin_id}")
-
-                for key, value in update.dict().items():
-                    setattr(admin, key, value)
+            async_session = self.__async_db_session
+            admin = (await async_session.scalars(
+                update_statement(Admin)
+                .where(Admin.id == admin_id)
+                .values(**values)
+                .returning(Admin)
+            )).first()
+            if not admin:
+                await self.log.b_crit(f"Admin not found: {admin_id}")
+                raise Exception(f"Admin not found: {admin_id}")
 
-                await async_session.commit()
+            await invalidation_bus.publish(async_session, 'admins', admin_id)
+            await commit(async_session)
         except SQLAlchemyError as err_sql:
             await self.log.b_crit(f"SQLAlchemy Error: {err_sql}")
             raise SQLAlchemyError(f"SQLAlchemy Error: {err_sql}")
@@ -234,15 +308,16 @@ class AdminManager:
         @raise: Exception if any error occurs. Raises an exception.
         """
         try:
-            async with self.__async_db_session as async_session:
-                admin = await async_session.execute(select(Admin).filter(Admin.id == admin_id))
-                admin = admin.scalars().first()
-                if not admin:
-                    await self.log.b_crit(f"Admin not found: {admin_id}")
-                    raise Exception(f"Admin not found: {admin_id}")
+            async_session = self.__async_db_session
+            deleted = (await async_session.execute(
+                delete(Admin).where(Admin.id == admin_id).returning(Admin.id)
+            )).scalar_one_or_none()
+            if deleted is None:
+                await self.log.b_crit(f"Admin not found: {admin_id}")
+                raise Exception(f"Admin not found: {admin_id}")
 
-                await async_session.delete(admin)
-                await async_session.commit()
+            await invalidation_bus.publish(async_session, 'admins', admin_id)
+            await commit(async_session)
         except SQLAlchemyError as err_sql:
             await self.log.b_crit(f"SQLAlchemy Error: {err_sql}")
             raise SQLAlchemyError(f"SQLAlchemy Error: {err_sql}")
@@ -258,9 +333,9 @@ class AdminManager:
         @raise: Exception if any error occurs. Raises an exception.
         """
         try:
-            async with self.__async_db_session as async_session:
-                admins = await async_session.execute(select(Admin))
-                admins = admins.scalars().all()
+            async_session = self.__async_db_session
+            admins = await async_session.execute(select(Admin))
+            admins = admins.scalars().all()
         except SQLAlchemyError as err_sql:
             await self.log.b_crit(f"SQLAlchemy Error: {err_sql}")
             raise SQLAlchemyError(f"SQLAlchemy Error: {err_sql}")
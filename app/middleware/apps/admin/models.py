@@ -9,9 +9,11 @@ from sqlalchemy import (
     ForeignKey, 
     DateTime, 
     Boolean, 
+    Index,
     Table,  
     TIMESTAMP, 
-    Text
+    Text,
+    text
 )
 
 
@@ -34,6 +36,19 @@ admin_table = Table(
     Column('created_at', DateTime, default=datetime.datetime.utcnow, nullable=False),
 )
 
+# Table of revoked tokens. Rows are kept until the token expires, a token
+# that expired is rejected anyway; every revocation deletes the expired rows
+# through the expires_at index
+revoked_token_table = Table(
+    'revoked_tokens',
+    metadata,
+    Column('jti', String(32), primary_key=True, nullable=False),
+    Column('expires_at', DateTime, nullable=False),
+    Column('revoked_at', DateTime, nullable=False, server_default=text("timezone('utc', now())")),
+    Index('ix_revoked_tokens_expires_at', 'expires_at'),
+    Index('ix_revoked_tokens_revoked_at', 'revoked_at'),
+)
+
 
 class Admin(Base):
     """
@@ -79,4 +94,14 @@ class Admin(Base):
                 data[attr] = value.isoformat()  # Convert datetime to ISO format string
             else:
                 data[attr] = value
-        return data
\ No newline at end of file
+        return data
+
+
+class RevokedToken(Base):
+    """
+    Revoked token model for database
+    """
+    __tablename__ = 'revoked_tokens'
+    jti: Optional[str] = Column(String(32), primary_key=True, nullable=False) # ID токена
+    expires_at: Optional[datetime.datetime] = Column(DateTime, nullable=False) # Срок действия токена, UTC
+    revoked_at: Optional[datetime.datetime] = Column(DateTime, nullable=False, server_default=text("timezone('utc', now())"))
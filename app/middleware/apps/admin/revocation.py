@@ -0,0 +1,295 @@
+"""
+Revocation list of tokens (sign out, rotated refresh tokens).
+
+Revoked jti are stored in the revoked_tokens table until the token expires
+and mirrored in memory by Bloom filters. There is one filter per
+REVOCATION_SLICE_SECONDS of token expiry, a token is looked for only in the
+slice of its exp claim, so a check is a fixed number of bit probes no matter
+how many tokens were revoked, and a slice is dropped as a whole once every
+token in it expired. Nearly every check ends in the filter; only a possible
+hit is confirmed in the table.
+
+Every worker adds a revocation once it is committed, the other workers get
+it through middleware.apps.invalidation.bus. A background task started with
+the application loads the table on start, then the revocations made since
+the last load every REVOCATION_RESYNC_SECONDS, and right away when the bus
+missed invalidations. Checks never load the table.
+"""
+import asyncio
+import datetime
+import hashlib
+import math
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from functions.async_logger import AsyncLogger
+from middleware.apps.admin import (
+    REVOCATION_ERROR_RATE,
+    REVOCATION_RESYNC_SECONDS,
+    REVOCATION_SLICE_CAPACITY,
+    REVOCATION_SLICE_SECONDS
+)
+from middleware.apps.admin.models import RevokedToken
+from middleware.apps.invalidation.bus import invalidation_bus
+
+__all__ = [
+    'BloomFilter',
+    'RevocationList',
+    'revocation_list',
+]
+
+# Revocations committed by other workers while a sync ran are picked up by
+# the next sync, which reads this many seconds before the last one
+SYNC_OVERLAP_SECONDS = 60
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+log = AsyncLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Bloom filter over 128-bit digests with double hashing.
+    """
+    __slots__ = ('size', 'hashes', 'bits', 'count')
+
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        """
+        Initialize the filter.
+        @params capacity: expected number of items.
+        @params error_rate: false positive rate at capacity.
+        @return: None
+        """
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def add(self, first: int, second: int) -> None:
+        for i in range(self.hashes):
+            position = (first + i * second) % self.size
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def contains(self, first: int, second: int) -> bool:
+        for i in range(self.hashes):
+            position = (first + i * second) % self.size
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+def _digest(jti: str) -> tuple:
+    digest = hashlib.blake2b(jti.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+def _timestamp(at: datetime.datetime) -> float:
+    """
+    Get the POSIX time of a naive UTC datetime.
+    """
+    return (at - EPOCH).total_seconds()
+
+
+class RevocationList:
+    """
+    Revoked token IDs in Bloom filters sliced by token expiry, backed by the revoked_tokens table.
+    """
+
+    def __init__(
+        self,
+        slice_seconds: int = REVOCATION_SLICE_SECONDS,
+        slice_capacity: int = REVOCATION_SLICE_CAPACITY,
+        error_rate: float = REVOCATION_ERROR_RATE,
+        resync_seconds: float = REVOCATION_RESYNC_SECONDS
+    ) -> None:
+        """
+        Initialize the revocation list.
+        @params slice_seconds: expiry time covered by one filter.
+        @params slice_capacity: expected revocations per filter.
+        @params error_rate: false positive rate of a filter at capacity.
+        @params resync_seconds: seconds between loads of revocations made by other workers.
+        @return: None
+        """
+        self.slice_seconds = slice_seconds
+        self.slice_capacity = slice_capacity
+        self.error_rate = error_rate
+        self.resync_seconds = resync_seconds
+        self.synced_at: Optional[float] = None
+        self.checks = 0
+        self.filter_hits = 0
+        self.false_positives = 0
+        self._slices: Dict[int, BloomFilter] = {}
+        self._synced_until: Optional[datetime.datetime] = None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def _drop_expired(self) -> None:
+        current = int(time.time()) // self.slice_seconds
+        for index in [index for index in self._slices if index < current]:
+            del self._slices[index]
+
+    def add(self, jti: str, expires_at: float) -> None:
+        """
+        Add a revoked token to the filters.
+        @params jti: ID of the token.
+        @params expires_at: exp claim of the token, POSIX time.
+        @return: None
+        """
+        if expires_at <= time.time():
+            return
+        index = int(expires_at) // self.slice_seconds
+        bloom = self._slices.get(index)
+        if bloom is None:
+            self._drop_expired()
+            bloom = self._slices[index] = BloomFilter(self.slice_capacity, self.error_rate)
+        bloom.add(*_digest(jti))
+
+    def might_be_revoked(self, jti: str, expires_at: float) -> bool:
+        """
+        Check the filters.
+        @params jti: ID of the token.
+        @params expires_at: exp claim of the token, POSIX time.
+        @return: False if the token is certainly not revoked.
+        """
+        self.checks += 1
+        bloom = self._slices.get(int(expires_at) // self.slice_seconds)
+        if bloom is None or not bloom.contains(*_digest(jti)):
+            return False
+        self.filter_hits += 1
+        return True
+
+    async def is_revoked(self, session: AsyncSession, jti: str, expires_at: float) -> bool:
+        """
+        Check if a token is revoked, the table is read only when the filter has the token.
+        @params session: database session.
+        @params jti: ID of the token.
+        @params expires_at: exp claim of the token, POSIX time.
+        @return: True if the token is revoked.
+        """
+        if not self.might_be_revoked(jti, expires_at):
+            return False
+        result = await session.execute(
+            text("SELECT 1 FROM revoked_tokens WHERE jti = :jti"),
+            {'jti': jti}
+        )
+        revoked = result.scalar() is not None
+        if not revoked:
+            self.false_positives += 1
+        return revoked
+
+    async def revoke(self, session: AsyncSession, jti: str, expires_at: float) -> bool:
+        """
+        Revoke a token in the transaction of the session, the caller commits.
+        Rows of tokens that expired are deleted by the same transaction.
+        The row of the token is the lock of its revocation: of two transactions revoking the
+        same token, the second waits for the first and gets False once it committed.
+        @params session: database session.
+        @params jti: ID of the token.
+        @params expires_at: exp claim of the token, POSIX time.
+        @return: True if this call revoked the token, False if it was revoked already.
+        """
+        revoked = (await session.execute(
+            insert(RevokedToken)
+            .values(jti=jti, expires_at=datetime.datetime.utcfromtimestamp(expires_at))
+            .on_conflict_do_nothing(index_elements=[RevokedToken.jti])
+            .returning(RevokedToken.jti)
+        )).scalar_one_or_none() is not None
+        if not revoked:
+            return False
+        await session.execute(
+            text("DELETE FROM revoked_tokens WHERE expires_at < timezone('utc', now())").execution_options(primary=True)
+        )
+        await invalidation_bus.publish(session, 'revoked_tokens', [jti, expires_at])
+        return True
+
+    def invalidate(self, key: Optional[list]) -> None:
+        """
+        Apply a revocation published by a worker.
+        @params key: [jti, exp] of the revoked token, None to load the table right away.
+        @return: None
+        """
+        if key is None:
+            self._wake.set()
+        else:
+            self.add(*key)
+
+    async def sync(self, session: AsyncSession) -> None:
+        """
+        Load revocations made since the last sync, all unexpired ones on the first sync.
+        @params session: database session.
+        @return: None
+        """
+        since = self._synced_until - datetime.timedelta(seconds=SYNC_OVERLAP_SECONDS) if self._synced_until else EPOCH
+        result = await session.execute(
+            text("""
+                SELECT jti, expires_at, revoked_at FROM revoked_tokens
+                WHERE revoked_at >= :since AND expires_at > timezone('utc', now())
+            """),
+            {'since': since}
+        )
+        for jti, expires_at, revoked_at in result.all():
+            self.add(jti, _timestamp(expires_at))
+            if self._synced_until is None or revoked_at > self._synced_until:
+                self._synced_until = revoked_at
+        self._drop_expired()
+        self.synced_at = time.monotonic()
+
+    async def start(self) -> None:
+        """
+        Load the table and start the background loads.
+        """
+        if self._task is not None:
+            return
+        await self._load()
+        self._task = asyncio.create_task(self._resync())
+
+    async def stop(self) -> None:
+        """
+        Stop the background loads.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _load(self) -> None:
+        from database import connection
+
+        try:
+            async with connection.AsyncSessionLocal() as session:
+                await self.sync(session)
+        except Exception as e:
+            await log.b_err(f"Failed to load revoked tokens: {e}")
+
+    async def _resync(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.resync_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._load()
+
+    def stats(self) -> dict:
+        """
+        Get counters of the revocation list.
+        @return: dict with checks, filter hits, false positives and the size of the filters.
+        """
+        return {
+            'checks': self.checks,
+            'filter_hits': self.filter_hits,
+            'false_positives': self.false_positives,
+            'slices': len(self._slices),
+            'revoked': sum(bloom.count for bloom in self._slices.values()),
+            'bytes': sum(len(bloom.bits) for bloom in self._slices.values()),
+        }
+
+
+revocation_list = RevocationList()
+invalidation_bus.register('revoked_tokens', revocation_list.invalidate)
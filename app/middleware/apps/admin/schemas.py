@@ -173,4 +173,10 @@ class TokenData(BaseModel):
     """
     Token data Schema.
     """
-    username: Optional[str] = None
\ No newline at end of file
+    username: Optional[str] = None
+# Модель refresh токена
+class RefreshTokenScheme(BaseModel):
+    """
+    Refresh token Schema.
+    """
+    refresh_token: str = Field(..., min_length=1, max_length=2048)
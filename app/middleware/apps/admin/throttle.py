@@ -0,0 +1,157 @@
+"""
+Brute-force throttling of /admins/sign_in.
+
+Failed sign ins are counted per username and per client IP in a sliding
+window of SIGN_IN_WINDOW_SECONDS. After SIGN_IN_FREE_FAILURES[kind] failures
+a key has to wait SIGN_IN_BACKOFF_BASE_SECONDS, doubled with every further
+failure, up to a lockout of SIGN_IN_LOCKOUT_SECONDS. A waiting key is
+answered with 429 before the admin is looked up or a password is hashed, so
+guessing passwords costs the server nearly nothing. A successful sign in
+clears the failures of the username, never of the IP.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional
+
+from middleware.apps.admin import (
+    SIGN_IN_BACKOFF_BASE_SECONDS,
+    SIGN_IN_FREE_FAILURES,
+    SIGN_IN_LOCKOUT_SECONDS,
+    SIGN_IN_WINDOW_SECONDS
+)
+
+__all__ = [
+    'SignInThrottle',
+    'sign_in_throttle',
+]
+
+
+class FailureWindow:
+    """
+    Failures of one key in the sliding window and the time until the key is blocked.
+    """
+    __slots__ = ('failures', 'blocked_until')
+
+    def __init__(self) -> None:
+        self.failures: Deque[float] = deque()
+        self.blocked_until = 0.0
+
+
+class SignInThrottle:
+    """
+    Exponential backoff and lockout of sign in failures per username and IP.
+    """
+
+    def __init__(
+        self,
+        free_failures: Dict[str, int] = SIGN_IN_FREE_FAILURES,
+        window_seconds: float = SIGN_IN_WINDOW_SECONDS,
+        backoff_base_seconds: float = SIGN_IN_BACKOFF_BASE_SECONDS,
+        lockout_seconds: float = SIGN_IN_LOCKOUT_SECONDS,
+        max_keys: int = 100_000
+    ) -> None:
+        """
+        Initialize the throttle.
+        @params free_failures: key kind -> failures in the window before backoff starts.
+        @params window_seconds: seconds a failure is counted.
+        @params backoff_base_seconds: wait after the first failure over the free ones.
+        @params lockout_seconds: longest wait.
+        @params max_keys: number of keys kept per kind, least recently used keys are dropped.
+        @return: None
+        """
+        self.free_failures = dict(free_failures)
+        self.window_seconds = window_seconds
+        self.backoff_base_seconds = backoff_base_seconds
+        self.lockout_seconds = lockout_seconds
+        self.max_keys = max_keys
+        self.failures_total = 0
+        self.blocked: Dict[str, int] = {kind: 0 for kind in free_failures}
+        self.blocked_total = 0
+        self.lockouts = 0
+        self._windows: Dict[str, 'OrderedDict[str, FailureWindow]'] = {kind: OrderedDict() for kind in free_failures}
+
+    def _window(self, kind: str, key: str, create: bool) -> Optional[FailureWindow]:
+        windows = self._windows[kind]
+        window = windows.get(key)
+        if window is None:
+            if not create:
+                return None
+            window = windows[key] = FailureWindow()
+            if len(windows) > self.max_keys:
+                windows.popitem(last=False)
+        else:
+            windows.move_to_end(key)
+        return window
+
+    def check(self, keys: Dict[str, Optional[str]]) -> float:
+        """
+        Check if a sign in may be tried.
+        @params keys: key kind -> key, kinds without a key are not throttled.
+        @return: 0 if the sign in may be tried, otherwise seconds until it may.
+        """
+        now = time.monotonic()
+        retry_after = 0.0
+        for kind, key in keys.items():
+            if not key or kind not in self._windows:
+                continue
+            window = self._windows[kind].get(key)
+            if window is not None and window.blocked_until > now:
+                self.blocked[kind] += 1
+                retry_after = max(retry_after, window.blocked_until - now)
+        if retry_after:
+            self.blocked_total += 1
+        return retry_after
+
+    def failure(self, keys: Dict[str, Optional[str]]) -> None:
+        """
+        Count a failed sign in and block its keys if they are over their free failures.
+        @params keys: key kind -> key.
+        @return: None
+        """
+        now = time.monotonic()
+        self.failures_total += 1
+        for kind, key in keys.items():
+            if not key or kind not in self._windows:
+                continue
+            window = self._window(kind, key, create=True)
+            failures = window.failures
+            while failures and failures[0] <= now - self.window_seconds:
+                failures.popleft()
+            failures.append(now)
+
+            over = len(failures) - self.free_failures[kind]
+            if over > 0:
+                wait = min(self.lockout_seconds, self.backoff_base_seconds * 2 ** (over - 1))
+                if wait >= self.lockout_seconds:
+                    self.lockouts += 1
+                window.blocked_until = now + wait
+
+    def success(self, username: Optional[str]) -> None:
+        """
+        Clear the failures of a username after a successful sign in.
+        @params username: username of the admin.
+        @return: None
+        """
+        if username and 'username' in self._windows:
+            self._windows['username'].pop(username, None)
+
+    def stats(self) -> dict:
+        """
+        Get counters of the throttle.
+        @return: dict with failed and blocked sign ins, lockouts and tracked and blocked keys per kind.
+        """
+        now = time.monotonic()
+        return {
+            'failures': self.failures_total,
+            'blocked': dict(self.blocked),
+            'blocked_total': self.blocked_total,
+            'lockouts': self.lockouts,
+            'tracked_keys': {kind: len(windows) for kind, windows in self._windows.items()},
+            'blocked_keys': {
+                kind: sum(1 for window in windows.values() if window.blocked_until > now)
+                for kind, windows in self._windows.items()
+            },
+        }
+
+
+sign_in_throttle = SignInThrottle()
@@ -1,3 +1,6 @@
+import hashlib
+import time
+import uuid
 from datetime import (
     datetime, 
     timedelta
@@ -23,33 +26,113 @@ from middleware.apps.admin import oauth2_scheme
 from middleware.apps.admin.models import Admin
 from database.session import get_async_db
 from core import cfg
-from middleware.apps.admin import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM
+from middleware.apps.admin import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    ADMIN_CACHE_SECONDS,
+    ADMIN_CACHE_SIZE,
+    ALGORITHM,
+    REFRESH_TOKEN_EXPIRE_DAYS,
+    TOKEN_CACHE_SIZE,
+    TRUST_TOKEN_CLAIMS_MINUTES
+)
+from middleware.apps.admin.revocation import revocation_list
+from middleware.apps.invalidation.bus import invalidation_bus
+from utils import TTLCache
+
+# Authenticated admins by ID. Column values without the password hash are cached,
+# AdminManager.update_admin and delete_admin invalidate their admin on every worker.
+admin_cache = TTLCache(ADMIN_CACHE_SECONDS, ADMIN_CACHE_SIZE)
+invalidation_bus.register(
+    'admins',
+    lambda admin_id: admin_cache.clear() if admin_id is None else admin_cache.pop(admin_id)
+)
+
+PRINCIPAL_FIELDS = ('id', 'name', 'surname', 'email', 'phone', 'username', 'created_at')
+
+# Claims of verified tokens by token digest, every entry expires with its token
+token_cache = TTLCache(ACCESS_TOKEN_EXPIRE_MINUTES * 60, TOKEN_CACHE_SIZE)
 
 def create_access_token(
         data: dict,
         expires_delta=None,
+        token_type: str = "access",
 ) -> tuple[str, datetime | Any]:
     """
     Create an access token with the given data and expiration time.
+    Every token gets a unique jti, the ID used to revoke it.
 
     Args:
         data: A dictionary containing the data to be encoded in the token.
         expires_delta: The expiration time for the token. If not provided, the token will expire after 30 minutes.
+        token_type: "access" or "refresh", only access tokens authenticate requests.
         ACCESS_TOKEN_EXPIRE_MINUTES: int = 999,
         ALGORITHM: str = "HS256"
     Returns:
         The encoded access token.
     """
     to_encode = data.copy()
+    issued_at = datetime.utcnow()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = issued_at + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+        expire = issued_at + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": issued_at, "jti": uuid.uuid4().hex, "type": token_type})
     encoded_jwt = jwt.encode(to_encode, cfg['BACKEND_SECRET_COOKIE_KEY'], algorithm=ALGORITHM)
     return encoded_jwt, expire
 
 
+def create_refresh_token(data: dict) -> tuple[str, datetime]:
+    """
+    Create a refresh token, it is exchanged for new tokens at /admins/refresh.
+
+    Args:
+        data: A dictionary containing the data to be encoded in the token.
+    Returns:
+        The encoded refresh token and its expiration time.
+    """
+    return create_access_token(data, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS), token_type="refresh")
+
+
+async def check_not_revoked(payload: dict, db: AsyncSession) -> None:
+    """
+    Check that a token was not revoked.
+
+    Args:
+        payload: decoded token.
+        db: The database session, used only if the token may be revoked.
+    Raises:
+        HTTPException: If the token was revoked.
+    """
+    if "jti" in payload and await revocation_list.is_revoked(db, payload["jti"], payload["exp"]):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Could not validate credentials: Token was revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+def decode_token(token: str) -> dict:
+    """
+    Verify and decode a token. Verified tokens are served from token_cache until their exp,
+    so the signature of a token is checked once per process instead of once per request.
+    Args:
+        token: The token to decode.
+    Returns:
+        Claims of the token, a new dict on every call.
+    Raises:
+        JWTError: If the token is invalid or expired.
+    """
+    digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    payload = token_cache.get(digest)
+    if payload is None:
+        payload = jwt.decode(token, cfg['BACKEND_SECRET_COOKIE_KEY'], algorithms=[ALGORITHM])
+        if "exp" in payload:
+            ttl = payload["exp"] - time.time()
+            if ttl > 0:
+                token_cache.set(digest, payload, ttl)
+    return dict(payload)
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme), 
     db: AsyncSession = Depends(get_async_db)
@@ -63,7 +146,7 @@ async def get_current_user(
         The current user. If the token is invalid, return None.
     """
     try:
-        payload = jwt.decode(token, cfg['BACKEND_SECRET_COOKIE_KEY'], algorithms=[ALGORITHM])
+        payload = decode_token(token)
         user_id = int(payload.get("sub"))
         
         if user_id is None:
@@ -80,21 +163,51 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    user = await db.execute(select(Admin).filter(Admin.id == user_id))
-    user = user.scalars().first()
-    
-    if user is None:
+    if payload.get("type", "access") != "access":
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Could not validate credentials: Admin not found",
+            detail=f"Could not validate credentials: Not an access token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return user
+    await check_not_revoked(payload, db)
+
+    if trusts_claims(payload):
+        return Admin(id=user_id, username=payload.get("username"))
+
+    principal = admin_cache.get(user_id)
+    if principal is None:
+        user = await db.execute(select(Admin).filter(Admin.id == user_id))
+        user = user.scalars().first()
+
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=f"Could not validate credentials: Admin not found",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        principal = {field: getattr(user, field) for field in PRINCIPAL_FIELDS}
+        admin_cache.set(user_id, principal)
+    # A new transient object per request, so callers never share state
+    return Admin(**principal)
+
+
+def trusts_claims(payload: dict) -> bool:
+    """
+    Check if a token is short-lived enough to be trusted without looking the admin up.
+    Args:
+        payload: decoded token.
+    Returns:
+        True if TRUST_TOKEN_CLAIMS_MINUTES is set and the token lives at most that long.
+    """
+    if not TRUST_TOKEN_CLAIMS_MINUTES or "iat" not in payload or "exp" not in payload:
+        return False
+    return payload["exp"] - payload["iat"] <= TRUST_TOKEN_CLAIMS_MINUTES * 60
+
 
 # Функция для проверки JWT токена
 def verify_token(token: str, credentials_exception):
     try:
-        payload = jwt.decode(token, cfg['BACKEND_SECRET_COOKIE_KEY'], algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -0,0 +1,20 @@
+__doc__ = """
+A package for application feedbacks in API server
+"""
+
+# Rate limits of POST /feedback/: key kind -> (requests per minute, burst)
+FEEDBACK_RATE_LIMITS = {
+    'ip': (10, 5),
+    'email': (2, 3),
+}
+
+# Near-duplicate detection of feedback descriptions, see middleware.apps.feedback.dedup
+DEDUP_SHINGLE_SIZE = 5
+DEDUP_NUM_PERMUTATIONS = 128
+DEDUP_BANDS = 16
+DEDUP_THRESHOLD = 0.7
+DEDUP_RESYNC_SECONDS = 600
+
+# Inbox totals are counted exactly below this number of feedbacks,
+# above it they are estimated from planner statistics
+FEEDBACK_EXACT_COUNT_LIMIT = 10_000
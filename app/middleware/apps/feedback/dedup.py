@@ -0,0 +1,297 @@
+"""
+Near-duplicate detection of feedback descriptions with MinHash and LSH.
+
+A description is normalized (lower case, collapsed whitespace) and split into
+character shingles of DEDUP_SHINGLE_SIZE, every shingle is hashed and the
+MinHash signature is the minimum of DEDUP_NUM_PERMUTATIONS universal hash
+functions over the shingles, all computed with NumPy in one pass. Signatures
+are split into DEDUP_BANDS bands, feedbacks sharing a band are candidates
+and candidates with estimated Jaccard similarity >= DEDUP_THRESHOLD are near
+duplicates.
+
+The index lives in the process and is updated by every feedback write of
+the worker. A background task started with the application rebuilds it from
+the database on start and every DEDUP_RESYNC_SECONDS: the rows are read,
+their signatures and buckets are computed in a thread, off the event loop,
+and swapped in; writes made during the rebuild are applied again to the new
+index. Requests never rebuild it.
+"""
+import asyncio
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from middleware.apps.feedback import (
+    DEDUP_BANDS,
+    DEDUP_NUM_PERMUTATIONS,
+    DEDUP_RESYNC_SECONDS,
+    DEDUP_SHINGLE_SIZE,
+    DEDUP_THRESHOLD
+)
+from functions.async_logger import AsyncLogger
+from middleware.apps.feedback.models import FeedBack
+
+__all__ = [
+    'FeedbackIndex',
+    'feedback_index',
+]
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Odd multiplier of the polynomial shingle hash
+SHINGLE_BASE = np.uint64(1_000_003)
+
+# Characters of a description kept for cluster samples
+SAMPLE_LENGTH = 200
+
+# Near duplicates returned for a new description, bounds the check of a
+# description copied thousands of times
+DUPLICATES_LIMIT = 16
+
+log = AsyncLogger(__name__)
+
+
+class FeedbackIndex:
+    """
+    MinHash LSH index of feedback descriptions.
+    """
+
+    def __init__(
+        self,
+        shingle_size: int = DEDUP_SHINGLE_SIZE,
+        num_permutations: int = DEDUP_NUM_PERMUTATIONS,
+        bands: int = DEDUP_BANDS,
+        threshold: float = DEDUP_THRESHOLD,
+        resync_seconds: float = DEDUP_RESYNC_SECONDS,
+        seed: int = 1
+    ) -> None:
+        """
+        Initialize the index.
+        @params shingle_size: number of characters of a shingle.
+        @params num_permutations: length of MinHash signatures, must be divisible by bands.
+        @params bands: number of LSH bands.
+        @params threshold: estimated Jaccard similarity of near duplicates.
+        @params resync_seconds: seconds after which the index should be rebuilt from the database.
+        @params seed: seed of the hash functions, equal seeds give equal signatures.
+        @return: None
+        """
+        if num_permutations % bands:
+            raise ValueError("num_permutations must be divisible by bands")
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = num_permutations // bands
+        self.threshold = threshold
+        self.resync_seconds = resync_seconds
+        self.synced_at: Optional[float] = None
+
+        random = np.random.default_rng(seed)
+        self._a = random.integers(1, 2 ** 63, size=(num_permutations, 1), dtype=np.uint64) | np.uint64(1)
+        self._b = random.integers(0, 2 ** 63, size=(num_permutations, 1), dtype=np.uint64)
+        self._reset()
+        self._changes: Optional[List[tuple]] = None  # writes made during a rebuild
+        self._task: Optional[asyncio.Task] = None
+
+    def _reset(self) -> None:
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._samples: Dict[int, str] = {}
+        self._buckets: List[Dict[bytes, Set[int]]] = [{} for _ in range(self.bands)]
+        self._clusters: Optional[List[dict]] = None
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Get the MinHash signature of a text.
+        @params text: text.
+        @return: array of num_permutations uint64 values.
+        """
+        normalized = WHITESPACE_PATTERN.sub(' ', text.lower()).strip()
+        codes = np.frombuffer(normalized.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        size = min(self.shingle_size, len(codes)) or 1
+        if not len(codes):
+            codes = np.zeros(1, dtype=np.uint64)
+
+        count = len(codes) - size + 1
+        shingles = np.zeros(count, dtype=np.uint64)
+        for offset in range(size):
+            shingles = shingles * SHINGLE_BASE + codes[offset:offset + count]
+
+        # Universal hashing modulo 2^64, the high bits are the best mixed ones
+        hashes = (self._a * shingles + self._b) >> np.uint64(32)
+        return hashes.min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _similar(self, signature: np.ndarray, limit: int = DUPLICATES_LIMIT) -> List[int]:
+        duplicates: List[int] = []
+        checked: Set[int] = set()
+        for band, key in self._band_keys(signature):
+            for candidate in self._buckets[band].get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if np.count_nonzero(self._signatures[candidate] == signature) >= self.threshold * len(signature):
+                    duplicates.append(candidate)
+                    if len(duplicates) >= limit:
+                        return sorted(duplicates)
+        return sorted(duplicates)
+
+    def _insert(self, feedback_id: int, text: str, signature: np.ndarray) -> None:
+        self._signatures[feedback_id] = signature
+        self._samples[feedback_id] = text[:SAMPLE_LENGTH]
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, set()).add(feedback_id)
+        self._clusters = None
+
+    def add(self, feedback_id: int, text: str) -> List[int]:
+        """
+        Add or replace the description of a feedback.
+        @params feedback_id: The ID of the feedback.
+        @params text: description of the feedback.
+        @return: IDs of at most DUPLICATES_LIMIT other feedbacks with near-duplicate descriptions.
+        """
+        self.remove(feedback_id)
+        if self._changes is not None:
+            self._changes.append((feedback_id, text))
+        signature = self.signature(text)
+        duplicates = self._similar(signature)
+        self._insert(feedback_id, text, signature)
+        return duplicates
+
+    def remove(self, feedback_id: int) -> None:
+        """
+        Remove a feedback from the index.
+        @params feedback_id: The ID of the feedback.
+        @return: None
+        """
+        if self._changes is not None:
+            self._changes.append((feedback_id, None))
+        signature = self._signatures.pop(feedback_id, None)
+        if signature is None:
+            return
+        self._samples.pop(feedback_id, None)
+        for band, key in self._band_keys(signature):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(feedback_id)
+                if not bucket:
+                    del self._buckets[band][key]
+        self._clusters = None
+
+    def clusters(self, min_size: int = 2) -> List[dict]:
+        """
+        Group near-duplicate feedbacks. Clusters are recomputed only after the index changed.
+        @params min_size: smallest cluster size returned.
+        @return: list of clusters ordered by size, every cluster is a dict with
+                 cluster_id (smallest feedback ID), size, feedback_ids and sample.
+        """
+        if self._clusters is None:
+            parents = {feedback_id: feedback_id for feedback_id in self._signatures}
+
+            def find(feedback_id: int) -> int:
+                while parents[feedback_id] != feedback_id:
+                    parents[feedback_id] = parents[parents[feedback_id]]
+                    feedback_id = parents[feedback_id]
+                return feedback_id
+
+            # Every bucket member is compared to the first member only, so a bucket costs linear time
+            for buckets in self._buckets:
+                for members in buckets.values():
+                    if len(members) < 2:
+                        continue
+                    first, *others = sorted(members)
+                    for other in others:
+                        if np.count_nonzero(self._signatures[first] == self._signatures[other]) >= self.threshold * len(self._signatures[first]):
+                            parents[find(other)] = find(first)
+
+            groups: Dict[int, List[int]] = {}
+            for feedback_id in self._signatures:
+                groups.setdefault(find(feedback_id), []).append(feedback_id)
+            self._clusters = sorted(
+                (
+                    {
+                        'cluster_id': min(members),
+                        'size': len(members),
+                        'feedback_ids': sorted(members),
+                        'sample': self._samples[min(members)],
+                    }
+                    for members in groups.values()
+                ),
+                key=lambda cluster: (-cluster['size'], cluster['cluster_id'])
+            )
+        return [cluster for cluster in self._clusters if cluster['size'] >= min_size]
+
+    def _build(self, rows: Sequence[Tuple[int, str]]) -> tuple:
+        """
+        Compute signatures, samples and buckets of rows without touching the index, runs in a thread.
+        """
+        signatures: Dict[int, np.ndarray] = {}
+        samples: Dict[int, str] = {}
+        buckets: List[Dict[bytes, Set[int]]] = [{} for _ in range(self.bands)]
+        for feedback_id, description in rows:
+            signature = signatures[feedback_id] = self.signature(description)
+            samples[feedback_id] = description[:SAMPLE_LENGTH]
+            for band, key in self._band_keys(signature):
+                buckets[band].setdefault(key, set()).add(feedback_id)
+        return signatures, samples, buckets
+
+    async def load(self, rows: Sequence[Tuple[int, str]]) -> None:
+        """
+        Replace the index by rows. The signatures are computed in a thread, the index keeps
+        answering meanwhile and writes made meanwhile are applied to the new index.
+        @params rows: (feedback ID, description) tuples.
+        @return: None
+        """
+        self._changes = []
+        try:
+            built = await asyncio.get_running_loop().run_in_executor(None, self._build, rows)
+        except BaseException:
+            self._changes = None
+            raise
+        changes, self._changes = self._changes, None
+        self._reset()
+        self._signatures, self._samples, self._buckets = built
+        for feedback_id, text in changes:
+            if text is None:
+                self.remove(feedback_id)
+            else:
+                self.add(feedback_id, text)
+        self.synced_at = time.monotonic()
+
+    async def start(self) -> None:
+        """
+        Start the background rebuilds, the first one right away.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._resync())
+
+    async def stop(self) -> None:
+        """
+        Stop the background rebuilds.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _resync(self) -> None:
+        from database import connection
+
+        while True:
+            try:
+                # The connection goes back to the pool before the signatures are computed
+                async with connection.AsyncSessionLocal() as session:
+                    rows = (await session.execute(select(FeedBack.id, FeedBack.description))).all()
+                await self.load(rows)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await log.b_err(f"Failed to rebuild the feedback index: {e}")
+            await asyncio.sleep(self.resync_seconds)
+
+
+feedback_index = FeedbackIndex()
@@ -1,13 +1,15 @@
 from typing import List, Optional
 import json
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from middleware.apps.admin.models import Admin
 from middleware.apps.admin.utils import get_current_user
+from middleware.apps.feedback import FEEDBACK_RATE_LIMITS
 from middleware.apps.feedback.manager import FeedBackManager
 from middleware.apps.feedback.schemas import CreateFeedBackSchema, UpdateFeedBackSchema
 from database.session import get_async_db
+from utils import RateLimiter
 
 
 API_FEEDBACK_MODULE = APIRouter(
@@ -17,6 +19,8 @@ API_FEEDBACK_MODULE = APIRouter(
 
 CreateFeedBackResponse = CreateFeedBackSchema
 
+feedback_rate_limiter = RateLimiter("feedback", FEEDBACK_RATE_LIMITS)
+
 async def get_feedback_manager(
     db_session: AsyncSession = Depends(get_async_db)
 ) -> 'FeedBackManager':
@@ -35,6 +39,7 @@ async def get_feedback_manager(
     '/',
     response_model=CreateFeedBackResponse,
     summary='Create feedback',
+    dependencies=[Depends(feedback_rate_limiter)],
 )
 async def create_feedback(
     feedback: CreateFeedBackResponse = Depends(),
@@ -47,7 +52,7 @@ async def create_feedback(
     status_code: status
 
     try:
-        new_feedback = await feedback_manager.create_feedback(feedback)
+        new_feedback, created = await feedback_manager.create_feedback(feedback)
     except Exception as e:
         status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         raise HTTPException(
@@ -56,8 +61,12 @@ async def create_feedback(
         )
     else:
         response_content['feedback'] = new_feedback
-        response_content['detail'] = "Successfully created feedback"
-        status_code = status.HTTP_201_CREATED  # 201 Created
+        if created:
+            response_content['detail'] = "Successfully created feedback"
+            status_code = status.HTTP_201_CREATED  # 201 Created
+        else:
+            response_content['detail'] = "Successfully updated feedback"
+            status_code = status.HTTP_200_OK  # 200 OK
     finally:
         if not response_content.get('feedback', None):
             response_content['feedback'] = None
@@ -68,6 +77,104 @@ async def create_feedback(
     response = Response(content=response_json, media_type="application/json", status_code=status_code)
     return response
 
+@API_FEEDBACK_MODULE.get(
+    '/rate-limit/',
+    summary='Get rate limiter counters of feedback creation',
+)
+async def get_feedback_rate_limit(
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Get counters of allowed and rejected feedback submissions. API endpoint.
+    @return: Response object.
+    """
+    response_content = {
+        'rate_limit': feedback_rate_limiter.stats(),
+        'details': "Successfully get rate limit counters",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json", status_code=status.HTTP_202_ACCEPTED)
+    return response
+
+@API_FEEDBACK_MODULE.get(
+    '/clusters/',
+    summary='Get clusters of near-duplicate feedbacks',
+)
+async def get_feedback_clusters(
+    min_size: int = Query(2, ge=1),
+    limit: int = Query(50, ge=1, le=500),
+    feedback_manager: 'FeedBackManager' = Depends(get_feedback_manager),
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Get clusters of near-duplicate feedbacks, largest first. API endpoint.
+    @params: min_size: smallest cluster size.
+    @params: limit: maximal number of clusters.
+    @params: feedback_manager: Dependency
+    @return: Response object.
+    @raise: HTTPException if clusters could not be computed.
+    """
+    try:
+        clusters = await feedback_manager.get_feedback_clusters(min_size, limit)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+    response_content = {
+        'clusters': clusters,
+        'details': "Successfully get feedback clusters",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json", status_code=status.HTTP_202_ACCEPTED)
+    return response
+
+@API_FEEDBACK_MODULE.get(
+    '/inbox/',
+    summary='Search the feedback inbox',
+)
+async def search_feedbacks(
+    email: Optional[str] = Query(None, max_length=255, description="Email prefix"),
+    name: Optional[str] = Query(None, max_length=255, description="Full name prefix"),
+    q: Optional[str] = Query(None, max_length=255, description="Keywords of the description"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[int] = Query(None, description="next_cursor of the previous page"),
+    feedback_manager: 'FeedBackManager' = Depends(get_feedback_manager),
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Search feedbacks by email and name prefixes and description keywords, newest first. API endpoint.
+    @params: email: email prefix.
+    @params: name: full name prefix.
+    @params: q: keywords of the description.
+    @params: limit: page size.
+    @params: cursor: cursor of the page.
+    @params: feedback_manager: Dependency
+    @return: Response object.
+    @raise: HTTPException if feedbacks could not be searched.
+    """
+    try:
+        feedbacks, next_cursor, total, approximate = await feedback_manager.search_feedbacks(
+            email, name, q, limit, cursor
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+    response_content = {
+        'feedbacks': feedbacks,
+        'next_cursor': next_cursor,
+        'total': total,
+        'total_approximate': approximate,
+        'details': "Successfully searched feedbacks",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json", status_code=status.HTTP_202_ACCEPTED)
+    return response
+
 @API_FEEDBACK_MODULE.get(
     '/{feedback_id}',
     response_model=CreateFeedBackResponse,
@@ -0,0 +1,26 @@
+"""
+Background jobs of feedbacks, run by middleware.apps.outbox.queue.
+Notifications and moderation of new feedback belong here, not in the request.
+"""
+from functions.async_logger import AsyncLogger
+from middleware.apps.outbox.queue import job_queue
+
+__all__ = [
+    'FEEDBACK_SUBMITTED',
+]
+
+# Job kind enqueued for every created or updated feedback
+FEEDBACK_SUBMITTED = 'feedback.submitted'
+
+log = AsyncLogger(__name__)
+
+
+@job_queue.handler(FEEDBACK_SUBMITTED)
+async def notify_feedback_submitted(payload: dict) -> None:
+    """
+    Notify about a submitted feedback.
+    @params payload: dict with feedback_id and created flag.
+    @return: None
+    """
+    action = "New" if payload.get('created') else "Updated"
+    await log.b_info(f"{action} feedback: {payload['feedback_id']}")
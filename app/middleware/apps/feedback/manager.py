@@ -1,19 +1,33 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import select
+from sqlalchemy import delete, func, literal, literal_column, select, text
+from sqlalchemy import update as update_statement
+from sqlalchemy.dialects.postgresql import insert
 
+import json
 from typing import (
     List,
+    Optional,
     Union,
     Tuple
 )
 
+from database.unit_of_work import after_commit, commit
+from middleware.apps import validated_values
+from middleware.apps.feedback import FEEDBACK_EXACT_COUNT_LIMIT
+
+from middleware.apps.feedback.dedup import feedback_index
+from middleware.apps.feedback.jobs import FEEDBACK_SUBMITTED
 from middleware.apps.feedback.models import FeedBack
+from middleware.apps.outbox.models import OutboxJob
+from middleware.apps.outbox.queue import job_queue
 from functions.async_logger import AsyncLogger
 
 from .schemas import *
 
-
+# Text search configuration of the description index, rendered as a constant
+# so the query expression matches the index expression
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
 
 
 class FeedBackManager:
@@ -39,11 +53,15 @@ class FeedBackManager:
     async def create_feedback(
         self,
         new: CreateFeedBackSchema
-    ) -> CreateFeedBackSchema:
+    ) -> Tuple[CreateFeedBackSchema, bool]:
         """
-        Create a new feedback
+        Create a new feedback or replace the feedback of the same email.
+        Repeat submits are a single INSERT ... ON CONFLICT (email) DO UPDATE statement, the
+        FEEDBACK_SUBMITTED background job is inserted into the outbox by the same statement.
+        The description is checked against the near-duplicate index, the IDs of the feedbacks
+        it duplicates are returned under 'duplicates'.
         @params new: CreateFeedBackSchema object
-        @return: CreateFeedBackSchema object
+        @return: CreateFeedBackSchema object with duplicates and True if the feedback was created, False if it was updated
         @raise: Exception if database session is not initialized
         """
         if not new.validate():
@@ -53,16 +71,55 @@ class FeedBackManager:
             new_feedback = FeedBack(**new.dict())
         except:
             raise Exception("РАЗРАБ ДОЛБАЕБ УХЙ!")
+
+        values = {
+            'fullname': new_feedback.fullname,
+            'email': new_feedback.email,
+            'description': new_feedback.description,
+            'phone': new_feedback.phone,
+        }
+        statement = insert(FeedBack).values(**values)
+        upsert = statement.on_conflict_do_update(
+            index_elements=[FeedBack.email],
+            set_={
+                'fullname': statement.excluded.fullname,
+                'description': statement.excluded.description,
+                'phone': statement.excluded.phone,
+            }
+        ).returning(
+            FeedBack.id,
+            FeedBack.fullname,
+            FeedBack.email,
+            FeedBack.description,
+            FeedBack.phone,
+            literal_column('xmax = 0').label('created')  # xmax is 0 for inserted rows
+        ).cte('feedback')
+        job = insert(OutboxJob).from_select(
+            ['kind', 'payload'],
+            select(
+                literal(FEEDBACK_SUBMITTED),
+                func.jsonb_build_object('feedback_id', upsert.c.id, 'created', upsert.c.created)
+            )
+        ).cte('job')
+        # The writes are CTEs of a SELECT, see database.routing
+        statement = select(upsert).add_cte(job).execution_options(primary=True)
         try:
-            async with self.__async_db_session as async_session:
-                async with async_session.begin():
-                    async_session.add(new_feedback)
-                    await async_session.commit()
+            async_session = self.__async_db_session
+            result = await async_session.execute(statement)
+            row = result.mappings().one()
+            await commit(async_session)
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Failed to create feedback: {e}")
             raise SQLAlchemyError(f"Failed to create feedback: {e}")
-        
-        return new_feedback.dict()
+
+        feedback = dict(row)
+        created = feedback.pop('created')
+        after_commit(async_session, job_queue.wake)
+        # Added right away to get the duplicates for the response. The statement above is the last
+        # write of the request, a feedback whose commit fails is dropped by the next rebuild.
+        feedback['duplicates'] = feedback_index.add(feedback['id'], feedback['description'])
+        return feedback, created
+
     async def get_feedback_by_id(
         self,
         feedback_id: int
@@ -74,12 +131,12 @@ class FeedBackManager:
         @raise: Exception if any error occurs.
         """
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(FeedBack).filter_by(id=feedback_id))
-                feedback = result.scalar_one_or_none()
-                if feedback:
-                    return feedback.dict()
-                return None
+            async_session = self.__async_db_session
+            result = await async_session.execute(select(FeedBack).filter_by(id=feedback_id))
+            feedback = result.scalar_one_or_none()
+            if feedback:
+                return feedback.dict()
+            return None
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -91,10 +148,10 @@ class FeedBackManager:
         @raise: Exception if any error occurs.
         """
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(FeedBack))
-                feedbacks = result.scalars().all()
-                return [feedback.dict() for feedback in feedbacks]
+            async_session = self.__async_db_session
+            result = await async_session.execute(select(FeedBack))
+            feedbacks = result.scalars().all()
+            return [feedback.dict() for feedback in feedbacks]
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -111,16 +168,25 @@ class FeedBackManager:
         @return: The updated feedback if found, None otherwise.
         @raise: Exception if any error occurs.
         """
+        values = validated_values(FeedBack, update.dict(exclude_unset=True))
+        if values:
+            statement = (
+                update_statement(FeedBack)
+                .where(FeedBack.id == feedback_id)
+                .values(**values)
+                .returning(FeedBack)
+            )
+        else:
+            statement = select(FeedBack).where(FeedBack.id == feedback_id)
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(FeedBack).filter_by(id=feedback_id))
-                feedback = result.scalar_one_or_none()
-                if feedback:
-                    for key, value in update.dict(exclude_unset=True).items():
-                        setattr(feedback, key, value)
-                    await async_session.commit()
-                    return feedback.dict()
-                return None
+            async_session = self.__async_db_session
+            feedback = (await async_session.scalars(statement)).one_or_none()
+            if feedback:
+                await commit(async_session)
+                feedback = feedback.dict()
+                after_commit(async_session, lambda: feedback_index.add(feedback['id'], feedback['description']))
+                return feedback
+            return None
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -136,14 +202,117 @@ class FeedBackManager:
         @raise: Exception if any error occurs.
         """
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(FeedBack).filter_by(id=feedback_id))
-                feedback = result.scalar_one_or_none()
-                if feedback:
-                    await async_session.delete(feedback)
-                    await async_session.commit()
-                    return True
-                return False
+            async_session = self.__async_db_session
+            deleted = (await async_session.execute(
+                delete(FeedBack).where(FeedBack.id == feedback_id).returning(FeedBack.id)
+            )).scalar_one_or_none()
+            if deleted is not None:
+                await commit(async_session)
+                after_commit(async_session, lambda: feedback_index.remove(feedback_id))
+                return True
+            return False
+        except SQLAlchemyError as e:
+            await self.log.b_crit(f"Error: {e}")
+            raise SQLAlchemyError(f"Error: {e}")
+
+    async def get_feedback_clusters(
+        self,
+        min_size: int = 2,
+        limit: int = 50
+    ) -> List[dict]:
+        """
+        Get groups of near-duplicate feedbacks, largest first.
+        @params min_size: smallest cluster size.
+        @params limit: maximal number of clusters.
+        @return: A list of clusters with cluster_id, size, feedback_ids and a sample description.
+        @raise: Exception if any error occurs.
+        """
+        return feedback_index.clusters(min_size)[:limit]
+
+    async def search_feedbacks(
+        self,
+        email: Optional[str] = None,
+        name: Optional[str] = None,
+        keywords: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[int] = None
+    ) -> Tuple[List[dict], Optional[int], int, bool]:
+        """
+        Get a page of the feedback inbox, newest first.
+        Every filter is served by an index: email and name prefixes by lower(...) text_pattern_ops
+        indexes, keywords by the full text index of the description.
+        @params email: email prefix, case insensitive.
+        @params name: full name prefix, case insensitive.
+        @params keywords: words which all must be in the description.
+        @params limit: maximal number of feedbacks in the page.
+        @params cursor: ID of the last feedback of the previous page. None for the first page.
+        @return: feedbacks of the page, cursor of the next page (None on the last page),
+                 total number of matching feedbacks and True if the total is an estimate.
+        @raise: Exception if any error occurs.
+        """
+        conditions = []
+        if email:
+            conditions.append(func.lower(FeedBack.email).startswith(email.lower(), autoescape=True))
+        if name:
+            conditions.append(func.lower(FeedBack.fullname).startswith(name.lower(), autoescape=True))
+        if keywords:
+            conditions.append(
+                func.to_tsvector(SEARCH_CONFIG, FeedBack.description).op('@@')(
+                    func.plainto_tsquery(SEARCH_CONFIG, keywords)
+                )
+            )
+
+        query = select(FeedBack).where(*conditions)
+        if cursor is not None:
+            query = query.where(FeedBack.id < cursor)
+        query = query.order_by(FeedBack.id.desc()).limit(limit + 1)
+        try:
+            async_session = self.__async_db_session
+            feedbacks = (await async_session.execute(query)).scalars().all()
+            if cursor is None and len(feedbacks) <= limit:
+                # The first page holds every match
+                total, approximate = len(feedbacks), False
+            else:
+                total, approximate = await self._count_feedbacks(async_session, conditions)
+                if cursor is None:
+                    total = max(total, len(feedbacks))
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
-            raise SQLAlchemyError(f"Error: {e}")
\ No newline at end of file
+            raise SQLAlchemyError(f"Error: {e}")
+
+        next_cursor = None
+        if len(feedbacks) > limit:
+            feedbacks = feedbacks[:limit]
+            next_cursor = feedbacks[-1].id
+        return [feedback.dict() for feedback in feedbacks], next_cursor, total, approximate
+
+    async def _count_feedbacks(
+        self,
+        async_session: AsyncSession,
+        conditions: list
+    ) -> Tuple[int, bool]:
+        """
+        Count feedbacks matching conditions. Small tables are counted exactly, for large ones
+        the number of rows is taken from pg_class or from the planner estimate of the query.
+        @params async_session: database session.
+        @params conditions: filters of the inbox.
+        @return: number of feedbacks and True if it is an estimate.
+        """
+        table_rows = (await async_session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'feedbacks'::regclass")
+        )).scalar()
+        # reltuples is -1 for a table that was never analyzed
+        if table_rows < FEEDBACK_EXACT_COUNT_LIMIT:
+            count = select(func.count()).select_from(FeedBack).where(*conditions)
+            return (await async_session.execute(count)).scalar(), False
+        if not conditions:
+            return table_rows, True
+
+        # The search terms are sent as parameters of the EXPLAIN, never inlined into its SQL
+        query = select(FeedBack.id).where(*conditions).compile(dialect=async_session.bind.dialect)
+        parameters = tuple(query.params[name] for name in query.positiontup)
+        connection = await async_session.connection()
+        plan = (await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {query}", parameters)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), True
@@ -6,9 +6,11 @@ from sqlalchemy import (
     ForeignKey, 
     DateTime, 
     Boolean,
+    Index,
     Table,  
     TIMESTAMP, 
-    Text
+    Text,
+    text
 )
 
 from sqlalchemy.orm import validates
@@ -23,7 +25,11 @@ feedback_table = Table(
     Column('fullname', String(255), nullable=False),
     Column('email', String(50), nullable=False, unique=True),
     Column('description', String(999), nullable=False),
-    Column('phone', String(255), nullable=False)
+    Column('phone', String(255), nullable=False),
+    # Inbox search: email and name prefixes, keywords of the description
+    Index('ix_feedbacks_email_prefix', text('lower(email) text_pattern_ops')),
+    Index('ix_feedbacks_fullname_prefix', text('lower(fullname) text_pattern_ops')),
+    Index('ix_feedbacks_description_search', text("to_tsvector('simple', description)"), postgresql_using='gin')
 )
 
 
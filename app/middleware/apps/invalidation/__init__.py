@@ -0,0 +1,15 @@
+__doc__ = """
+A package for the invalidation of in-process caches across workers and hosts
+"""
+
+# Channel of the NOTIFY messages
+INVALIDATION_CHANNEL = 'cache_invalidation'
+
+# Seconds between polls of the cache_versions table in poll mode
+INVALIDATION_POLL_SECONDS = 2
+
+# Seconds before a lost LISTEN connection is opened again
+INVALIDATION_RECONNECT_SECONDS = 5
+
+# Seconds between checks that an idle LISTEN connection is alive
+INVALIDATION_KEEPALIVE_SECONDS = 30
@@ -0,0 +1,261 @@
+"""
+Invalidation of the in-process caches of every worker.
+
+Caches are registered by name with a handler that evicts a key, or
+everything when the key is None:
+
+    invalidation_bus.register('products', lambda key: product_cache.clear())
+
+A manager that changes the data of a cache publishes the change in its
+transaction. The worker of the request applies it after the commit, the
+other workers learn about it in one of two modes, DB_INVALIDATION:
+
+notify  The change is sent with pg_notify() inside the transaction, so
+        Postgres delivers it on commit and drops it on rollback. Every
+        worker LISTENs on INVALIDATION_CHANNEL with a dedicated connection
+        and evicts the key. Messages of the worker itself are skipped. When
+        the connection is lost every cache is cleared, notifications sent
+        in the meantime are lost.
+poll    For connections without LISTEN, e.g. pgbouncer in transaction
+        mode. The change increases the version of the cache in the
+        cache_versions table and workers poll the versions every
+        INVALIDATION_POLL_SECONDS, a cache whose version changed is cleared.
+        Caches registered with poll=False are only kept fresh by their own
+        resync in this mode.
+off     Only the worker of the request evicts.
+"""
+import asyncio
+import json
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.unit_of_work import after_commit
+from functions.async_logger import AsyncLogger
+from middleware.apps.invalidation import (
+    INVALIDATION_CHANNEL,
+    INVALIDATION_KEEPALIVE_SECONDS,
+    INVALIDATION_POLL_SECONDS,
+    INVALIDATION_RECONNECT_SECONDS
+)
+
+__all__ = [
+    'InvalidationBus',
+    'invalidation_bus',
+]
+
+Handler = Callable[[Any], None]
+
+INVALIDATION_MODES = ('notify', 'poll', 'off')
+
+# Postgres rejects NOTIFY payloads of 8000 bytes and more
+MAX_PAYLOAD_BYTES = 7900
+
+# pg_notify() must run on the primary, see database.routing
+NOTIFY = text("SELECT pg_notify(:channel, :payload)").execution_options(primary=True)
+
+BUMP_VERSION = text("""
+    INSERT INTO cache_versions (cache, version) VALUES (:cache, 1)
+    ON CONFLICT (cache) DO UPDATE SET version = cache_versions.version + 1
+""").execution_options(primary=True)
+
+READ_VERSIONS = text("SELECT cache, version FROM cache_versions")
+
+
+class InvalidationBus:
+    """
+    Cross-worker invalidation of named caches.
+    """
+
+    log = AsyncLogger(__name__)
+
+    def __init__(self, channel: str = INVALIDATION_CHANNEL, poll_seconds: float = INVALIDATION_POLL_SECONDS) -> None:
+        """
+        Initialize the bus, it publishes to the local worker only until it is started.
+        @params channel: NOTIFY channel.
+        @params poll_seconds: seconds between polls of cache_versions in poll mode.
+        @return: None
+        """
+        self.channel = channel
+        self.poll_seconds = poll_seconds
+        self.mode = 'off'
+        self.origin = uuid.uuid4().hex  # skips the messages of this worker
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+        self._handlers: Dict[str, Handler] = {}
+        self._polled: Dict[str, bool] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, cache: str, handler: Handler, poll: bool = True) -> None:
+        """
+        Register the handler of a cache.
+        @params cache: cache name.
+        @params handler: evicts the key passed to it, or the whole cache for None. Keys are JSON values.
+        @params poll: False to leave the cache alone in poll mode, for caches written too often for a version row.
+        @return: None
+        """
+        self._handlers[cache] = handler
+        self._polled[cache] = poll
+
+    async def publish(self, session: AsyncSession, cache: str, key: Any = None) -> None:
+        """
+        Publish a change of a cache in the transaction of the session.
+        Call it after the write of the change.
+        @params session: database session of the change.
+        @params cache: cache name.
+        @params key: changed key, None for the whole cache.
+        @return: None
+        @raise: KeyError if the cache is not registered.
+        """
+        handler = self._handlers[cache]
+        after_commit(session, lambda: handler(key))
+        if self.mode == 'notify':
+            payload = json.dumps({'origin': self.origin, 'cache': cache, 'key': key}, default=str)
+            if len(payload.encode()) > MAX_PAYLOAD_BYTES:
+                payload = json.dumps({'origin': self.origin, 'cache': cache, 'key': None})
+            await session.execute(NOTIFY, {'channel': self.channel, 'payload': payload})
+        elif self.mode == 'poll' and self._polled[cache]:
+            await session.execute(BUMP_VERSION, {'cache': cache})
+
+    def apply(self, cache: str, key: Any = None) -> None:
+        """
+        Evict a key of a cache of this worker.
+        @params cache: cache name, unknown names are ignored.
+        @params key: key to evict, None for the whole cache.
+        @return: None
+        """
+        handler = self._handlers.get(cache)
+        if handler is None:
+            return
+        try:
+            handler(key)
+        except Exception as e:
+            self.log.logger.error(f"Failed to invalidate {cache} {key!r}: {e}")
+
+    def apply_all(self) -> None:
+        """
+        Clear every cache of this worker.
+        """
+        for cache in self._handlers:
+            self.apply(cache)
+
+    async def start(self, mode: Optional[str] = None) -> None:
+        """
+        Start listening or polling.
+        @params mode: notify, poll or off, DB_INVALIDATION if None.
+        @return: None
+        @raise: ValueError if the mode is unknown.
+        """
+        if self._task is not None:
+            return
+        if mode is None:
+            from core.settings import DatabaseSettings
+            mode = DatabaseSettings().db_invalidation
+        if mode not in INVALIDATION_MODES:
+            raise ValueError(f"Unknown invalidation mode {mode!r}, expected one of {INVALIDATION_MODES}")
+        self.mode = mode
+        if mode == 'notify':
+            self._task = asyncio.create_task(self._listen())
+        elif mode == 'poll':
+            self._task = asyncio.create_task(self._poll())
+        await self.log.b_info(f"Started cache invalidation in {mode} mode")
+
+    async def stop(self) -> None:
+        """
+        Stop listening or polling, changes are published to the local worker only afterwards.
+        """
+        self.mode = 'off'
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self.connected = False
+
+    def stats(self) -> dict:
+        """
+        Get the mode and the counters of the bus.
+        """
+        return {
+            'mode': self.mode,
+            'caches': sorted(self._handlers),
+            'connected': self.connected,
+            'received': self.received,
+            'reconnects': self.reconnects,
+        }
+
+    def _notified(self, connection, pid: int, channel: str, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            self.log.logger.error(f"Invalid invalidation message: {payload[:200]}")
+            return
+        if message.get('origin') == self.origin:
+            return
+        self.received += 1
+        self.apply(message.get('cache'), message.get('key'))
+
+    async def _listen(self) -> None:
+        import asyncpg
+        from core import cfg
+
+        # asyncpg takes the URL without the +asyncpg driver
+        dsn = make_url(cfg['DATABASE_URL']).set(drivername='postgresql').render_as_string(hide_password=False)
+        listened = False
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda _: lost.set())
+                await connection.add_listener(self.channel, self._notified)
+                self.connected = True
+                if listened:
+                    # Notifications sent while the connection was lost are gone
+                    self.reconnects += 1
+                    self.apply_all()
+                listened = True
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), timeout=INVALIDATION_KEEPALIVE_SECONDS)
+                    except asyncio.TimeoutError:
+                        await connection.execute("SELECT 1")
+                await self.log.b_warn("Lost the cache invalidation connection")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self.log.b_err(f"Cache invalidation connection failed: {e}")
+            finally:
+                self.connected = False
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+            await asyncio.sleep(INVALIDATION_RECONNECT_SECONDS)
+
+    async def _poll(self) -> None:
+        from database import connection
+
+        versions: Optional[Dict[str, int]] = None
+        while True:
+            try:
+                async with connection.AsyncSessionLocal() as session:
+                    current = dict((await session.execute(READ_VERSIONS)).all())
+                self.connected = True
+                if versions is not None:
+                    changed: List[str] = [cache for cache, version in current.items() if versions.get(cache) != version]
+                    self.received += len(changed)
+                    for cache in changed:
+                        self.apply(cache)
+                versions = current
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.connected = False
+                await self.log.b_err(f"Failed to poll cache versions: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+
+invalidation_bus = InvalidationBus()
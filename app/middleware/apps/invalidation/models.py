@@ -0,0 +1,17 @@
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    String,
+    Table
+)
+
+from middleware.apps import metadata
+
+# One row per cache, its version is increased by every write to the cache in
+# poll mode. Workers poll the versions and clear caches whose version changed.
+cache_version_table = Table(
+    'cache_versions',
+    metadata,
+    Column('cache', String(100), primary_key=True, nullable=False),
+    Column('version', BigInteger, nullable=False, server_default='0'),
+)
@@ -0,0 +1,12 @@
+__doc__ = """
+A package for application orders in API server
+"""
+
+# Monthly partitions of the orders table created ahead of time
+PARTITION_MONTHS_AHEAD = 3
+
+# Months of orders kept in the database, older partitions are archived
+PARTITION_KEEP_MONTHS = 12
+
+# Directory with archived partitions of the orders table
+ARCHIVE_DIRECTORY = "../archive/orders"
@@ -0,0 +1,232 @@
+"""
+Archive of old orders partitions. Every detached partition is stored as one
+compressed NumPy file (orders_yYYYYmMM.npz) with an array per column, the
+lines of multi-line orders are stored in the same file as item__<column>
+arrays. The archive is read-only and is queried by the orders export endpoint.
+"""
+import datetime
+import os
+import re
+from collections import OrderedDict
+from typing import (
+    Any,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple
+)
+
+import numpy as np
+
+from middleware.apps.order import ARCHIVE_DIRECTORY
+
+__all__ = [
+    'ARCHIVE_COLUMNS',
+    'ITEM_COLUMNS',
+    'OrderArchive',
+    'write_archive',
+]
+
+ARCHIVE_COLUMNS: Tuple[str, ...] = (
+    'id',
+    'product_id',
+    'price',
+    'quantity',
+    'total_price',
+    'customer_name',
+    'delivery',
+    'note',
+    'created_at',
+    'customer_id',
+)
+
+# Columns which may be NULL, a <column>__null mask array is stored for them
+NULLABLE_COLUMNS: Tuple[str, ...] = ('product_id', 'price', 'quantity', 'note', 'customer_id')
+
+ITEM_COLUMNS: Tuple[str, ...] = (
+    'id',
+    'order_id',
+    'product_id',
+    'price',
+    'quantity',
+    'total_price',
+)
+
+ARCHIVE_FILE_PATTERN = re.compile(r'^orders_y(\d{4})m(\d{2})\.npz$')
+
+
+def _column_array(name: str, values: List[Any]) -> np.ndarray:
+    """
+    Build the array of one archive column.
+    """
+    if name in ('id', 'order_id', 'product_id', 'quantity', 'customer_id'):
+        return np.array([0 if value is None else value for value in values], dtype=np.int64)
+    if name in ('price', 'total_price'):
+        return np.array([0.0 if value is None else value for value in values], dtype=np.float64)
+    if name == 'delivery':
+        return np.array(values, dtype=np.bool_)
+    if name == 'created_at':
+        return np.array(values, dtype='datetime64[us]')
+    return np.array(['' if value is None else value for value in values], dtype=np.str_)
+
+
+def write_archive(
+    path: str,
+    rows: Sequence[Mapping[str, Any]],
+    start: datetime.datetime,
+    end: datetime.datetime,
+    items: Sequence[Mapping[str, Any]] = ()
+) -> None:
+    """
+    Write rows of one orders partition to a compressed columnar file.
+    The file is written next to the target and renamed, so a reader never sees a partial archive.
+    @params path: path of the archive file.
+    @params rows: rows of the partition.
+    @params start: lower bound of the partition range, inclusive.
+    @params end: upper bound of the partition range, exclusive.
+    @params items: rows of order_items of the orders of the partition.
+    @return: None
+    """
+    arrays = {}
+    for name in ARCHIVE_COLUMNS:
+        values = [row[name] for row in rows]
+        arrays[name] = _column_array(name, values)
+        if name in NULLABLE_COLUMNS:
+            arrays[f'{name}__null'] = np.array([value is None for value in values], dtype=np.bool_)
+    for name in ITEM_COLUMNS:
+        arrays[f'item__{name}'] = _column_array(name, [item[name] for item in items])
+    arrays['__range__'] = np.array([start, end], dtype='datetime64[us]')
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as buffer:
+        np.savez_compressed(buffer, **arrays)
+    os.replace(tmp_path, path)
+
+
+class OrderArchive:
+    """
+    Read-only access to archived orders partitions.
+    Loaded files are kept in a small LRU cache, keyed by path and modification time.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_DIRECTORY, cache_size: int = 8) -> None:
+        """
+        Initialize the archive.
+        @params directory: directory with archive files.
+        @params cache_size: number of archive files kept in memory.
+        @return: None
+        """
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[Tuple[str, float], Dict[str, np.ndarray]]' = OrderedDict()
+
+    def files(self) -> List[Tuple[str, datetime.datetime, datetime.datetime]]:
+        """
+        List archive files with the month they cover.
+        @return: list of (path, start, end) tuples ordered by month.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+
+        files = []
+        for file_name in sorted(os.listdir(self.directory)):
+            match = ARCHIVE_FILE_PATTERN.match(file_name)
+            if not match:
+                continue
+            year, month = int(match.group(1)), int(match.group(2))
+            start = datetime.datetime(year, month, 1)
+            end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+            files.append((os.path.join(self.directory, file_name), start, end))
+        return files
+
+    def _load(self, path: str) -> Dict[str, np.ndarray]:
+        """
+        Load all columns of an archive file.
+        """
+        key = (path, os.path.getmtime(path))
+        columns = self._cache.get(key)
+        if columns is not None:
+            self._cache.move_to_end(key)
+            return columns
+
+        with np.load(path, allow_pickle=False) as archive:
+            columns = {name: archive[name] for name in archive.files}
+        for array in columns.values():
+            array.flags.writeable = False
+
+        self._cache[key] = columns
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return columns
+
+    def query(
+        self,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None
+    ) -> List[dict]:
+        """
+        Get archived orders created in [date_from, date_to).
+        @params date_from: lower bound of created_at, inclusive. None for no bound.
+        @params date_to: upper bound of created_at, exclusive. None for no bound.
+        @return: list of orders as dicts ordered by created_at.
+        """
+        orders = []
+        for path, start, end in self.files():
+            if date_from is not None and end <= date_from:
+                continue
+            if date_to is not None and start >= date_to:
+                continue
+
+            columns = self._load(path)
+            created_at = columns['created_at']
+            mask = np.ones(created_at.shape, dtype=np.bool_)
+            if date_from is not None:
+                mask &= created_at >= np.datetime64(date_from, 'us')
+            if date_to is not None:
+                mask &= created_at < np.datetime64(date_to, 'us')
+
+            # Columns added after an archive was written are read as NULL, columns that became
+            # nullable after it was written have no null mask and no NULLs
+            size = int(mask.sum())
+            selected = {}
+            for name in ARCHIVE_COLUMNS:
+                if name in columns:
+                    selected[name] = columns[name][mask]
+                    if name in NULLABLE_COLUMNS:
+                        selected[f'{name}__null'] = columns.get(
+                            f'{name}__null', np.zeros(created_at.shape, dtype=np.bool_)
+                        )[mask]
+                else:
+                    selected[name] = np.zeros(size, dtype=np.int64)
+                    selected[f'{name}__null'] = np.ones(size, dtype=np.bool_)
+
+            # Archives written before order_items existed have no item arrays
+            item_order_ids = columns.get('item__order_id', np.empty(0, dtype=np.int64))
+            item_index = np.argsort(item_order_ids, kind='stable')
+            item_order_ids = item_order_ids[item_index]
+
+            for index in np.argsort(selected['created_at'], kind='stable'):
+                order = {}
+                for name in ARCHIVE_COLUMNS:
+                    value = selected[name][index]
+                    if f'{name}__null' in selected and selected[f'{name}__null'][index]:
+                        order[name] = None
+                    elif name == 'created_at':
+                        order[name] = value.astype(datetime.datetime).isoformat()
+                    else:
+                        order[name] = value.item()
+
+                low = np.searchsorted(item_order_ids, order['id'], side='left')
+                high = np.searchsorted(item_order_ids, order['id'], side='right')
+                order['items'] = [
+                    dict(
+                        {name: columns[f'item__{name}'][item].item() for name in ITEM_COLUMNS},
+                        order_created_at=order['created_at']
+                    )
+                    for item in item_index[low:high]
+                ]
+                orders.append(order)
+        return orders
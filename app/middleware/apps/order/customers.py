@@ -0,0 +1,40 @@
+"""
+Customers of orders. Orders keep the customer name they were placed with,
+the customer itself is stored once in the customers table and referenced by
+orders.customer_id.
+"""
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from middleware.apps.order.models import Customer
+
+__all__ = [
+    'get_or_create_customer',
+]
+
+
+async def get_or_create_customer(session: AsyncSession, name: str) -> int:
+    """
+    Get the ID of the customer with the name, the customer is created if it does not exist.
+    Returning customers cost one SELECT, new ones one INSERT more.
+    @params session: database session, the caller commits.
+    @params name: customer name.
+    @return: customer ID.
+    """
+    query = select(Customer.id).where(Customer.name == name)
+    customer_id = (await session.execute(query)).scalar_one_or_none()
+    if customer_id is not None:
+        return customer_id
+
+    result = await session.execute(
+        insert(Customer)
+        .values(name=name)
+        .on_conflict_do_nothing(index_elements=[Customer.name])
+        .returning(Customer.id)
+    )
+    customer_id = result.scalar_one_or_none()
+    if customer_id is None:
+        # Created by a concurrent transaction after the SELECT
+        customer_id = (await session.execute(query)).scalar_one()
+    return customer_id
@@ -1,12 +1,14 @@
 from typing import List, Optional
+import datetime
 import json
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from middleware.apps.admin.models import Admin
 from middleware.apps.admin.utils import get_current_user
 from middleware.apps.order.manager import OrderManager
-from middleware.apps.order.schemas import CreateOrderSchema, UpdateOrderSchema
+from middleware.apps.order.schemas import CheckoutSchema, CreateOrderSchema, UpdateOrderSchema
+from middleware.apps.product.inventory import OutOfStockError, ProductNotFoundError
 from database.session import get_async_db
 
 API_ORDER_MODULE = APIRouter(
@@ -47,6 +49,16 @@ async def create_order(
 
     try:
         new_order = await order_manager.create_order(order)
+    except OutOfStockError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except ProductNotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
     except Exception as e:
         status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         raise HTTPException(
@@ -67,6 +79,52 @@ async def create_order(
     response = Response(content=response_json, media_type="application/json", status_code=status_code)
     return response
 
+@API_ORDER_MODULE.post(
+    '/checkout/',
+    summary='Create order from a basket',
+)
+async def checkout(
+    basket: CheckoutSchema,
+    order_manager: 'OrderManager' = Depends(get_order_manager),
+) -> Response:
+    """
+    Create a multi-line order from a basket. API endpoint.
+    @params: basket: basket lines and customer data.
+    @params: order_manager: Dependency
+    @return: Response object.
+    @raise: HTTPException if the order could not be created.
+    """
+    try:
+        new_order = await order_manager.checkout(basket)
+    except OutOfStockError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    except ProductNotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+    response_content = {
+        'order': new_order,
+        'detail': "Successfully created order",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json", status_code=status.HTTP_201_CREATED)
+    return response
+
 @API_ORDER_MODULE.get(
     '/{order_id}',
     response_model=CreateOrderResponse,
@@ -114,11 +172,15 @@ async def get_order_by_id(
     summary='Get all orders',
 )
 async def get_all_orders(
+    date_from: Optional[datetime.datetime] = None,
+    date_to: Optional[datetime.datetime] = None,
     order_manager: 'OrderManager' = Depends(get_order_manager),
     current_user: Admin = Depends(get_current_user)
 ) -> Response:
     """
     Get all orders. API endpoint.
+    @params: date_from: lower bound of the order creation time, inclusive.
+    @params: date_to: upper bound of the order creation time, exclusive.
     @params: order_manager: Dependency
     @return: Response object.
     @raise: HTTPException if orders not found.
@@ -126,7 +188,7 @@ async def get_all_orders(
     response_content = {}
     status_code: status
     try:
-        orders = await order_manager.get_all_orders()
+        orders = await order_manager.get_all_orders(date_from, date_to)
     except Exception as e:
         status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         raise HTTPException(
@@ -147,6 +209,95 @@ async def get_all_orders(
     response = Response(content=response_json, media_type="application/json", status_code=status_code)
     return response
 
+@API_ORDER_MODULE.get(
+    '/by-customer/{customer_id}',
+    summary='Get orders of a customer',
+)
+async def get_orders_by_customer(
+    customer_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    order_manager: 'OrderManager' = Depends(get_order_manager),
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Get orders of a customer, newest first. API endpoint.
+    @params: customer_id: customer id.
+    @params: limit: number of orders in the page.
+    @params: cursor: next_cursor of the previous page.
+    @params: order_manager: Dependency
+    @return: Response object.
+    @raise: HTTPException if customer not found.
+    """
+    after = None
+    if cursor:
+        try:
+            created_at, order_id = cursor.rsplit('_', 1)
+            after = (datetime.datetime.fromisoformat(created_at), int(order_id))
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+
+    try:
+        page = await order_manager.get_orders_by_customer(customer_id, limit, after)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    if page is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Customer not found"
+        )
+
+    orders, next_cursor = page
+    response_content = {
+        'orders': orders,
+        'next_cursor': f"{next_cursor[0].isoformat()}_{next_cursor[1]}" if next_cursor else None,
+        'details': "Successfully get customer orders",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json", status_code=status.HTTP_202_ACCEPTED)
+    return response
+
+@API_ORDER_MODULE.get(
+    '/export/',
+    summary='Export orders including archived ones',
+)
+async def export_orders(
+    date_from: Optional[datetime.datetime] = None,
+    date_to: Optional[datetime.datetime] = None,
+    order_manager: 'OrderManager' = Depends(get_order_manager),
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Export orders. API endpoint.
+    Orders of archived partitions are read from the archive files.
+    @params: date_from: lower bound of the order creation time, inclusive.
+    @params: date_to: upper bound of the order creation time, exclusive.
+    @params: order_manager: Dependency
+    @return: Response object.
+    @raise: HTTPException if orders could not be exported.
+    """
+    try:
+        orders = await order_manager.export_orders(date_from, date_to)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+    response_content = {
+        'orders': orders,
+        'details': "Successfully exported orders",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json", status_code=status.HTTP_202_ACCEPTED)
+    return response
+
 @API_ORDER_MODULE.put(
     '/{order_id}',
     response_model=CreateOrderResponse,
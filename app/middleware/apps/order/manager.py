@@ -1,13 +1,42 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import select
+from sqlalchemy import insert, select, text, tuple_
+from sqlalchemy.orm import selectinload
 
-from typing import List, Optional
+import datetime
+from typing import Dict, List, Optional, Tuple
 
-from middleware.apps.order.models import Order
+from database.unit_of_work import after_commit, commit, rollback
+from middleware.apps.order.archive import OrderArchive
+from middleware.apps.order.customers import get_or_create_customer
+from middleware.apps.order.models import Customer, Order, OrderItem
+from middleware.apps.product.inventory import (
+    OutOfStockError,
+    ProductNotFoundError,
+    release_stock,
+    reserve_stock
+)
+from middleware.apps.product.bestsellers import bestsellers
+from middleware.apps.product.models import Product
 from functions.async_logger import AsyncLogger
 
-from .schemas import CreateOrderSchema, UpdateOrderSchema
+from .schemas import CheckoutSchema, CreateOrderSchema, UpdateOrderSchema
+
+# Deletes an order and its lines in one statement. Both CTEs see the rows
+# as they were before the statement, so the lines are found through the header.
+DELETE_ORDER = text("""
+    WITH header AS (
+        DELETE FROM orders WHERE id = :id
+        RETURNING id, created_at, product_id, quantity, total_price
+    ), items AS (
+        DELETE FROM order_items USING header
+        WHERE order_items.order_id = header.id AND order_items.order_created_at = header.created_at
+        RETURNING order_items.product_id, order_items.quantity, order_items.total_price
+    )
+    SELECT created_at, product_id, quantity, total_price FROM header
+    UNION ALL
+    SELECT NULL, product_id, quantity, total_price FROM items
+""").execution_options(primary=True)
 
 class OrderManager:
     """
@@ -16,6 +45,7 @@ class OrderManager:
     """
 
     log = AsyncLogger(__name__)
+    archive = OrderArchive()
 
     def __init__(self, database_session: AsyncSession) -> None:
         """
@@ -29,31 +59,123 @@ class OrderManager:
     async def create_order(self, new: CreateOrderSchema) -> CreateOrderSchema:
         """
         Create a new order.
+        The stock of the product is reserved in the same transaction as the order insert.
         @params new: CreateOrderSchema object.
         @return: CreateOrderSchema object.
+        @raise: OutOfStockError if the product has not enough stock.
         @raise: Exception if database session is not initialized.
         """
-        new_order = Order(**new.dict())
+        values = new.dict()
+        Order(**values)  # the model validates the order
         try:
-            async with self.__async_db_session as async_session:
-                async with async_session.begin():
-                    async_session.add(new_order)
-                    await async_session.commit()
+            async_session = self.__async_db_session
+            await reserve_stock(async_session, values['product_id'], values['quantity'])
+            values['customer_id'] = await get_or_create_customer(async_session, values['customer_name'])
+            new_order = (await async_session.scalars(insert(Order).values(**values).returning(Order))).one()
+            await commit(async_session)
+        except (OutOfStockError, ProductNotFoundError) as e:
+            await rollback(async_session)
+            await self.log.b_warn(f"Failed to create order: {e}")
+            raise
         except SQLAlchemyError as e:
+            await rollback(async_session)
             await self.log.b_crit(f"Failed to create order: {e}")
             raise SQLAlchemyError(f"Failed to create order: {e}")
 
+        after_commit(async_session, lambda: bestsellers.record(
+            new_order.product_id, new_order.quantity, new_order.total_price, new_order.created_at
+        ))
         return new_order.dict()
 
+    async def checkout(self, basket: CheckoutSchema) -> dict:
+        """
+        Create a multi-line order from a basket.
+        Prices are read from the products with one query, the stock of every line is reserved
+        and the header and all lines are inserted in the same transaction, the lines with one bulk insert.
+        @params basket: CheckoutSchema object.
+        @return: order as dict with its items.
+        @raise: OutOfStockError if a product has not enough stock.
+        @raise: ProductNotFoundError if a product does not exist.
+        @raise: Exception if database session is not initialized.
+        """
+        quantities: Dict[int, int] = {}
+        for item in basket.items:
+            quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+        try:
+            async_session = self.__async_db_session
+            result = await async_session.execute(
+                select(Product.id, Product.price, Product.is_on_sale, Product.sale_price)
+                .where(Product.id.in_(quantities))
+            )
+            prices = {
+                row.id: row.sale_price if row.is_on_sale and row.sale_price is not None else row.price
+                for row in result
+            }
+
+            # Products are reserved in the same order by every checkout, so two baskets never deadlock
+            for product_id in sorted(quantities):
+                if product_id not in prices:
+                    raise ProductNotFoundError(product_id)
+                await reserve_stock(async_session, product_id, quantities[product_id])
+
+            lines = [
+                {
+                    'product_id': product_id,
+                    'price': prices[product_id],
+                    'quantity': quantity,
+                    'total_price': prices[product_id] * quantity,
+                }
+                for product_id, quantity in quantities.items()
+            ]
+            new_order = Order(
+                product_id=None,
+                price=None,
+                quantity=None,
+                total_price=sum(line['total_price'] for line in lines),
+                customer_name=basket.customer_name,
+                delivery=basket.delivery,
+                note=basket.note,
+                customer_id=await get_or_create_customer(async_session, basket.customer_name)
+            )
+            async_session.add(new_order)
+            await async_session.flush()
+
+            for line in lines:
+                line['order_id'] = new_order.id
+                line['order_created_at'] = new_order.created_at
+            items = await async_session.scalars(insert(OrderItem).returning(OrderItem), lines)
+
+            order = new_order.dict()
+            order['items'] = [item.dict() for item in items]
+            await commit(async_session)
+        except (OutOfStockError, ProductNotFoundError) as e:
+            await rollback(async_session)
+            await self.log.b_warn(f"Failed to checkout: {e}")
+            raise
+        except SQLAlchemyError as e:
+            await rollback(async_session)
+            await self.log.b_crit(f"Failed to checkout: {e}")
+            raise SQLAlchemyError(f"Failed to checkout: {e}")
+
+        def record_sales() -> None:
+            for item in order['items']:
+                bestsellers.record(item['product_id'], item['quantity'], item['total_price'], new_order.created_at)
+
+        after_commit(async_session, record_sales)
+        return order
+
     async def get_order_by_id(self, order_id: int) -> Optional[CreateOrderSchema]:
         """
-        Get order by ID.
+        Get order by ID. The order and its items are read with two queries.
         @params order_id: The ID of the order to retrieve.
         @return: CreateOrderSchema object if found, None otherwise.
         @raise: Exception if any error occurs.
         """
         try:
-            result = await self.__async_db_session.execute(select(Order).filter_by(id=order_id))
+            result = await self.__async_db_session.execute(
+                select(Order).options(selectinload(Order.items)).filter_by(id=order_id)
+            )
             order = result.scalar_one_or_none()
             if order:
                 return order.dict()
@@ -62,20 +184,93 @@ class OrderManager:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
 
-    async def get_all_orders(self) -> List[Optional[CreateOrderSchema]]:
+    async def get_all_orders(
+        self,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None
+    ) -> List[Optional[CreateOrderSchema]]:
         """
-        Get all orders.
+        Get all orders with their items. With a date range only the partitions of the range are scanned.
+        @params date_from: lower bound of created_at, inclusive. None for no bound.
+        @params date_to: upper bound of created_at, exclusive. None for no bound.
         @return: A list of all orders.
         @raise: Exception if any error occurs.
         """
+        query = select(Order).options(selectinload(Order.items))
+        if date_from is not None:
+            query = query.where(Order.created_at >= date_from)
+        if date_to is not None:
+            query = query.where(Order.created_at < date_to)
         try:
-            result = await self.__async_db_session.execute(select(Order))
+            result = await self.__async_db_session.execute(query.order_by(Order.created_at, Order.id))
             orders = result.scalars().all()
             return [order.dict() for order in orders]
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
 
+    async def get_orders_by_customer(
+        self,
+        customer_id: int,
+        limit: int,
+        cursor: Optional[Tuple[datetime.datetime, int]] = None
+    ) -> Optional[Tuple[List[dict], Optional[Tuple[datetime.datetime, int]]]]:
+        """
+        Get a page of orders of a customer with their items, newest first.
+        Pages are keyset based, so every page is one range scan of ix_orders_customer_id.
+        @params customer_id: The ID of the customer.
+        @params limit: maximal number of orders in the page.
+        @params cursor: (created_at, id) of the last order of the previous page. None for the first page.
+        @return: orders of the page and the cursor of the next page (None on the last page),
+                 None if the customer does not exist.
+        @raise: Exception if any error occurs.
+        """
+        query = (
+            select(Order)
+            .options(selectinload(Order.items))
+            .where(Order.customer_id == customer_id)
+        )
+        if cursor is not None:
+            query = query.where(tuple_(Order.created_at, Order.id) < tuple_(*cursor))
+        query = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1)
+        try:
+            orders = (await self.__async_db_session.execute(query)).scalars().all()
+            if not orders and cursor is None:
+                customer = await self.__async_db_session.get(Customer, customer_id)
+                if customer is None:
+                    return None
+
+            next_cursor = None
+            if len(orders) > limit:
+                orders = orders[:limit]
+                next_cursor = (orders[-1].created_at, orders[-1].id)
+            return [order.dict() for order in orders], next_cursor
+        except SQLAlchemyError as e:
+            await self.log.b_crit(f"Error: {e}")
+            raise SQLAlchemyError(f"Error: {e}")
+
+    async def export_orders(
+        self,
+        date_from: Optional[datetime.datetime] = None,
+        date_to: Optional[datetime.datetime] = None
+    ) -> List[dict]:
+        """
+        Export orders created in a date range, including archived partitions.
+        @params date_from: lower bound of created_at, inclusive. None for no bound.
+        @params date_to: upper bound of created_at, exclusive. None for no bound.
+        @return: A list of orders ordered by created_at, archived orders first.
+        @raise: Exception if any error occurs.
+        """
+        archived = [
+            dict(order, archived=True)
+            for order in self.archive.query(date_from, date_to)
+        ]
+        live = [
+            dict(order, archived=False)
+            for order in await self.get_all_orders(date_from, date_to)
+        ]
+        return archived + live
+
     async def update_order_by_id(self, order_id: int, update: UpdateOrderSchema) -> Optional[CreateOrderSchema]:
         """
         Update an order.
@@ -85,15 +280,45 @@ class OrderManager:
         @raise: Exception if any error occurs.
         """
         try:
-            result = await self.__async_db_session.execute(select(Order).filter_by(id=order_id))
+            # The row stays locked until the commit, so concurrent updates of the order compute
+            # their stock change from the quantity left by the previous one
+            result = await self.__async_db_session.execute(
+                select(Order)
+                .filter_by(id=order_id)
+                .with_for_update()
+                .execution_options(populate_existing=True, primary=True)
+            )
             order = result.scalar_one_or_none()
             if order:
+                old_product_id, old_quantity = order.product_id, order.quantity
+                old_total_price = order.total_price
                 for key, value in update.dict(exclude_unset=True).items():
                     setattr(order, key, value)
-                await self.__async_db_session.commit()
-                await self.__async_db_session.refresh(order)
+                if 'customer_name' in update.dict(exclude_unset=True):
+                    order.customer_id = await get_or_create_customer(self.__async_db_session, order.customer_name)
+
+                if old_product_id is None:
+                    pass  # header of a multi-line order, its lines hold the stock
+                elif order.product_id != old_product_id:
+                    await release_stock(self.__async_db_session, old_product_id, old_quantity)
+                    await reserve_stock(self.__async_db_session, order.product_id, order.quantity)
+                elif order.quantity > old_quantity:
+                    await reserve_stock(self.__async_db_session, order.product_id, order.quantity - old_quantity)
+                elif order.quantity < old_quantity:
+                    await release_stock(self.__async_db_session, order.product_id, old_quantity - order.quantity)
+                await commit(self.__async_db_session)
+                if old_product_id is not None:
+                    def record_sales() -> None:
+                        bestsellers.record(old_product_id, -old_quantity, -old_total_price, order.created_at)
+                        bestsellers.record(order.product_id, order.quantity, order.total_price, order.created_at)
+
+                    after_commit(self.__async_db_session, record_sales)
                 return order.dict()
             return None
+        except (OutOfStockError, ProductNotFoundError) as e:
+            await rollback(self.__async_db_session)
+            await self.log.b_warn(f"Failed to update order: {e}")
+            raise
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -106,13 +331,22 @@ class OrderManager:
         @raise: Exception if any error occurs.
         """
         try:
-            result = await self.__async_db_session.execute(select(Order).filter_by(id=order_id))
-            order = result.scalar_one_or_none()
-            if order:
-                await self.__async_db_session.delete(order)
-                await self.__async_db_session.commit()
-                return True
-            return False
+            rows = (await self.__async_db_session.execute(DELETE_ORDER, {'id': order_id})).all()
+            if not rows:
+                return False
+            created_at = next(row.created_at for row in rows if row.created_at is not None)
+            for row in rows:
+                if row.product_id is not None:
+                    await release_stock(self.__async_db_session, row.product_id, row.quantity)
+            await commit(self.__async_db_session)
+
+            def record_returns() -> None:
+                for row in rows:
+                    if row.product_id is not None:
+                        bestsellers.record(row.product_id, -row.quantity, -row.total_price, created_at)
+
+            after_commit(self.__async_db_session, record_returns)
+            return True
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
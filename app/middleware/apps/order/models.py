@@ -1,45 +1,105 @@
+import datetime
 from typing import Optional
 from sqlalchemy import (
     Column,
+    DateTime,
     ForeignKey,
+    ForeignKeyConstraint,
+    Index,
     Integer,
     String,
     Float,
     Boolean,
     Table,
-    Text
+    Text,
+    text
 )
 
 from database.connection import Base
-from sqlalchemy.orm import validates
+from sqlalchemy.orm import relationship, validates
 from middleware.apps import metadata
 
+# Определение таблицы customers
+customer_table = Table(
+    'customers',
+    metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True, nullable=False),
+    Column('name', String(255), nullable=False, unique=True)
+)
+
 # Определение таблицы orders
+# The table is partitioned by month of created_at, partitions are managed
+# by middleware.apps.order.partitions.
+# product_id, price and quantity are empty for multi-line orders, their lines are in order_items
 order_table = Table(
     'orders',
     metadata,
-    Column('id', Integer, primary_key=True, autoincrement=True, nullable=False, unique=True),
+    Column('id', Integer, primary_key=True, autoincrement=True, nullable=False),
+    Column('product_id', Integer, ForeignKey('products.id'), nullable=True),
+    Column('price', Float, nullable=True),
+    Column('quantity', Integer, nullable=True),
+    Column('total_price', Float, nullable=False),
+    Column('customer_name', String(255), nullable=False),
+    Column('delivery', Boolean, nullable=False, default=False),
+    Column('note', Text, nullable=True),
+    Column('created_at', DateTime, primary_key=True, nullable=False, server_default=text("timezone('utc', now())")),
+    Column('customer_id', Integer, ForeignKey('customers.id'), nullable=True),
+    Index('ix_orders_customer_id', 'customer_id', 'created_at', 'id'),
+    Index('ix_orders_product_id', 'product_id'),
+    postgresql_partition_by='RANGE (created_at)'
+)
+
+# Определение таблицы order_items
+# Lines of multi-line orders, the order is referenced with the partition key
+order_item_table = Table(
+    'order_items',
+    metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True, nullable=False),
+    Column('order_id', Integer, nullable=False),
+    Column('order_created_at', DateTime, nullable=False),
     Column('product_id', Integer, ForeignKey('products.id'), nullable=False),
     Column('price', Float, nullable=False),
     Column('quantity', Integer, nullable=False),
     Column('total_price', Float, nullable=False),
-    Column('customer_name', String(255), nullable=False),
-    Column('delivery', Boolean, nullable=False, default=False),
-    Column('note', Text, nullable=True)
+    ForeignKeyConstraint(
+        ['order_id', 'order_created_at'],
+        ['orders.id', 'orders.created_at'],
+        ondelete='CASCADE'
+    ),
+    Index('ix_order_items_order', 'order_id', 'order_created_at'),
+    Index('ix_order_items_product_id', 'product_id')
 )
 
+class Customer(Base):
+    """
+    Customer model class
+    """
+    __tablename__ = 'customers'
+    id: Optional[int] = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+
+    name: Optional[str] = Column(String(255), nullable=False, unique=True)
+
+    def __iter__(self):
+        for attr, value in self.__dict__.items():
+            if not attr.startswith('_'):
+                yield attr, value
+
+    def dict(self):
+        return dict(self)
+
+
 class Order(Base):
     """
     Order model class
     """
     __tablename__ = 'orders'
-    id: Optional[int] = Column(Integer, primary_key=True, autoincrement=True, nullable=False, unique=True)
+    id: Optional[int] = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
     
-    product_id: Optional[int] = Column(Integer, ForeignKey('products.id'), nullable=False) # Поле для связи с таблицей products
+    product_id: Optional[int] = Column(Integer, ForeignKey('products.id'), nullable=True) # Поле для связи с таблицей products
     
-    price: Optional[float] = Column(Float, nullable=False)
+    price: Optional[float] = Column(Float, nullable=True)
     
-    quantity: Optional[int] = Column(Integer, nullable=False)
+    quantity: Optional[int] = Column(Integer, nullable=True)
     
     total_price: Optional[float] = Column(Float, nullable=False)
     
@@ -48,8 +108,22 @@ class Order(Base):
     delivery: Optional[bool] = Column(Boolean, nullable=False, default=False) # Поле для флага доставки
     
     note: Optional[str] = Column(Text, nullable=True) # Поле для описания заказа
+
+    created_at: Optional[datetime.datetime] = Column(DateTime, primary_key=True, nullable=False, default=datetime.datetime.utcnow) # Ключ партиционирования
+
+    customer_id: Optional[int] = Column(Integer, ForeignKey('customers.id'), nullable=True) # Поле для связи с таблицей customers
+
+    items = relationship(
+        'OrderItem',
+        back_populates='order',
+        order_by='OrderItem.id',
+        cascade='all, delete-orphan',
+        passive_deletes=True,
+        lazy='raise'
+    ) # Позиции заказа, загружаются явно через selectinload
     
-    def __init__(self, product_id: int, price: float, quantity: int, total_price: float, customer_name: str, delivery: bool, note: str): # Конструктор
+    def __init__(self, product_id: Optional[int], price: Optional[float], quantity: Optional[int], total_price: float, customer_name: str, delivery: bool, note: str, customer_id: Optional[int] = None): # Конструктор
+        self.customer_id = customer_id
         self.product_id = product_id
         self.price = price
         self.quantity = quantity
@@ -60,7 +134,7 @@ class Order(Base):
         
     @validates('price')
     def validate_price(self, key, value):
-        if value < 0:
+        if value is not None and value < 0:
             raise ValueError('Price must be greater than or equal to 0')
         return value
     
@@ -81,5 +155,65 @@ class Order(Base):
     def dict(self):
         data = {}
         for attr, value in self:
+            if isinstance(value, datetime.datetime):
+                data[attr] = value.isoformat()  # Convert datetime to ISO format string
+            elif attr == 'items':
+                data[attr] = [item.dict() for item in value]
+            else:
+                data[attr] = value
+        return data
+
+
+class OrderItem(Base):
+    """
+    Order item model class
+    """
+    __tablename__ = 'order_items'
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ['order_id', 'order_created_at'],
+            ['orders.id', 'orders.created_at'],
+            ondelete='CASCADE'
+        ),
+    )
+    id: Optional[int] = Column(Integer, primary_key=True, autoincrement=True, nullable=False)
+
+    order_id: Optional[int] = Column(Integer, nullable=False)
+
+    order_created_at: Optional[datetime.datetime] = Column(DateTime, nullable=False)
+
+    product_id: Optional[int] = Column(Integer, ForeignKey('products.id'), nullable=False)
+
+    price: Optional[float] = Column(Float, nullable=False)
+
+    quantity: Optional[int] = Column(Integer, nullable=False)
+
+    total_price: Optional[float] = Column(Float, nullable=False)
+
+    order = relationship('Order', back_populates='items')
+
+    @validates('price')
+    def validate_price(self, key, value):
+        if value < 0:
+            raise ValueError('Price must be greater than or equal to 0')
+        return value
+
+    @validates('quantity')
+    def validate_quantity(self, key, value):
+        if value <= 0:
+            raise ValueError('Quantity must be greater than 0')
+        return value
+
+    def __iter__(self):
+        for attr, value in self.__dict__.items():
+            if not attr.startswith('_') and attr != 'order':
+                yield attr, value
+
+    def dict(self):
+        data = {}
+        for attr, value in self:
+            if isinstance(value, datetime.datetime):
+                data[attr] = value.isoformat()  # Convert datetime to ISO format string
+            else:
                 data[attr] = value
         return data
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+Monthly partitions of the orders table.
+
+The application creates partitions ahead of time on start, old partitions
+are detached and moved to the archive (see middleware.apps.order.archive)
+with the command line tool:
+
+    python -m middleware.apps.order.partitions list
+    python -m middleware.apps.order.partitions create --months-ahead 3
+    python -m middleware.apps.order.partitions archive --keep-months 12
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import re
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from functions.async_logger import AsyncLogger
+from middleware.apps.order import (
+    ARCHIVE_DIRECTORY,
+    PARTITION_KEEP_MONTHS,
+    PARTITION_MONTHS_AHEAD
+)
+from middleware.apps.order.archive import ARCHIVE_COLUMNS, ITEM_COLUMNS, write_archive
+
+__all__ = [
+    'month_start',
+    'partition_name',
+    'list_partitions',
+    'ensure_partitions',
+    'archive_partitions',
+]
+
+log = AsyncLogger(__name__)
+
+PARTITION_NAME_PATTERN = re.compile(r'^orders_y\d{4}m\d{2}$')
+PARTITION_BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def month_start(value: datetime.date, shift: int = 0) -> datetime.datetime:
+    """
+    Get the first moment of the month of value, shifted by a number of months.
+    @params value: any date of the month.
+    @params shift: number of months to shift, may be negative.
+    @return: datetime of the month start.
+    """
+    month = value.year * 12 + value.month - 1 + shift
+    return datetime.datetime(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(start: datetime.datetime) -> str:
+    """
+    Get the name of the partition that starts at start.
+    """
+    return f"orders_y{start.year}m{start.month:02d}"
+
+
+async def list_partitions(connection: AsyncConnection) -> List[dict]:
+    """
+    List monthly partitions attached to the orders table.
+    @params connection: database connection.
+    @return: list of dicts with name, start and end of every partition ordered by start.
+    """
+    result = await connection.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'orders'::regclass
+    """))
+
+    partitions = []
+    for name, bound in result.all():
+        match = PARTITION_BOUND_PATTERN.search(bound or '')
+        if not match:
+            continue  # DEFAULT partition
+        partitions.append({
+            'name': name,
+            'start': datetime.datetime.fromisoformat(match.group(1)),
+            'end': datetime.datetime.fromisoformat(match.group(2)),
+        })
+    return sorted(partitions, key=lambda partition: partition['start'])
+
+
+async def ensure_partitions(engine: AsyncEngine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """
+    Create partitions of the current month and of the months ahead if they do not exist.
+    @params engine: database engine.
+    @params months_ahead: number of months after the current one to create partitions for.
+    @return: names of created partitions.
+    """
+    created = []
+    today = datetime.datetime.utcnow().date()
+    async with engine.begin() as connection:
+        existing = {partition['name'] for partition in await list_partitions(connection)}
+        for shift in range(months_ahead + 1):
+            start, end = month_start(today, shift), month_start(today, shift + 1)
+            name = partition_name(start)
+            if name in existing:
+                continue
+            await connection.execute(text(
+                f"CREATE TABLE {name} PARTITION OF orders "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+            created.append(name)
+
+    for name in created:
+        await log.b_info(f"Created orders partition: {name}")
+    return created
+
+
+async def archive_partitions(
+    engine: AsyncEngine,
+    keep_months: int = PARTITION_KEEP_MONTHS,
+    directory: str = ARCHIVE_DIRECTORY
+) -> List[str]:
+    """
+    Detach partitions older than keep_months, write them with the lines of their orders
+    to the archive and drop them.
+    @params engine: database engine.
+    @params keep_months: number of months, including the current one, kept in the database.
+    @params directory: archive directory.
+    @return: paths of written archive files.
+    """
+    cutoff = month_start(datetime.datetime.utcnow().date(), -(keep_months - 1))
+    async with engine.connect() as connection:
+        partitions = [
+            partition for partition in await list_partitions(connection)
+            if partition['end'] <= cutoff
+        ]
+
+    archived = []
+    for partition in partitions:
+        name = partition['name']
+        if not PARTITION_NAME_PATTERN.match(name):
+            await log.b_warn(f"Skip partition with unexpected name: {name}")
+            continue
+
+        # Everything is done in one transaction, a failed archive leaves the partition attached.
+        # Lines of the orders reference the partition, they are archived with it and deleted
+        # before the partition is detached. The archive is written under a name the archive
+        # does not read and renamed into place after the commit, so orders are never read
+        # from both the partition and the archive.
+        path = os.path.join(directory, f"{name}.npz")
+        pending_path = f"{path}.pending"
+        bounds = {'start': partition['start'], 'end': partition['end']}
+        try:
+            async with engine.begin() as connection:
+                await connection.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+                result = await connection.execute(text(
+                    f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM {name} ORDER BY created_at, id"
+                ))
+                rows = result.mappings().all()
+                result = await connection.execute(text(
+                    f"SELECT {', '.join(ITEM_COLUMNS)} FROM order_items "
+                    f"WHERE order_created_at >= :start AND order_created_at < :end ORDER BY id"
+                ), bounds)
+                items = result.mappings().all()
+
+                write_archive(pending_path, rows, partition['start'], partition['end'], items)
+
+                await connection.execute(text(
+                    "DELETE FROM order_items WHERE order_created_at >= :start AND order_created_at < :end"
+                ), bounds)
+                await connection.execute(text(f"ALTER TABLE orders DETACH PARTITION {name}"))
+                await connection.execute(text(f"DROP TABLE {name}"))
+        except BaseException:
+            if os.path.exists(pending_path):
+                os.remove(pending_path)
+            raise
+        os.replace(pending_path, path)
+
+        await log.b_info(f"Archived orders partition {name}: {len(rows)} rows, {len(items)} items to {path}")
+        archived.append(path)
+    return archived
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """
+    Create argument parser for CLI
+    """
+    parser = argparse.ArgumentParser(description="Orders partitions management")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list monthly partitions")
+    create = commands.add_parser("create", help="create partitions ahead of time")
+    create.add_argument("--months-ahead", default=PARTITION_MONTHS_AHEAD, type=int)
+    archive = commands.add_parser("archive", help="archive and drop old partitions")
+    archive.add_argument("--keep-months", default=PARTITION_KEEP_MONTHS, type=int)
+    archive.add_argument("--directory", default=ARCHIVE_DIRECTORY, type=str)
+    return parser
+
+
+async def main(args: argparse.Namespace) -> None:
+    from core import setup
+    await setup()
+
+    from database import connection
+    await connection.init_db()
+
+    if args.command == "list":
+        async with connection.async_engine.connect() as db_connection:
+            for partition in await list_partitions(db_connection):
+                print(f"{partition['name']}: {partition['start'].isoformat()} - {partition['end'].isoformat()}")
+    elif args.command == "create":
+        for name in await ensure_partitions(connection.async_engine, args.months_ahead):
+            print(f"created {name}")
+    elif args.command == "archive":
+        for path in await archive_partitions(connection.async_engine, args.keep_months, args.directory):
+            print(f"archived {path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(create_parser().parse_args()))
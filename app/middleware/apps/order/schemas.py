@@ -1,6 +1,6 @@
 from fastapi import Form
 from pydantic import BaseModel, Field, validator
-from typing import Optional
+from typing import List, Optional
 
 class CreateOrderSchema(BaseModel):
     """
@@ -27,3 +27,22 @@ class UpdateOrderSchema(BaseModel):
     customer_name: Optional[str] = Form(None, description="Customer's full name")
     delivery: Optional[bool] = Form(None, description="Delivery flag")
     note: Optional[str] = Form(None, description="Note for the order")
+
+
+class CheckoutItemSchema(BaseModel):
+    """
+    Basket line schema model class for pydantic validation and serialization
+    """
+    product_id: int = Field(..., description="Product ID")
+    quantity: int = Field(..., gt=0, description="Quantity of the product")
+
+
+class CheckoutSchema(BaseModel):
+    """
+    Checkout schema model class for pydantic validation and serialization.
+    The whole basket is sent as a JSON body, prices are taken from the products.
+    """
+    customer_name: str = Field(..., max_length=255, description="Customer's full name")
+    delivery: bool = Field(False, description="Delivery flag")
+    note: Optional[str] = Field(None, description="Note for the order")
+    items: List[CheckoutItemSchema] = Field(..., min_length=1, max_length=100, description="Basket lines")
@@ -0,0 +1,19 @@
+__doc__ = """
+A package for background jobs of the API server, kept in a persistent outbox table
+"""
+
+# Number of worker tasks running jobs in every process
+JOB_WORKERS = 4
+
+# Seconds between polls of the outbox when no job was enqueued by the process
+JOB_POLL_SECONDS = 5
+
+# Seconds a claimed job is owned by a process, a job still running after that
+# is considered lost (crashed process) and is claimed again
+JOB_LEASE_SECONDS = 60
+
+# Attempts of a job before it is marked as failed
+JOB_MAX_ATTEMPTS = 5
+
+# Delay before the first retry, doubled on every next one
+JOB_RETRY_BASE_SECONDS = 2
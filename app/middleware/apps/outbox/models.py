@@ -0,0 +1,73 @@
+import datetime
+from typing import Optional
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    Table,
+    Text,
+    text
+)
+from sqlalchemy.dialects.postgresql import JSONB
+
+from database.connection import Base
+from middleware.apps import metadata
+
+# Определение таблицы outbox_jobs
+# Jobs are written in the transaction of the change they belong to and
+# deleted once they ran successfully
+outbox_job_table = Table(
+    'outbox_jobs',
+    metadata,
+    Column('id', BigInteger, primary_key=True, autoincrement=True, nullable=False),
+    Column('kind', String(100), nullable=False),
+    Column('payload', JSONB, nullable=False, server_default=text("'{}'::jsonb")),
+    Column('status', String(20), nullable=False, server_default='pending'),
+    Column('attempts', Integer, nullable=False, server_default='0'),
+    Column('run_at', DateTime, nullable=False, server_default=text("timezone('utc', now())")),
+    Column('locked_until', DateTime, nullable=True),
+    Column('last_error', Text, nullable=True),
+    Column('created_at', DateTime, nullable=False, server_default=text("timezone('utc', now())")),
+    Index('ix_outbox_jobs_status_run_at', 'status', 'run_at')
+)
+
+
+class OutboxJob(Base):
+    """
+    Outbox job model class
+    """
+    __tablename__ = 'outbox_jobs'
+    id: Optional[int] = Column(BigInteger, primary_key=True, autoincrement=True, nullable=False)
+
+    kind: Optional[str] = Column(String(100), nullable=False) # Имя обработчика задачи
+
+    payload: Optional[dict] = Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+
+    status: Optional[str] = Column(String(20), nullable=False, server_default='pending') # pending, running или failed
+
+    attempts: Optional[int] = Column(Integer, nullable=False, server_default='0')
+
+    run_at: Optional[datetime.datetime] = Column(DateTime, nullable=False, server_default=text("timezone('utc', now())"))
+
+    locked_until: Optional[datetime.datetime] = Column(DateTime, nullable=True)
+
+    last_error: Optional[str] = Column(Text, nullable=True)
+
+    created_at: Optional[datetime.datetime] = Column(DateTime, nullable=False, server_default=text("timezone('utc', now())"))
+
+    def __iter__(self):
+        for attr, value in self.__dict__.items():
+            if not attr.startswith('_'):
+                yield attr, value
+
+    def dict(self):
+        data = {}
+        for attr, value in self:
+            if isinstance(value, datetime.datetime):
+                data[attr] = value.isoformat()  # Convert datetime to ISO format string
+            else:
+                data[attr] = value
+        return data
@@ -0,0 +1,257 @@
+"""
+In-process background jobs backed by the outbox_jobs table.
+
+A job is inserted into the outbox in the same transaction as the change it
+belongs to, so it exists exactly when the change was committed. Every process
+runs a poller and a pool of worker tasks: the poller claims due jobs with
+UPDATE ... FOR UPDATE SKIP LOCKED (several processes never claim the same
+job) and hands them to the workers through an asyncio queue. A job is deleted
+when its handler succeeded, retried with exponential backoff when it failed
+and marked as failed after JOB_MAX_ATTEMPTS. Jobs of a process that died are
+claimed again when their lease expired, so jobs survive restarts.
+
+Handlers are registered by kind:
+
+    @job_queue.handler('feedback.created')
+    async def notify(payload: dict) -> None:
+        ...
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from functions.async_logger import AsyncLogger
+from middleware.apps.outbox import (
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_SECONDS,
+    JOB_RETRY_BASE_SECONDS,
+    JOB_WORKERS
+)
+from middleware.apps.outbox.models import OutboxJob
+
+__all__ = [
+    'JobQueue',
+    'job_queue',
+]
+
+Handler = Callable[[dict], Awaitable[None]]
+
+CLAIM_JOBS = text("""
+    UPDATE outbox_jobs
+    SET status = 'running',
+        attempts = attempts + 1,
+        locked_until = timezone('utc', now()) + make_interval(secs => :lease)
+    WHERE id IN (
+        SELECT id FROM outbox_jobs
+        WHERE (status = 'pending' AND run_at <= timezone('utc', now()))
+           OR (status = 'running' AND locked_until < timezone('utc', now()))
+        ORDER BY run_at
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, payload, attempts
+""").execution_options(primary=True)
+
+RETRY_JOB = text("""
+    UPDATE outbox_jobs
+    SET status = 'pending',
+        run_at = timezone('utc', now()) + make_interval(secs => :delay),
+        locked_until = NULL,
+        last_error = :error
+    WHERE id = :id
+""").execution_options(primary=True)
+
+FAIL_JOB = text("""
+    UPDATE outbox_jobs
+    SET status = 'failed', locked_until = NULL, last_error = :error
+    WHERE id = :id
+""").execution_options(primary=True)
+
+RELEASE_JOBS = text("""
+    UPDATE outbox_jobs
+    SET status = 'pending', attempts = attempts - 1, locked_until = NULL
+    WHERE id = ANY(:ids) AND status = 'running'
+""").execution_options(primary=True)
+
+
+class JobQueue:
+    """
+    Background job queue with a persistent outbox.
+    """
+
+    log = AsyncLogger(__name__)
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        poll_seconds: float = JOB_POLL_SECONDS,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retry_base_seconds: float = JOB_RETRY_BASE_SECONDS
+    ) -> None:
+        """
+        Initialize the job queue.
+        @params workers: number of worker tasks.
+        @params poll_seconds: seconds between polls of the outbox.
+        @params lease_seconds: seconds a claimed job is owned by this process, handlers are cancelled after it.
+        @params max_attempts: attempts of a job before it is marked as failed.
+        @params retry_base_seconds: delay before the first retry, doubled on every next one.
+        @return: None
+        """
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self._handlers: Dict[str, Handler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._busy = 0
+
+    def handler(self, kind: str) -> Callable[[Handler], Handler]:
+        """
+        Register the handler of a job kind.
+        @params kind: job kind.
+        @return: decorator of the handler.
+        """
+        def register(function: Handler) -> Handler:
+            self._handlers[kind] = function
+            return function
+        return register
+
+    @staticmethod
+    def enqueue(session: AsyncSession, kind: str, payload: dict) -> None:
+        """
+        Add a job to the outbox in the transaction of the session, the caller commits.
+        Call wake() after the commit to run the job right away.
+        @params session: database session.
+        @params kind: job kind.
+        @params payload: JSON payload of the job.
+        @return: None
+        """
+        session.add(OutboxJob(kind=kind, payload=payload))
+
+    def wake(self) -> None:
+        """
+        Make the poller claim jobs now instead of at its next poll.
+        """
+        if self._wake is not None:
+            self._wake.set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        """
+        Start the poller and the workers.
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._wake = asyncio.Event()
+        self._wake.set()  # pick up jobs left by a previous run
+        self._tasks = [asyncio.create_task(self._poll())]
+        self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        await self.log.b_info(f"Started job queue with {self.workers} workers")
+
+    async def stop(self) -> None:
+        """
+        Stop the poller and the workers. Claimed jobs that did not start are released,
+        jobs cancelled while running are claimed again after their lease.
+        """
+        if not self._tasks:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        waiting = []
+        while not self._queue.empty():
+            waiting.append(self._queue.get_nowait()['id'])
+        if waiting:
+            from database import connection
+            async with connection.AsyncSessionLocal() as session:
+                await session.execute(RELEASE_JOBS, {'ids': waiting})
+                await session.commit()
+        await self.log.b_info(f"Stopped job queue, released {len(waiting)} jobs")
+
+    async def _poll(self) -> None:
+        from database import connection
+
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+            try:
+                while True:
+                    free = self.workers - self._busy - self._queue.qsize()
+                    if free <= 0:
+                        break  # a worker wakes the poller when it is done
+                    async with connection.AsyncSessionLocal() as session:
+                        result = await session.execute(CLAIM_JOBS, {'lease': self.lease_seconds, 'limit': free})
+                        jobs = result.mappings().all()
+                        await session.commit()
+                    for job in jobs:
+                        self._queue.put_nowait(dict(job))
+                    if len(jobs) < free:
+                        break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self.log.b_err(f"Failed to claim jobs: {e}")
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self._busy += 1
+            try:
+                await self._run(job)
+            finally:
+                self._busy -= 1
+                self.wake()
+
+    async def _run(self, job: dict) -> None:
+        from database import connection
+
+        error = None
+        handler = self._handlers.get(job['kind'])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler of job kind {job['kind']}")
+            await asyncio.wait_for(handler(job['payload']), timeout=self.lease_seconds)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        try:
+            async with connection.AsyncSessionLocal() as session:
+                if error is None:
+                    await session.execute(OutboxJob.__table__.delete().where(OutboxJob.id == job['id']))
+                elif job['attempts'] >= self.max_attempts:
+                    await session.execute(FAIL_JOB, {'id': job['id'], 'error': error})
+                else:
+                    delay = self.retry_base_seconds * 2 ** (job['attempts'] - 1)
+                    await session.execute(RETRY_JOB, {'id': job['id'], 'error': error, 'delay': delay})
+                await session.commit()
+        except Exception as e:
+            # The job is claimed again after its lease
+            await self.log.b_err(f"Failed to finish job {job['id']}: {e}")
+            return
+
+        if error is not None and job['attempts'] >= self.max_attempts:
+            await self.log.b_err(f"Job {job['id']} ({job['kind']}) failed after {job['attempts']} attempts: {error}")
+        elif error is not None:
+            await self.log.b_warn(f"Job {job['id']} ({job['kind']}) failed, retrying: {error}")
+
+
+job_queue = JobQueue()
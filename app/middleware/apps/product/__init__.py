@@ -0,0 +1,20 @@
+__doc__ = """
+A package for application products in API server
+"""
+
+# Seconds a computed bestsellers top-k is served from cache
+BESTSELLERS_CACHE_SECONDS = 30
+
+# Seconds between rebuilds of the bestsellers counters from the database by
+# a background task, picks up orders written by other workers
+BESTSELLERS_RESYNC_SECONDS = 300
+
+# Largest k of the bestsellers endpoint
+BESTSELLERS_MAX_K = 50
+
+# Seconds product reads are served from the cache of a worker. Stock counters
+# in cached products can lag by that much, the stock endpoint reads them live.
+PRODUCT_CACHE_SECONDS = 10
+
+# Number of cached product reads, a single product or a listing each
+PRODUCT_CACHE_SIZE = 1_000
@@ -0,0 +1,258 @@
+"""
+Bestsellers over sliding windows (last day, week and month).
+
+Sold units and revenue are counted per product in hourly buckets. Every
+window keeps running totals of the buckets inside it: an order write adds to
+its bucket and to the totals, buckets leaving a window are subtracted from
+its totals. A top-k is taken from the totals with a heap of size k and is
+cached for BESTSELLERS_CACHE_SECONDS, so reads never scan orders.
+
+The counters live in the process. Every worker counts the orders it writes,
+a background task started with the application rebuilds the counters from
+the database on start and every BESTSELLERS_RESYNC_SECONDS (one grouped
+query over the last month only, pruned to its partitions). Reads serve the
+current counters while a rebuild runs. The query runs in a REPEATABLE READ
+transaction whose snapshot is taken before the worker starts collecting its
+sales: sales committed before the snapshot are in the rows, the ones the
+worker counts afterwards are counted again on the rebuilt counters.
+"""
+import asyncio
+import datetime
+import heapq
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from functions.async_logger import AsyncLogger
+from middleware.apps.product import (
+    BESTSELLERS_CACHE_SECONDS,
+    BESTSELLERS_RESYNC_SECONDS
+)
+
+__all__ = [
+    'WINDOWS',
+    'BestsellerAggregator',
+    'bestsellers',
+]
+
+BUCKET_SECONDS = 3600
+
+# Window name -> number of hourly buckets
+WINDOWS: Dict[str, int] = {
+    'day': 24,
+    'week': 24 * 7,
+    'month': 24 * 30,
+}
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+SALES = text("""
+    SELECT date_trunc('hour', created_at), product_id, sum(quantity), sum(total_price)
+    FROM orders
+    WHERE created_at >= :since AND product_id IS NOT NULL
+    GROUP BY 1, 2
+    UNION ALL
+    SELECT date_trunc('hour', orders.created_at), order_items.product_id,
+           sum(order_items.quantity), sum(order_items.total_price)
+    FROM orders
+    JOIN order_items ON order_items.order_id = orders.id
+                    AND order_items.order_created_at = orders.created_at
+    WHERE orders.created_at >= :since
+    GROUP BY 1, 2
+""")
+
+log = AsyncLogger(__name__)
+
+
+def _bucket(at: datetime.datetime) -> int:
+    """
+    Get the bucket of a naive UTC datetime.
+    """
+    return int((at - EPOCH).total_seconds()) // BUCKET_SECONDS
+
+
+class BestsellerAggregator:
+    """
+    Incrementally maintained units and revenue per product over sliding windows.
+    """
+
+    def __init__(
+        self,
+        cache_seconds: float = BESTSELLERS_CACHE_SECONDS,
+        resync_seconds: float = BESTSELLERS_RESYNC_SECONDS
+    ) -> None:
+        """
+        Initialize the aggregator.
+        @params cache_seconds: seconds a computed top-k is served from cache.
+        @params resync_seconds: seconds between rebuilds of the counters from the database.
+        @return: None
+        """
+        self.cache_seconds = cache_seconds
+        self.resync_seconds = resync_seconds
+        self.synced_at: Optional[float] = None
+        self._reset()
+        self._changes: Optional[List[tuple]] = None  # sales counted during a rebuild
+        self._sync_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _reset(self) -> None:
+        # bucket -> product_id -> [units, revenue]
+        self._buckets: Dict[int, Dict[int, List[float]]] = {}
+        # window -> product_id -> [units, revenue] of the buckets inside the window
+        self._totals: Dict[str, Dict[int, List[float]]] = {window: {} for window in WINDOWS}
+        # current bucket and window -> first bucket counted in the totals
+        self._now = _bucket(datetime.datetime.utcnow())
+        self._first: Dict[str, int] = {window: self._now - size + 1 for window, size in WINDOWS.items()}
+        self._cache: Dict[Tuple[str, int], Tuple[float, dict]] = {}
+
+    @staticmethod
+    def _add(counters: Dict[int, List[float]], product_id: int, units: int, revenue: float) -> None:
+        values = counters.get(product_id)
+        if values is None:
+            values = counters[product_id] = [0, 0.0]
+        values[0] += units
+        values[1] += revenue
+        if values[0] <= 0 and abs(values[1]) < 1e-9:
+            del counters[product_id]
+
+    def _advance(self) -> None:
+        """
+        Subtract the buckets that left a window from its totals and drop buckets older than every window.
+        """
+        now = _bucket(datetime.datetime.utcnow())
+        if now == self._now:
+            return
+        self._now = now
+        for window, size in WINDOWS.items():
+            first = now - size + 1
+            totals = self._totals[window]
+            for bucket in [bucket for bucket in self._buckets if self._first[window] <= bucket < first]:
+                for product_id, (units, revenue) in self._buckets[bucket].items():
+                    self._add(totals, product_id, -units, -revenue)
+            self._first[window] = first
+
+        oldest = min(self._first.values())
+        for bucket in [bucket for bucket in self._buckets if bucket < oldest]:
+            del self._buckets[bucket]
+
+    def record(self, product_id: int, units: int, revenue: float, at: datetime.datetime) -> None:
+        """
+        Count a sale, negative values take a sale back (deleted or changed orders).
+        @params product_id: The ID of the product.
+        @params units: sold units.
+        @params revenue: revenue of the sale.
+        @params at: creation time of the order, naive UTC.
+        @return: None
+        """
+        if self._changes is not None:
+            self._changes.append((product_id, units, revenue, at))
+        self._advance()
+        bucket = _bucket(at)
+        if bucket < min(self._first.values()):
+            return
+
+        self._add(self._buckets.setdefault(bucket, {}), product_id, units, revenue)
+        for window in WINDOWS:
+            if bucket >= self._first[window]:
+                self._add(self._totals[window], product_id, units, revenue)
+
+    def load(self, rows: List[Tuple[datetime.datetime, int, int, float]]) -> None:
+        """
+        Replace the counters.
+        @params rows: (bucket start, product_id, units, revenue) tuples.
+        @return: None
+        """
+        self._reset()
+        for at, product_id, units, revenue in rows:
+            self.record(product_id, units, revenue, at)
+        self.synced_at = time.monotonic()
+
+    def top(self, window: str, k: int) -> dict:
+        """
+        Get the top-k products of a window by units and by revenue.
+        @params window: one of WINDOWS.
+        @params k: number of products.
+        @return: dict with by_units and by_revenue lists of {product_id, units, revenue}.
+        @raise: KeyError if the window is unknown.
+        """
+        size = WINDOWS[window]
+        key = (window, k)
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.cache_seconds:
+            return cached[1]
+
+        self._advance()
+        totals = self._totals[window].items()
+        result = {
+            'window': window,
+            'hours': size,
+            'by_units': [
+                {'product_id': product_id, 'units': units, 'revenue': revenue}
+                for product_id, (units, revenue) in heapq.nlargest(k, totals, key=lambda item: (item[1][0], item[1][1]))
+            ],
+            'by_revenue': [
+                {'product_id': product_id, 'units': units, 'revenue': revenue}
+                for product_id, (units, revenue) in heapq.nlargest(k, totals, key=lambda item: item[1][1])
+            ],
+        }
+        self._cache[key] = (time.monotonic(), result)
+        return result
+
+    async def sync(self, session: AsyncSession) -> None:
+        """
+        Rebuild the counters from the orders of the longest window. The current counters are served
+        until the rows are read, a call while a rebuild runs waits for it instead of starting another.
+        @params session: database session without a transaction, the sales are read in a new one.
+        @return: None
+        """
+        if self._sync_lock.locked():
+            async with self._sync_lock:
+                return
+        async with self._sync_lock:
+            since = datetime.datetime.utcnow() - datetime.timedelta(seconds=max(WINDOWS.values()) * BUCKET_SECONDS)
+            # The first statement takes the snapshot the sales are read in, after waiting for a
+            # connection; sales counted from then on are not in the rows
+            await session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+            await session.execute(text("SELECT 1"))
+            self._changes = []
+            try:
+                rows = [tuple(row) for row in (await session.execute(SALES, {'since': since})).all()]
+            finally:
+                changes, self._changes = self._changes, None
+            self.load(rows)
+            for change in changes:
+                self.record(*change)
+
+    async def start(self) -> None:
+        """
+        Start the background rebuilds, the first one right away.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._resync())
+
+    async def stop(self) -> None:
+        """
+        Stop the background rebuilds.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _resync(self) -> None:
+        from database import connection
+
+        while True:
+            try:
+                async with connection.AsyncSessionLocal() as session:
+                    await self.sync(session)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await log.b_err(f"Failed to rebuild the bestsellers: {e}")
+            await asyncio.sleep(self.resync_seconds)
+
+bestsellers = BestsellerAggregator()
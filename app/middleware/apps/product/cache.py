@@ -0,0 +1,66 @@
+"""
+Cache of the public product reads.
+
+ProductManager keeps single products and listings per worker for
+PRODUCT_CACHE_SECONDS, a hit is answered without a statement, so the
+request never checks a connection out of the pool. Product writes clear the
+cache of every worker once they are committed, see
+middleware.apps.invalidation.bus.
+
+Responses of the cached reads carry an ETag of their body; a client that
+sends it back in If-None-Match gets a 304 without the body.
+"""
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+from middleware.apps.invalidation.bus import invalidation_bus
+from middleware.apps.product import PRODUCT_CACHE_SECONDS, PRODUCT_CACHE_SIZE
+from utils import TTLCache
+
+__all__ = [
+    'etag',
+    'etag_response',
+    'product_cache',
+]
+
+product_cache = TTLCache(PRODUCT_CACHE_SECONDS, PRODUCT_CACHE_SIZE)
+invalidation_bus.register('products', lambda key: product_cache.clear())
+
+
+def etag(body: bytes) -> str:
+    """
+    Get the strong ETag of a response body.
+    """
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def matches(if_none_match: Optional[str], tag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag, weak comparison like RFC 9110 asks for GET.
+    @params if_none_match: value of the header, None if the request has none.
+    @params tag: ETag of the current body.
+    @return: True if the client has the current body.
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or any(candidate.removeprefix('W/') == tag for candidate in candidates)
+
+
+def etag_response(request: Request, content: str, status_code: int) -> Response:
+    """
+    Create a JSON response with an ETag, 304 Not Modified if the request already has the body.
+    @params request: HTTP request.
+    @params content: JSON body.
+    @params status_code: status code of the body.
+    @return: Response object.
+    """
+    if status_code >= 300:
+        return Response(content=content, media_type="application/json", status_code=status_code)
+    tag = etag(content.encode())
+    headers = {'ETag': tag, 'Cache-Control': 'no-cache'}  # clients revalidate every time
+    if matches(request.headers.get('if-none-match'), tag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="application/json", status_code=status_code, headers=headers)
@@ -1,6 +1,7 @@
 import shutil
 from typing import (
     List, 
+    Literal,
     Optional
 )
 import json
@@ -11,6 +12,8 @@ from fastapi import (
     File, 
     Form,
     HTTPException,
+    Query,
+    Request,
     UploadFile, 
     status as HTTPStatus, 
     Response
@@ -20,8 +23,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from middleware.apps.admin.models import Admin
 from middleware.apps.admin.utils import get_current_user
+from middleware.apps.product import BESTSELLERS_MAX_K
+from middleware.apps.product.cache import etag_response
 from middleware.apps.product.manager import ProductManager
-from middleware.apps.product.schemas import CreateProductSchema
+from middleware.apps.product.schemas import CreateProductSchema, UpdateStockSchema
 from database.session import get_async_db
 
 API_PRODUCT_MODULE = APIRouter(
@@ -105,11 +110,13 @@ async def create_product(
 )
 async def get_product_by_id(
     product_id: int,
+    request: Request,
     product_manager: 'ProductManager' = Depends(get_product_manager),
 ) -> Response:
     """
     Get product by id. API endpoint. 
     @params: product_id: product id.
+    @params: request: HTTP request, answered with 304 if its If-None-Match has the ETag of the body.
     @params: product_manager: Dependency
     @return: Response object. 
     @raise: HTTPException if product not found.
@@ -137,7 +144,7 @@ async def get_product_by_id(
             status_code = HTTPStatus.HTTP_500_INTERNAL_SERVER_ERROR # 500 Internal Server Error
             
         response_json = json.dumps(response_content)  # Convert dictionary to JSON string
-        response = Response(content=response_json, media_type="application/json", status_code=status_code)
+        response = etag_response(request, response_json, status_code)
         return response
 
 
@@ -147,10 +154,12 @@ async def get_product_by_id(
     summary='Get all products',
 )
 async def get_all_products(
+    request: Request,
     product_manager: 'ProductManager' = Depends(get_product_manager),
 ) -> Response:
     """
     Get all products. API endpoint. 
+    @params: request: HTTP request, answered with 304 if its If-None-Match has the ETag of the body.
     @params: product_manager: Dependency
     @return: Response object. 
     @raise: HTTPException if products not found.
@@ -177,7 +186,7 @@ async def get_all_products(
             status_code = HTTPStatus.HTTP_500_INTERNAL_SERVER_ERROR # 500 Internal Server Error
         
     response_json = json.dumps(response_content)  # Convert dictionary to JSON string
-    response = Response(content=response_json, media_type="application/json", status_code=status_code)
+    response = etag_response(request, response_json, status_code)
     return response
 
 @API_PRODUCT_MODULE.get(
@@ -187,10 +196,12 @@ async def get_all_products(
 )
 async def get_all_products(
     product_type: str,
+    request: Request,
     product_manager: 'ProductManager' = Depends(get_product_manager),
 ) -> Response:
     """
     Get all products. API endpoint. 
+    @params: request: HTTP request, answered with 304 if its If-None-Match has the ETag of the body.
     @params: product_manager: Dependency
     @return: Response object. 
     @raise: HTTPException if products not found.
@@ -217,7 +228,7 @@ async def get_all_products(
             status_code = HTTPStatus.HTTP_500_INTERNAL_SERVER_ERROR # 500 Internal Server Error
         
     response_json = json.dumps(response_content)  # Convert dictionary to JSON string
-    response = Response(content=response_json, media_type="application/json", status_code=status_code)
+    response = etag_response(request, response_json, status_code)
     return response
 
 @API_PRODUCT_MODULE.put(
@@ -319,6 +330,119 @@ async def delete_product_by_id(
         return response
 
 
+
+@API_PRODUCT_MODULE.get(
+    '/{product_id}/stock/',
+    summary='Get product stock by id',
+)
+async def get_product_stock(
+    product_id: int,
+    product_manager: 'ProductManager' = Depends(get_product_manager),
+) -> Response:
+    """
+    Get product stock by id. API endpoint.
+    @params: product_id: product id.
+    @params: product_manager: Dependency
+    @return: Response object.
+    @raise: HTTPException if product not found.
+    """
+    try:
+        stock = await product_manager.get_product_stock(product_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=HTTPStatus.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    if stock is None:
+        raise HTTPException(
+            status_code=HTTPStatus.HTTP_404_NOT_FOUND,
+            detail=f"Product not found: {product_id}"
+        )
+
+    response_content = {
+        'stock': stock,
+        'details': "Successfully get product stock",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json", status_code=HTTPStatus.HTTP_202_ACCEPTED)
+    return response
+
+
+@API_PRODUCT_MODULE.put(
+    '/{product_id}/stock/',
+    summary='Set product stock by id',
+)
+async def set_product_stock(
+    product_id: int,
+    stock: UpdateStockSchema = Depends(),
+    product_manager: 'ProductManager' = Depends(get_product_manager),
+    current_user: Admin = Depends(get_current_user)
+) -> Response:
+    """
+    Set product stock by id. API endpoint.
+    @params: product_id: product id.
+    @params: stock: new stock and number of stripes.
+    @params: product_manager: Dependency
+    @return: Response object.
+    @raise: HTTPException if product not found.
+    """
+    try:
+        updated_stock = await product_manager.set_product_stock(product_id, stock)
+    except Exception as e:
+        raise HTTPException(
+            status_code=HTTPStatus.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+    if updated_stock is None:
+        raise HTTPException(
+            status_code=HTTPStatus.HTTP_404_NOT_FOUND,
+            detail=f"Product not found: {product_id}"
+        )
+
+    response_content = {
+        'stock': updated_stock,
+        'details': "Successfully updated product stock",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = Response(content=response_json, media_type="application/json", status_code=HTTPStatus.HTTP_202_ACCEPTED)
+    return response
+
+
+@API_PRODUCT_MODULE.get(
+    '/bestsellers/',
+    summary='Get bestsellers of the last day, week or month',
+)
+async def get_bestsellers(
+    request: Request,
+    k: int = Query(10, ge=1, le=BESTSELLERS_MAX_K),
+    window: Literal['day', 'week', 'month'] = 'day',
+    product_manager: 'ProductManager' = Depends(get_product_manager),
+) -> Response:
+    """
+    Get top products by sold units and by revenue over a sliding window. API endpoint.
+    @params: request: HTTP request, answered with 304 if its If-None-Match has the ETag of the body.
+    @params: k: number of products.
+    @params: window: day, week or month.
+    @params: product_manager: Dependency
+    @return: Response object.
+    @raise: HTTPException if bestsellers could not be computed.
+    """
+    try:
+        top = await product_manager.get_bestsellers(window, k)
+    except Exception as e:
+        raise HTTPException(
+            status_code=HTTPStatus.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
+
+    response_content = {
+        'bestsellers': top,
+        'details': "Successfully get bestsellers",
+    }
+    response_json = json.dumps(response_content)  # Convert dictionary to JSON string
+    response = etag_response(request, response_json, HTTPStatus.HTTP_202_ACCEPTED)
+    return response
+
     
 @API_PRODUCT_MODULE.get(
     '/on-sale/',
@@ -326,10 +450,12 @@ async def delete_product_by_id(
     summary='Get all products on sale',
 )
 async def get_products_on_sale(
+    request: Request,
     product_manager: 'ProductManager' = Depends(get_product_manager),
 ) -> Response:
     """
     Get all products on sale. API endpoint.
+    @params: request: HTTP request, answered with 304 if its If-None-Match has the ETag of the body.
     @params: product_manager: Dependency
     @return: Response object.
     @raise: HTTPException if products not found.
@@ -355,7 +481,7 @@ async def get_products_on_sale(
             status_code = HTTPStatus.HTTP_500_INTERNAL_SERVER_ERROR # 500 Internal Server Error
 
     response_json = json.dumps(response_content)  # Convert dictionary to JSON string
-    response = Response(content=response_json, media_type="application/json", status_code=status_code)
+    response = etag_response(request, response_json, status_code)
     return response
 
 
@@ -0,0 +1,286 @@
+"""
+Product inventory. Stock reservations are done with conditional updates
+(UPDATE ... WHERE stock >= :quantity RETURNING), so no row is read and then
+written back and concurrent buyers can never oversell a product.
+
+A product keeps its stock either in products.stock (stock_stripes = 0) or,
+for hot products, split across product_stock_stripes rows. Striped
+reservations take the first unlocked stripe with enough stock
+(FOR UPDATE SKIP LOCKED), so buyers of one product do not queue on one row.
+"""
+import random
+from typing import Optional
+
+from sqlalchemy import (
+    delete,
+    func,
+    insert,
+    select,
+    update
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from middleware.apps.product.models import (
+    Product,
+    ProductStockStripe
+)
+
+__all__ = [
+    'OutOfStockError',
+    'ProductNotFoundError',
+    'reserve_stock',
+    'release_stock',
+    'set_stock',
+    'get_stock',
+]
+
+
+class OutOfStockError(Exception):
+    """
+    Raised when a product has not enough stock for a reservation.
+    """
+    def __init__(self, product_id: int, quantity: int) -> None:
+        self.product_id = product_id
+        self.quantity = quantity
+        super().__init__(f"Product {product_id} has not enough stock for quantity {quantity}")
+
+
+class ProductNotFoundError(Exception):
+    """
+    Raised when a reservation refers to a product that does not exist.
+    """
+    def __init__(self, product_id: int) -> None:
+        self.product_id = product_id
+        super().__init__(f"Product not found: {product_id}")
+
+
+class _NoFreeStripe(Exception):
+    """
+    Raised when no unlocked stripe can serve a reservation.
+    """
+
+
+async def reserve_stock(session: AsyncSession, product_id: int, quantity: int) -> Optional[int]:
+    """
+    Reserve stock of a product inside the current transaction of the session.
+    The reservation is rolled back together with the transaction.
+    @params session: database session with an open transaction.
+    @params product_id: The ID of the product.
+    @params quantity: quantity to reserve.
+    @return: stock left in products.stock or in the used stripe, None if the stock of the product is not tracked.
+    @raise: OutOfStockError if there is not enough stock, ProductNotFoundError if the product does not exist.
+    """
+    if quantity <= 0:
+        raise ValueError(f"Quantity must be greater than 0: {quantity}")
+
+    # Fast path: one statement for a product with a single stock counter
+    result = await session.execute(
+        update(Product)
+        .where(
+            Product.id == product_id,
+            Product.stock_stripes == 0,
+            Product.stock >= quantity
+        )
+        .values(stock=Product.stock - quantity)
+        .returning(Product.stock)
+        .execution_options(synchronize_session=False)
+    )
+    left = result.scalar_one_or_none()
+    if left is not None:
+        return left
+
+    result = await session.execute(
+        select(Product.stock, Product.stock_stripes).where(Product.id == product_id)
+    )
+    row = result.one_or_none()
+    if row is None:
+        raise ProductNotFoundError(product_id)
+
+    stock, stripes = row
+    if not stripes:
+        if stock is None:
+            return None
+        raise OutOfStockError(product_id, quantity)
+
+    return await _reserve_striped(session, product_id, quantity, stripes)
+
+
+async def _reserve_striped(session: AsyncSession, product_id: int, quantity: int, stripes: int) -> int:
+    """
+    Reserve stock from the stripes of a product.
+    Starts from a random stripe and skips stripes locked by other buyers,
+    falls back to locking all stripes when none of them can serve the quantity.
+    """
+    offset = random.randrange(stripes)
+    candidate = (
+        select(ProductStockStripe.stripe)
+        .where(
+            ProductStockStripe.product_id == product_id,
+            ProductStockStripe.stock >= quantity
+        )
+        .order_by((ProductStockStripe.stripe + offset) % stripes)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    try:
+        # The savepoint drops a stripe lock taken by a failed attempt,
+        # so the slow path below never waits while holding a stripe.
+        async with session.begin_nested():
+            result = await session.execute(
+                update(ProductStockStripe)
+                .where(
+                    ProductStockStripe.product_id == product_id,
+                    ProductStockStripe.stripe == candidate,
+                    ProductStockStripe.stock >= quantity
+                )
+                .values(stock=ProductStockStripe.stock - quantity)
+                .returning(ProductStockStripe.stock)
+                .execution_options(synchronize_session=False)
+            )
+            left = result.scalar_one_or_none()
+            if left is None:
+                raise _NoFreeStripe()
+        return left
+    except _NoFreeStripe:
+        pass
+
+    # Slow path: every stripe is drained or locked, wait for all of them in a fixed order
+    result = await session.execute(
+        select(ProductStockStripe.stripe, ProductStockStripe.stock)
+        .where(ProductStockStripe.product_id == product_id)
+        .order_by(ProductStockStripe.stripe)
+        .with_for_update()
+        .execution_options(primary=True)
+    )
+    rows = result.all()
+    if sum(stock for _, stock in rows) < quantity:
+        raise OutOfStockError(product_id, quantity)
+
+    remaining = quantity
+    for stripe, stock in rows:
+        if remaining == 0:
+            break
+        taken = min(stock, remaining)
+        if taken == 0:
+            continue
+        await session.execute(
+            update(ProductStockStripe)
+            .where(
+                ProductStockStripe.product_id == product_id,
+                ProductStockStripe.stripe == stripe
+            )
+            .values(stock=ProductStockStripe.stock - taken)
+            .execution_options(synchronize_session=False)
+        )
+        remaining -= taken
+    return 0
+
+
+async def release_stock(session: AsyncSession, product_id: int, quantity: int) -> None:
+    """
+    Return reserved stock of a product, e.g. when an order is deleted.
+    @params session: database session with an open transaction.
+    @params product_id: The ID of the product.
+    @params quantity: quantity to return.
+    @return: None
+    """
+    if quantity <= 0:
+        return
+
+    result = await session.execute(
+        update(Product)
+        .where(
+            Product.id == product_id,
+            Product.stock_stripes == 0,
+            Product.stock.is_not(None)
+        )
+        .values(stock=Product.stock + quantity)
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.scalar_one_or_none() is not None:
+        return
+
+    stripe = (
+        select(ProductStockStripe.stripe)
+        .where(ProductStockStripe.product_id == product_id)
+        .order_by(func.random())
+        .limit(1)
+        .scalar_subquery()
+    )
+    await session.execute(
+        update(ProductStockStripe)
+        .where(
+            ProductStockStripe.product_id == product_id,
+            ProductStockStripe.stripe == stripe
+        )
+        .values(stock=ProductStockStripe.stock + quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def set_stock(session: AsyncSession, product_id: int, stock: Optional[int], stripes: int = 0) -> bool:
+    """
+    Set the stock of a product.
+    @params session: database session with an open transaction.
+    @params product_id: The ID of the product.
+    @params stock: new stock of the product, None to stop tracking the stock.
+    @params stripes: number of stripes to split the stock across, 0 or 1 keeps the stock in one row.
+    @return: True if the product was found, False otherwise.
+    """
+    if stock is not None and stock < 0:
+        raise ValueError(f"Stock must be greater than or equal to 0: {stock}")
+    if stock is None or stripes <= 1:
+        stripes = 0
+
+    result = await session.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(
+            stock=stock if not stripes else None,
+            stock_stripes=stripes
+        )
+        .returning(Product.id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.scalar_one_or_none() is None:
+        return False
+
+    await session.execute(
+        delete(ProductStockStripe).where(ProductStockStripe.product_id == product_id)
+    )
+    if stripes:
+        share, rest = divmod(stock, stripes)
+        await session.execute(
+            insert(ProductStockStripe),
+            [
+                {'product_id': product_id, 'stripe': n, 'stock': share + (1 if n < rest else 0)}
+                for n in range(stripes)
+            ]
+        )
+    return True
+
+
+async def get_stock(session: AsyncSession, product_id: int) -> Optional[dict]:
+    """
+    Get the stock of a product.
+    @params session: database session.
+    @params product_id: The ID of the product.
+    @return: dict with the stock and the number of stripes, None if the product was not found.
+    """
+    result = await session.execute(
+        select(Product.stock, Product.stock_stripes).where(Product.id == product_id)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return None
+
+    stock, stripes = row
+    if stripes:
+        result = await session.execute(
+            select(func.sum(ProductStockStripe.stock))
+            .where(ProductStockStripe.product_id == product_id)
+        )
+        stock = result.scalar_one_or_none() or 0
+    return {'product_id': product_id, 'stock': stock, 'stripes': stripes}
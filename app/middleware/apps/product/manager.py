@@ -2,13 +2,20 @@ import base64
 from typing import List, Optional
 from typing_extensions import deprecated
 from fastapi import HTTPException
-from sqlalchemy import select
+from sqlalchemy import delete, insert, select
+from sqlalchemy import update as update_statement
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
+from database.unit_of_work import commit, rollback
+from middleware.apps import validated_values
 from middleware.apps.product.schemas import CreateProductSchema
 from middleware.apps.product.models import Product
+from middleware.apps.product.bestsellers import bestsellers
+from middleware.apps.product.cache import product_cache
+from middleware.apps.product.inventory import get_stock, set_stock
+from middleware.apps.invalidation.bus import invalidation_bus
 from functions.async_logger import AsyncLogger
-from .schemas import CreateProductSchema, UpdateProductSchema
+from .schemas import CreateProductSchema, UpdateProductSchema, UpdateStockSchema
 
 def load_image(image):
     # take from https://github.com/massonskyi/OWC-backend/blob/master/middleware/profile/endpoints.py
@@ -49,28 +56,26 @@ class ProductManager:
             await self.log.b_crit(f"Validation error: {new.errors()}")
             raise ValueError(f"Validation error: {new.errors()}")
 
-        new_product = Product(
-            name=new.name,
-            smallDescription=new.smallDescription,
-            description=new.description,
-            application=new.application,
-            structure=new.structure,
-            price=new.price,
-            status=new.status,
-            type=new.type,
-            is_on_sale=new.is_on_sale,
-            sale_price=new.sale_price,
-            file=image
-            )
+        values = validated_values(Product, {
+            'name': new.name,
+            'smallDescription': new.smallDescription,
+            'description': new.description,
+            'application': new.application,
+            'structure': new.structure,
+            'price': new.price,
+            'status': new.status,
+            'type': new.type,
+            'is_on_sale': new.is_on_sale,
+            'sale_price': new.sale_price,
+            'image': image,
+        })
         try:
-            async with self.__async_db_session as async_session:
-                if not async_session.in_transaction():
-                    async with async_session.begin():
-                        async_session.add(new_product)
-                        await async_session.commit()
-                else:
-                    async_session.add(new_product)
-                    await async_session.commit()
+            async_session = self.__async_db_session
+            new_product = (await async_session.scalars(
+                insert(Product).values(**values).returning(Product)
+            )).one()
+            await invalidation_bus.publish(async_session, 'products')
+            await commit(async_session)
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -83,13 +88,18 @@ class ProductManager:
         @return: The product if found, None otherwise.
         @raise: Exception if any errors occur. Raises an exception if any error occurs.
         """
+        cached = product_cache.get(('product', product_id))
+        if cached is not None:
+            return cached
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(Product).filter_by(id=product_id))
-                product = result.scalar_one_or_none()
-                if product:
-                    return product.dict(), load_image(product.image)
-                return None
+            async_session = self.__async_db_session
+            result = await async_session.execute(select(Product).filter_by(id=product_id))
+            product = result.scalar_one_or_none()
+            if product:
+                cached = product.dict(), load_image(product.image)
+                product_cache.set(('product', product_id), cached)
+                return cached
+            return None
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -100,13 +110,18 @@ class ProductManager:
         @return: A list of all products.
         @raise: Exception if any errors occur. Raises an exception if any error occurs.
         """
+        cached = product_cache.get(('all',))
+        if cached is not None:
+            return cached
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(Product))
-                products = result.scalars().all()
-                if not products:
-                    raise
-            return  [{'id':product.id, 'product':product.dict(), 'file':load_image(product.image)} for product in products]
+            async_session = self.__async_db_session
+            result = await async_session.execute(select(Product))
+            products = result.scalars().all()
+            if not products:
+                raise
+            cached = [{'id':product.id, 'product':product.dict(), 'file':load_image(product.image)} for product in products]
+            product_cache.set(('all',), cached)
+            return cached
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -118,11 +133,16 @@ class ProductManager:
         @return: A list of products of the specified type.
         @raise: Exception if any errors occur. Raises an exception if any error occurs.
         """
+        cached = product_cache.get(('type', product_type))
+        if cached is not None:
+            return cached
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(Product).filter_by(type=product_type))
-                products = result.scalars().all()
-                return  [{'id':product.id, 'product':product.dict(), 'file':load_image(product.image)} for product in products]
+            async_session = self.__async_db_session
+            result = await async_session.execute(select(Product).filter_by(type=product_type))
+            products = result.scalars().all()
+            cached = [{'id':product.id, 'product':product.dict(), 'file':load_image(product.image)} for product in products]
+            product_cache.set(('type', product_type), cached)
+            return cached
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -133,11 +153,16 @@ class ProductManager:
         @return: A list of products that are on sale.
         @raise: Exception if any errors occur. Raises an exception if any error occurs.
         """
+        cached = product_cache.get(('on_sale',))
+        if cached is not None:
+            return cached
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(Product).filter_by(is_on_sale=True))
-                products = result.scalars().all()
-                return  [{'id':product.id, 'product':product.dict(), 'file':load_image(product.image)} for product in products]
+            async_session = self.__async_db_session
+            result = await async_session.execute(select(Product).filter_by(is_on_sale=True))
+            products = result.scalars().all()
+            cached = [{'id':product.id, 'product':product.dict(), 'file':load_image(product.image)} for product in products]
+            product_cache.set(('on_sale',), cached)
+            return cached
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -149,17 +174,21 @@ class ProductManager:
         @return: A list of all products with the sale price if applicable.
         @raise: Exception if any errors occur. Raises an exception if any error occurs.
         """
+        cached = product_cache.get(('with_sale_price',))
+        if cached is not None:
+            return cached
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(Product))
-                products = result.scalars().all()
-                product_list = []
-                for product in products:
-                    product_dict = product.dict()
-                    if product.is_on_sale:
-                        product_dict['price'] = product.sale_price
-                    product_list.append(product_dict)
-                return product_list
+            async_session = self.__async_db_session
+            result = await async_session.execute(select(Product))
+            products = result.scalars().all()
+            product_list = []
+            for product in products:
+                product_dict = product.dict()
+                if product.is_on_sale:
+                    product_dict['price'] = product.sale_price
+                product_list.append(product_dict)
+            product_cache.set(('with_sale_price',), product_list)
+            return product_list
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -173,18 +202,22 @@ class ProductManager:
         @raise: Exception if any errors occur. Raises an exception if any error occurs.
         """
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(Product).filter_by(id=product_id))
-                product = result.scalar_one_or_none()
+            async_session = self.__async_db_session
+            values = validated_values(Product, update.dict(exclude={'file'}))
+            values['image'] = result_image_path
+            product = (await async_session.scalars(
+                update_statement(Product)
+                .where(Product.id == product_id)
+                .values(**values)
+                .returning(Product)
+            )).one_or_none()
 
-                if product:
-                    for key, value in update.dict(exclude='file').items():
-                        setattr(product, key, value)
-                    setattr(product, 'image', result_image_path )
-                    await async_session.commit()
+            if product:
+                await invalidation_bus.publish(async_session, 'products')
+                await commit(async_session)
 
-                    return {'product':product.dict(), 'file':load_image(product.image)}
-                return None
+                return {'product':product.dict(), 'file':load_image(product.image)}
+            return None
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
@@ -197,14 +230,67 @@ class ProductManager:
         @raise: Exception if any errors occur. Raises an exception if any error occurs.
         """
         try:
-            async with self.__async_db_session as async_session:
-                result = await async_session.execute(select(Product).filter_by(id=product_id))
-                product = result.scalar_one_or_none()
-                if product:
-                    await async_session.delete(product)
-                    await async_session.commit()
-                    return True
-                return False
+            async_session = self.__async_db_session
+            deleted = (await async_session.execute(
+                delete(Product).where(Product.id == product_id).returning(Product.id)
+            )).scalar_one_or_none()
+            if deleted is not None:
+                await invalidation_bus.publish(async_session, 'products')
+                await commit(async_session)
+                return True
+            return False
         except SQLAlchemyError as e:
             await self.log.b_crit(f"Error: {e}")
             raise SQLAlchemyError(f"Error: {e}")
+
+    async def get_product_stock(self, product_id: int) -> Optional[dict]:
+        """
+        Get the stock of a product.
+        @params: product_id: The ID of the product.
+        @return: dict with the stock and the number of stripes if found, None otherwise.
+        @raise: Exception if any errors occur. Raises an exception if any error occurs.
+        """
+        try:
+            async_session = self.__async_db_session
+            return await get_stock(async_session, product_id)
+        except SQLAlchemyError as e:
+            await self.log.b_crit(f"Error: {e}")
+            raise SQLAlchemyError(f"Error: {e}")
+
+    async def set_product_stock(self, product_id: int, update: UpdateStockSchema) -> Optional[dict]:
+        """
+        Set the stock of a product. With stripes > 1 the stock is split across
+        several counter rows, use it for products bought by many buyers at once.
+        @params: product_id: The ID of the product.
+        @params: update: The new stock and number of stripes.
+        @return: dict with the stock and the number of stripes if found, None otherwise.
+        @raise: Exception if any errors occur. Raises an exception if any error occurs.
+        """
+        if not update.validate():
+            await self.log.b_crit(f"Validation error: {update}")
+            raise ValueError(f"Validation error: {update}")
+
+        try:
+            async_session = self.__async_db_session
+            found = await set_stock(async_session, product_id, update.stock, update.stripes)
+            if not found:
+                await rollback(async_session)
+                return None
+            await invalidation_bus.publish(async_session, 'products')
+            await commit(async_session)
+            return await get_stock(async_session, product_id)
+        except SQLAlchemyError as e:
+            await self.log.b_crit(f"Error: {e}")
+            raise SQLAlchemyError(f"Error: {e}")
+
+    async def get_bestsellers(self, window: str, k: int) -> dict:
+        """
+        Get the top-k products of a sliding window by sold units and by revenue.
+        The counters are kept in memory, maintained by order writes and rebuilt by a
+        background task, the database is never read here.
+        @params: window: day, week or month.
+        @params: k: number of products.
+        @return: dict with by_units and by_revenue lists.
+        @raise: KeyError if the window is unknown.
+        """
+        return bestsellers.top(window, k)
@@ -11,7 +11,10 @@ from sqlalchemy import (
     Table,  
     TIMESTAMP, 
     Text,
-    Float
+    Float,
+    CheckConstraint,
+    Index,
+    text
 )
 
 from sqlalchemy.orm import validates
@@ -33,7 +36,22 @@ product_table = Table(
     Column('status', Boolean, nullable=True),
     Column('uuid_file_store', String(255), nullable=True),
     Column('is_on_sale', Boolean, nullable=True),  # New field for sale status
-    Column('sale_price', Float, nullable=True)     # New field for sale price
+    Column('sale_price', Float, nullable=True),    # New field for sale price
+    Column('stock', Integer, nullable=True),       # NULL - stock is not tracked
+    Column('stock_stripes', Integer, nullable=False, server_default='0'),  # 0 - stock is kept in products.stock
+    CheckConstraint('stock >= 0', name='ck_products_stock_positive'),
+    Index('ix_products_type', 'type'),
+    Index('ix_products_is_on_sale', 'id', postgresql_where=text('is_on_sale'))  # few products are on sale
+)
+
+# Striped stock counters for hot products, see middleware.apps.product.inventory
+product_stock_stripe_table = Table(
+    'product_stock_stripes',
+    metadata,
+    Column('product_id', Integer, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True, nullable=False),
+    Column('stripe', Integer, primary_key=True, nullable=False),
+    Column('stock', Integer, nullable=False),
+    CheckConstraint('stock >= 0', name='ck_product_stock_stripes_stock_positive')
 )
 
 
@@ -56,8 +74,10 @@ class Product(Base):
     uuid_file_store: Optional[str] = Column(String(255), nullable=True)
     is_on_sale: Optional[bool] = Column(Boolean, nullable=True)  # New field for sale status
     sale_price: Optional[float] = Column(Float, nullable=True)   # New field for sale price
+    stock: Optional[int] = Column(Integer, nullable=True)        # NULL - stock is not tracked
+    stock_stripes: Optional[int] = Column(Integer, nullable=False, server_default='0', default=0)
 
-    def __init__(self, name, smallDescription, description, application, structure, price, type, status, is_on_sale, sale_price,file):
+    def __init__(self, name, smallDescription, description, application, structure, price, type, status, is_on_sale, sale_price,file, stock=None):
         """
         Initialize product
         """
@@ -73,6 +93,7 @@ class Product(Base):
         self.sale_price = sale_price
         # Создание папки и файлов при создании записи
         self.image=file
+        self.stock = stock
     def __repr__(self):
         return '<Product %r>' % self.Name
     
@@ -94,6 +115,12 @@ class Product(Base):
             raise ValueError('is_on_sale must be True or False')
         return value
 
+    @validates('stock')
+    def validate_stock(self, key, value):
+        if value is not None and value < 0:
+            raise ValueError('Stock must be greater than or equal to 0')
+        return value
+
     @validates('sale_price')
     def validate_sale_price(self, key, value):
         if value is not None and value < 0:
@@ -121,4 +148,16 @@ class Product(Base):
         """
         if self.is_on_sale:
             return self.price * (1 - discount_percentage / 100)
-        return self.price
\ No newline at end of file
+        return self.price
+
+
+class ProductStockStripe(Base):
+    """
+    Product stock stripe model. The stock of a hot product is split across
+    several rows so concurrent buyers do not queue on a single row lock.
+    """
+    __tablename__ = 'product_stock_stripes'
+
+    product_id: Optional[int] = Column(Integer, ForeignKey('products.id', ondelete='CASCADE'), primary_key=True, nullable=False)
+    stripe: Optional[int] = Column(Integer, primary_key=True, nullable=False)
+    stock: Optional[int] = Column(Integer, nullable=False)
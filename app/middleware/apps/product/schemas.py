@@ -120,3 +120,37 @@ class UpdateProductSchema(CreateProductSchema):
         except ValueError:
             return False
         return True
+
+
+class UpdateStockSchema(BaseModel):
+    """
+    Update stock schema model class for pydantic validation and serialization
+    """
+    stock: Optional[int] = Form(None, description="Stock of the product, empty to stop tracking the stock")
+    stripes: int = Form(0, description="Number of counter rows to split the stock across for hot products")
+
+    @field_validator('stock')
+    def validate_stock(cls, value: Optional[int]):
+        if value is not None and value < 0:
+            raise ValueError('Stock must be greater than or equal to 0')
+        return value
+
+    @field_validator('stripes')
+    def validate_stripes(cls, value: int):
+        if value < 0 or value > 64:
+            raise ValueError('Stripes must be between 0 and 64')
+        return value
+
+    def validate(self) -> bool:
+        """
+        Validate the input data.
+
+        Returns:
+            True if the data is valid, False otherwise.
+        """
+        try:
+            self.validate_stock(self.stock)
+            self.validate_stripes(self.stripes)
+        except ValueError:
+            return False
+        return True
@@ -1,7 +1,9 @@
-from .password_manager import PasswordManager
+from .cache import TTLCache
+from .password_manager import PasswordManager, PasswordPoolFull, password_pool
+from .rate_limiter import RateLimiter
 
-__all__ = ['PasswordManager']
+__all__ = ['PasswordManager', 'PasswordPoolFull', 'RateLimiter', 'TTLCache', 'password_pool']
 
 __doc__ = """
     Module to utils functions
-"""
\ No newline at end of file
+"""
@@ -0,0 +1,99 @@
+"""
+In-memory TTL cache with least recently used eviction.
+
+Entries expire ttl seconds after they were set and are dropped lazily on
+access; when the cache is full the least recently used entry is dropped.
+The cache is per process. Caches of shared data, like the admin and product
+caches, are registered with middleware.apps.invalidation.bus, which evicts
+a changed key in every worker once the change is committed; ttl bounds how
+long a change missed by the bus is served. A cache that is not registered
+is only invalidated in the worker that calls pop().
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+__all__ = [
+    'TTLCache',
+]
+
+
+class TTLCache:
+    """
+    Bounded mapping whose entries expire after ttl seconds.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10_000) -> None:
+        """
+        Initialize the cache.
+        @params ttl: seconds an entry is served after it was set.
+        @params max_size: number of entries kept, least recently used entries are dropped.
+        @return: None
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Get a value.
+        @params key: key of the value.
+        @params default: value returned for missing and expired keys.
+        @return: cached value or default.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        Set a value.
+        @params key: key of the value.
+        @params value: value.
+        @params ttl: seconds the value is served, the ttl of the cache if None.
+        @return: None
+        """
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Invalidate a key.
+        @params key: key of the value.
+        @params default: value returned for missing keys.
+        @return: removed value or default.
+        """
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Get counters of the cache.
+        @return: dict with hits, misses and the number of entries.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+        }
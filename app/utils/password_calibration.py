@@ -0,0 +1,52 @@
+"""
+Calibration of the password hashing cost.
+
+    python -m utils.password_calibration --target-ms 250
+
+prints the PASSWORD_HASH_ROUNDS of a hash taking about target-ms on this
+machine, add it to .env of every server with the same hardware.
+"""
+import argparse
+import time
+
+from utils.password_manager import make_context
+
+__all__ = [
+    'calibrate',
+]
+
+
+def calibrate(target_ms: float, samples: int = 5) -> int:
+    """
+    Find the pbkdf2_sha256 rounds of a hash taking target_ms on this machine.
+    pbkdf2 time is linear in the rounds, so it is measured at a probe cost and scaled.
+    @params target_ms: wanted time of one hash.
+    @params samples: hashes measured per cost, the median is used.
+    @return: rounds.
+    """
+    def measure(rounds: int) -> float:
+        context = make_context(rounds)
+        times = []
+        for _ in range(samples):
+            started = time.perf_counter()
+            context.hash("calibration-password")
+            times.append(time.perf_counter() - started)
+        return sorted(times)[len(times) // 2] * 1000
+
+    probe = 10_000
+    rounds = max(1000, int(probe * target_ms / measure(probe)))
+    # Second pass corrects the fixed overhead of a hash
+    return max(1000, int(rounds * target_ms / measure(rounds)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find PASSWORD_HASH_ROUNDS for a target hash latency")
+    parser.add_argument('--target-ms', type=float, default=250.0)
+    parser.add_argument('--samples', type=int, default=5)
+    args = parser.parse_args()
+
+    rounds = calibrate(args.target_ms, args.samples)
+    started = time.perf_counter()
+    make_context(rounds).hash("calibration-password")
+    print(f"pbkdf2_sha256 with {rounds} rounds takes {(time.perf_counter() - started) * 1000:.1f} ms")
+    print(f"PASSWORD_HASH_ROUNDS={rounds}")
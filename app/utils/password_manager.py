@@ -1,13 +1,202 @@
+"""
+Password hashing.
+
+pbkdf2_sha256 costs tens of milliseconds of CPU per hash, so the async code
+hashes and verifies in a process pool (password_pool) and never blocks the
+event loop. The pool takes at most PASSWORD_POOL_QUEUE operations at a time,
+further ones are rejected with PasswordPoolFull instead of queueing logins
+behind each other. Timings of every operation are counted in stats().
+
+The cost is PASSWORD_HASH_ROUNDS of the environment (passlib's default if
+unset), pick it for the hardware with
+
+    python -m utils.password_calibration --target-ms 250
+
+Hashes keep their own rounds, so changing the cost never breaks existing passwords.
+"""
+import asyncio
+import multiprocessing
 import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
 from passlib.context import CryptContext
 
 __all__ = [
     'PasswordManager',
+    'PasswordPool',
+    'PasswordPoolFull',
+    'password_pool',
 ]
 
+# Processes hashing passwords
+PASSWORD_POOL_WORKERS = min(4, os.cpu_count() or 1)
+
+# Operations running or waiting in the pool before new ones are rejected
+PASSWORD_POOL_QUEUE = 64
+
+
+def hash_rounds() -> Optional[int]:
+    """
+    Get the pbkdf2_sha256 rounds of the environment.
+    @return: PASSWORD_HASH_ROUNDS or None for passlib's default.
+    """
+    rounds = os.environ.get('PASSWORD_HASH_ROUNDS')
+    return int(rounds) if rounds else None
+
+
+def make_context(rounds: Optional[int] = None) -> CryptContext:
+    """
+    Create the passlib context.
+    @params rounds: pbkdf2_sha256 rounds of new hashes, passlib's default if None.
+    @return: CryptContext object.
+    """
+    if rounds:
+        return CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto", pbkdf2_sha256__rounds=rounds)
+    return CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
+
+# Context of a pool process, created by its initializer
+_worker_context: Optional[CryptContext] = None
+
+
+def _init_worker(rounds: Optional[int]) -> None:
+    global _worker_context
+    _worker_context = make_context(rounds)
+
+
+def _hash(pwd: str) -> Tuple[str, float]:
+    started = time.perf_counter()
+    hashed = _worker_context.hash(pwd)
+    return hashed, time.perf_counter() - started
+
+
+def _verify(hashed_password: str, plain_password: str) -> Tuple[bool, float]:
+    started = time.perf_counter()
+    valid = _worker_context.verify(plain_password, hashed_password)
+    return valid, time.perf_counter() - started
+
+
+class PasswordPoolFull(RuntimeError):
+    """
+    Raised when the password pool already has PASSWORD_POOL_QUEUE operations.
+    """
+
+
+class PasswordPool:
+    """
+    Process pool for password hashing with a bounded queue and per-operation timings.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_POOL_WORKERS,
+        max_pending: int = PASSWORD_POOL_QUEUE
+    ) -> None:
+        """
+        Initialize the pool, processes are started on first use.
+        @params workers: number of processes.
+        @params max_pending: operations running or waiting before new ones are rejected.
+        @return: None
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+        # operation -> count, seconds in the process, seconds including the wait, slowest call
+        self._timings: Dict[str, Dict[str, float]] = {
+            operation: {'count': 0, 'cpu_seconds': 0.0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+            for operation in ('hash', 'verify')
+        }
+
+    def start(self) -> None:
+        """
+        Create the process pool. Processes are spawned, not forked, so they never
+        inherit the event loop or open connections.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(hash_rounds(),)
+            )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, operation: str, function: Callable, *args) -> object:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordPoolFull(f"Password pool is full ({self.pending} operations)")
+        self.start()
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            result, cpu_seconds = await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        finally:
+            self.pending -= 1
+        total_seconds = time.perf_counter() - started
+
+        timings = self._timings[operation]
+        timings['count'] += 1
+        timings['cpu_seconds'] += cpu_seconds
+        timings['total_seconds'] += total_seconds
+        timings['max_seconds'] = max(timings['max_seconds'], total_seconds)
+        return result
+
+    async def hash(self, pwd: str) -> str:
+        """
+        Hash a password in the pool.
+        @params pwd: plain password.
+        @return: hash of the password.
+        @raise: PasswordPoolFull if the pool has no room.
+        """
+        return await self._run('hash', _hash, pwd)
+
+    async def verify(self, hashed_password: str, plain_password: str) -> bool:
+        """
+        Verify a password in the pool.
+        @params hashed_password: stored hash.
+        @params plain_password: plain password.
+        @return: True if the password matches the hash.
+        @raise: PasswordPoolFull if the pool has no room.
+        """
+        return await self._run('verify', _verify, hashed_password, plain_password)
+
+    def stats(self) -> dict:
+        """
+        Get timings of the pool.
+        @return: dict with pending and rejected operations and, per operation, the count and
+                 the average time in the process, the average time including the wait and the slowest call in ms.
+        """
+        operations = {}
+        for operation, timings in self._timings.items():
+            count = timings['count'] or 1
+            operations[operation] = {
+                'count': int(timings['count']),
+                'avg_cpu_ms': round(timings['cpu_seconds'] / count * 1000, 3),
+                'avg_total_ms': round(timings['total_seconds'] / count * 1000, 3),
+                'max_total_ms': round(timings['max_seconds'] * 1000, 3),
+            }
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'rejected': self.rejected,
+            'operations': operations,
+        }
+
+
+password_pool = PasswordPool()
+
 
 class PasswordManager:
-    pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+    pwd_context = make_context(hash_rounds())
 
     def __init__(self) -> None:
         self.secret_key = os.urandom(32)
@@ -18,15 +207,12 @@ class PasswordManager:
     def verify(self, hashed_password: str, plain_password: str) -> bool:
         return self.pwd_context.verify(plain_password, hashed_password)
 
+    async def hash_async(self, pwd: str) -> str:
+        return await password_pool.hash(pwd)
+
+    async def verify_async(self, hashed_password: str, plain_password: str) -> bool:
+        return await password_pool.verify(hashed_password, plain_password)
 
     def is_hashed(self, password: str) -> bool:
         # Passlib's identify method will return None if it cannot identify the hash scheme
         return self.pwd_context.identify(password) is not None
-    
-if __name__ == "__main__":
-    pwds = "password"
-    pwd = PasswordManager()
-    hashed_pwd = pwd.hash(pwds)
-    print(hashed_pwd)
-    print(pwd.verify(hashed_pwd, pwds))
-    print(pwd.verify(hashed_pwd, "wrong_password"))
@@ -0,0 +1,154 @@
+"""
+In-memory token bucket rate limiter used as a route dependency.
+
+Every route gets its own RateLimiter with limits per key kind: "ip" is the
+client address, any other kind is the value of the request field of that
+name (query parameter or form field), e.g.
+
+    feedback_rate_limiter = RateLimiter("feedback", {"ip": (10, 5), "email": (2, 3)})
+
+    @router.post('/', dependencies=[Depends(feedback_rate_limiter)])
+
+Route dependencies are resolved before the endpoint parameters, so rejected
+requests are answered with 429 and Retry-After before any validation or
+database work.
+"""
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+__all__ = [
+    'TokenBucket',
+    'RateLimiter',
+]
+
+
+class TokenBucket:
+    """
+    Token bucket of one key. Tokens are refilled lazily on access.
+    """
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, burst: int, now: float) -> None:
+        self.tokens = float(burst)
+        self.updated_at = now
+
+    def refill(self, rate: float, burst: int, now: float) -> None:
+        self.tokens = min(float(burst), self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter keyed by client IP and request fields.
+    A request is let through only if every bucket of its keys has a token, then one
+    token is taken from each of them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limits: Dict[str, Tuple[float, int]],
+        max_keys: int = 100_000
+    ) -> None:
+        """
+        Initialize the rate limiter.
+        @params name: name of the limiter in stats.
+        @params limits: key kind -> (requests per minute, burst).
+        @params max_keys: number of buckets kept per key kind, least recently used buckets are dropped.
+        @return: None
+        """
+        self.name = name
+        self.limits = {kind: (per_minute / 60.0, burst) for kind, (per_minute, burst) in limits.items()}
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.rejected_total = 0
+        # Rejections per key kind, a request over several limits is counted for each of them
+        self.rejected: Dict[str, int] = {kind: 0 for kind in limits}
+        self._buckets: Dict[str, 'OrderedDict[str, TokenBucket]'] = {kind: OrderedDict() for kind in limits}
+
+    def _bucket(self, kind: str, key: str, now: float) -> TokenBucket:
+        rate, burst = self.limits[kind]
+        buckets = self._buckets[kind]
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(burst, now)
+            if len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+            bucket.refill(rate, burst, now)
+        return bucket
+
+    def hit(self, keys: Dict[str, str]) -> float:
+        """
+        Take a token for the keys of a request.
+        @params keys: key kind -> key, kinds without a key are not limited.
+        @return: 0 if the request is allowed, otherwise seconds until it would be allowed.
+        """
+        now = time.monotonic()
+        buckets: List[Tuple[str, TokenBucket]] = [
+            (kind, self._bucket(kind, key, now))
+            for kind, key in keys.items()
+            if key and kind in self.limits
+        ]
+
+        retry_after = 0.0
+        for kind, bucket in buckets:
+            if bucket.tokens < 1.0:
+                rate, _ = self.limits[kind]
+                wait = (1.0 - bucket.tokens) / rate
+                if wait > retry_after:
+                    retry_after = wait
+                self.rejected[kind] += 1
+        if retry_after:
+            self.rejected_total += 1
+            return retry_after
+
+        for _, bucket in buckets:
+            bucket.tokens -= 1.0
+        self.allowed += 1
+        return 0.0
+
+    async def _keys(self, request: Request) -> Dict[str, Optional[str]]:
+        keys = {}
+        for kind in self.limits:
+            if kind == 'ip':
+                keys[kind] = request.client.host if request.client else None
+                continue
+            value = request.query_params.get(kind)
+            if value is None and request.headers.get('content-type', '').startswith(
+                ('application/x-www-form-urlencoded', 'multipart/form-data')
+            ):
+                value = (await request.form()).get(kind)
+            keys[kind] = str(value).strip().lower() if value else None
+        return keys
+
+    async def __call__(self, request: Request) -> None:
+        """
+        Route dependency.
+        @raise: HTTPException 429 with Retry-After if the request is over the limit.
+        """
+        retry_after = self.hit(await self._keys(request))
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={'Retry-After': str(math.ceil(retry_after))}
+            )
+
+    def stats(self) -> dict:
+        """
+        Get counters of the limiter.
+        @return: dict with allowed and rejected requests and the number of tracked keys.
+        """
+        return {
+            'name': self.name,
+            'allowed': self.allowed,
+            'rejected': dict(self.rejected),
+            'rejected_total': self.rejected_total,
+            'tracked_keys': {kind: len(buckets) for kind, buckets in self._buckets.items()},
+        }